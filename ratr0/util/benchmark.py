@@ -0,0 +1,238 @@
+"""
+benchmark.py - benchmarks of the conversion hot paths
+
+The benchmarks run the conversions on synthetic indexed images, which are
+generated from a fixed seed, so every run converts the same data. Each
+benchmark is run for every combination of image size and depth it
+supports and the best time of a number of repetitions is kept, setting up
+the input is not timed.
+
+The results are stored as JSON:
+
+{
+  "format": 1,
+  "platform": "...", "python": "3.11.4", "numpy": "1.26.0",
+  "results": {
+    "tiles.write_tile_file/interleaved/320x256/d5": {
+      "benchmark": "tiles.write_tile_file", "variant": "interleaved",
+      "width": 320, "height": 256, "depth": 5, "seconds": 0.0012
+    },
+    ...
+  }
+}
+
+and can be compared against a baseline from an earlier run on the same
+machine: a result is a regression if it takes more than 1 + tolerance
+times the baseline and at least MIN_DIFFERENCE seconds longer, the latter
+keeps the noise of very short runs out of the report.
+"""
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from ratr0.util import png_util, tiles, sprites, levels, compile_clist
+
+FORMAT_VERSION = 1
+SIZES = [(320, 256), (640, 512), (1024, 1024), (2048, 2048), (4096, 4096)]
+DEPTHS = list(range(1, 9))
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.2
+MIN_DIFFERENCE = 0.001
+SEED = 0x7a770
+TILE_SIZE = (16, 16)
+SPRITE_FRAME_HEIGHT = 16
+MAX_SPRITE_DEPTH = 4
+
+
+def synthetic_image(width, height, depth, seed=SEED):
+    """an indexed image of random pixels with 2^depth gray colors, the same
+    for the same parameters"""
+    rng = np.random.default_rng([seed, width, height, depth])
+    pixels = rng.integers(0, 1 << depth, size=(height, width), dtype=np.uint8)
+    im = Image.fromarray(pixels, mode='P')
+    im.putpalette(synthetic_colors(depth), rawmode='RGB')
+    return im
+
+
+def synthetic_colors(depth):
+    """the flat RGB palette of synthetic_image()"""
+    num_colors = 1 << depth
+    return [component for i in range(num_colors) for component in [i * 255 // (num_colors - 1)] * 3]
+
+
+def synthetic_level(width, height, seed=SEED):
+    """a level of random tile numbers that covers an image of the size
+    with tiles of TILE_SIZE"""
+    columns, rows = width // TILE_SIZE[0], height // TILE_SIZE[1]
+    rng = np.random.default_rng([seed, width, height])
+    return {"name": "benchmark", "width": columns, "height": rows,
+            "map": rng.integers(1, 256, size=columns * rows).tolist()}
+
+
+def synthetic_clist(num_lines):
+    """the source of a copper list that changes the background color in
+    num_lines lines"""
+    lines = []
+    for line in range(num_lines):
+        lines.append("WAIT 0,%d" % (line & 0xff))
+        lines.append("MOVE COLOR00,0x%03x" % (line & 0xfff))
+    lines.append("END")
+    return '\n'.join(lines) + '\n'
+
+
+# the benchmarks: name -> (variants, uses the depth, setup function), the
+# setup function gets the variant, the size, the depth and a directory for
+# the output files and returns the function to time or None if the
+# benchmark does not support the parameters
+
+
+def setup_extract_planes(variant, width, height, depth, outdir):
+    im = synthetic_image(width, height, depth)
+    return lambda: png_util.extract_planes(im, depth, False)
+
+
+def setup_interleave_planes(variant, width, height, depth, outdir):
+    planes, map_words_per_row = png_util.extract_planes(synthetic_image(width, height, depth),
+                                                        depth, False)
+    return lambda: png_util.interleave_planes(planes, map_words_per_row)
+
+
+def setup_write_tile_file(variant, width, height, depth, outdir):
+    im = synthetic_image(width, height, depth)
+    colors = png_util.make_colors(im, depth, False)
+    image = png_util.extract_planar_image(im, depth, False)
+    outfile = os.path.join(outdir, 'tiles.ts')
+    non_interleaved = variant == 'non_interleaved'
+    create_mask = variant == 'mask'
+    return lambda: tiles.write_tile_file(outfile, im, TILE_SIZE, image, colors,
+                                         image.words_per_row, False, non_interleaved,
+                                         create_mask, False)
+
+
+def setup_write_sprites(variant, width, height, depth, outdir):
+    if depth > MAX_SPRITE_DEPTH:
+        return None
+    generatec = variant == 'c'
+    if not generatec:
+        # the offsets of the binary format are 16 bit
+        pairs = 2 if depth > 2 else 1
+        num_sprites = (width // 16) * (height // SPRITE_FRAME_HEIGHT) * pairs
+        if (num_sprites - 1) * (SPRITE_FRAME_HEIGHT + 2) * 4 > 0xffff:
+            return None
+    im = synthetic_image(width, height, depth)
+    outfile = os.path.join(outdir, 'sprites.c' if generatec else 'sprites.spr')
+    return lambda: sprites.write_sprites(im, outfile, False, generatec, SPRITE_FRAME_HEIGHT)
+
+
+def setup_write_level(variant, width, height, depth, outdir):
+    level = synthetic_level(width, height)
+    outfile = os.path.join(outdir, 'level.lvl')
+    return lambda: levels.write_level(level, outfile, False)
+
+
+def setup_compile_clist(variant, width, height, depth, outdir):
+    inpath = os.path.join(outdir, 'clist.txt')
+    with open(inpath, 'w') as out:
+        out.write(synthetic_clist(height))
+    return lambda: compile_clist.compile_clist(inpath)
+
+
+BENCHMARKS = {
+    'png_util.extract_planes': (['default'], True, setup_extract_planes),
+    'png_util.interleave_planes': (['default'], True, setup_interleave_planes),
+    'tiles.write_tile_file': (['interleaved', 'non_interleaved', 'mask'], True,
+                              setup_write_tile_file),
+    'sprites.write_sprites': (['binary', 'c'], True, setup_write_sprites),
+    'levels.write_level': (['default'], False, setup_write_level),
+    'compile_clist.compile_clist': (['default'], False, setup_compile_clist),
+}
+
+
+def result_key(name, variant, width, height, depth):
+    key = "%s/%s/%dx%d" % (name, variant, width, height)
+    return key if depth is None else key + "/d%d" % depth
+
+
+def best_time(func, repeat):
+    """the shortest of repeat runs of func in seconds"""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(names=None, sizes=SIZES, depths=DEPTHS, repeat=DEFAULT_REPEAT, progress=None):
+    """Runs the benchmarks in names (default: all) and returns the results
+    document. progress is called with the key and the seconds of each result"""
+    results = {}
+    with tempfile.TemporaryDirectory() as outdir:
+        for name in names or list(BENCHMARKS):
+            if name not in BENCHMARKS:
+                raise Exception("unknown benchmark '%s', must be one of %s" %
+                                (name, ", ".join(BENCHMARKS)))
+            variants, uses_depth, setup = BENCHMARKS[name]
+            for variant in variants:
+                for width, height in sizes:
+                    for depth in (depths if uses_depth else [None]):
+                        func = setup(variant, width, height, depth, outdir)
+                        if func is None:
+                            continue
+                        key = result_key(name, variant, width, height, depth)
+                        seconds = best_time(func, repeat)
+                        results[key] = {'benchmark': name, 'variant': variant, 'width': width,
+                                        'height': height, 'depth': depth, 'seconds': seconds}
+                        if progress is not None:
+                            progress(key, seconds)
+    return {'format': FORMAT_VERSION, 'platform': platform.platform(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'results': results}
+
+
+def read_results(path):
+    with open(path) as infile:
+        document = json.load(infile)
+    if document.get('format') != FORMAT_VERSION:
+        raise Exception("'%s' is not a benchmark result file of format %d" % (path, FORMAT_VERSION))
+    return document
+
+
+def write_results(document, path):
+    with open(path, 'w') as out:
+        json.dump(document, out, indent=2, sort_keys=True)
+        out.write('\n')
+
+
+def compare(document, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares the results with those of the baseline, returns a list of
+    (key, baseline seconds, seconds, ratio, regression) for the results
+    that are in both, sorted by the ratio, the slowest first"""
+    comparison = []
+    for key, result in document['results'].items():
+        if key not in baseline['results']:
+            continue
+        before = baseline['results'][key]['seconds']
+        seconds = result['seconds']
+        ratio = seconds / before if before > 0 else float('inf')
+        regression = ratio > 1 + tolerance and seconds - before >= MIN_DIFFERENCE
+        comparison.append((key, before, seconds, ratio, regression))
+    comparison.sort(key=lambda entry: -entry[3])
+    return comparison
+
+
+def comparison_report(comparison):
+    """the lines of the comparison report"""
+    lines = ["%-56s %10s %10s %7s" % ("benchmark", "baseline s", "current s", "ratio")]
+    for key, before, seconds, ratio, regression in comparison:
+        lines.append("%-56s %10.4f %10.4f %7.2f%s" % (key, before, seconds, ratio,
+                                                     "  REGRESSION" if regression else ""))
+    num_regressions = len([entry for entry in comparison if entry[4]])
+    lines.append("%d results compared, %d regressions" % (len(comparison), num_regressions))
+    return lines
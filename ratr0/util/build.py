@@ -0,0 +1,271 @@
+"""
+build.py - manifest driven batch conversion
+
+A build manifest lists all assets of a game together with the options that
+would otherwise be passed to the individual conversion tools. All assets are
+converted in a single run on a pool of worker processes, so the interpreter
+and PIL are only started once per worker instead of once per asset.
+
+The manifest is a JSON or TOML file with a list of assets:
+
+{
+  "assets": [
+    {"type": "tiles", "input": "gfx/tiles.png", "output": "data/tiles.ts",
+     "tile_size": "16x16", "create_mask": true},
+    {"type": "sprites", "input": "gfx/player.png", "output": "data/player.spr"},
+    {"type": "level", "input": "levels/level1.json", "output": "data/level1.lvl"},
+    {"type": "tiled", "tiles": "tiled/tiles.json", "level": "tiled/level1.json",
+     "tiles_output": "data/tiles1.ts", "level_output": "data/level1.lvl"},
+    {"type": "copper", "input": "copper/main.txt", "output": "src/main_copper.c",
+     "listname": "main_copper"}
+  ]
+}
+
+Relative paths are relative to the directory of the manifest. The options
+have the names of the long command line options of the respective tool.
+"""
+import concurrent.futures
+import json
+import math
+import os
+import time
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+from ratr0.util import tiles, sprites, levels, tiled, png_util, compile_clist, cache, compress, quantize
+from ratr0.util import optimize_clist, coplist, profiling
+
+
+# asset type -> (path keys, option keys with their default values)
+ASSET_TYPES = {
+    "tiles": (["input", "output"],
+              {"tile_size": None, "non_interleaved": False, "palette24": False,
+               "force_depth": None, "create_mask": False, "mask_file": None,
+               "level_file": None, "codec": "none", "dither": "none", "crop": False,
+               "shifts": 1}),
+    "sprites": (["input", "output"], {"generatec": False, "dither": "none", "depth": 2,
+                                      "frame_height": None}),
+    "level": (["input", "output"], {"codec": "none", "strip_width": None}),
+    "tiled": (["tiles", "level", "tiles_output", "level_output"],
+              {"non_interleaved": False, "palette24": False, "force_depth": None}),
+    "copper": (["input", "output"], {"listname": "default_copper", "optimize": False,
+                                     "binary": False})
+}
+INPUT_KEYS = ["input", "tiles", "level"]
+PATH_OPTIONS = ["mask_file", "level_file"]
+
+
+class BuildError(Exception):
+    pass
+
+
+def load_manifest(path):
+    """reads the manifest and returns the list of validated assets with
+    absolute paths and all options filled in"""
+    if path.endswith('.toml') and tomllib is None:
+        raise BuildError("TOML manifests require Python 3.11 or newer, use JSON instead")
+    try:
+        if path.endswith('.toml'):
+            with open(path, 'rb') as infile:
+                manifest = tomllib.load(infile)
+        else:
+            with open(path) as infile:
+                manifest = json.load(infile)
+    except OSError as e:
+        raise BuildError("%s: can not read the manifest: %s" % (path, e.strerror))
+    except ValueError as e:
+        # json.JSONDecodeError and tomllib.TOMLDecodeError
+        raise BuildError("%s: invalid manifest: %s" % (path, e))
+
+    if (not isinstance(manifest, dict) or 'assets' not in manifest or
+            not isinstance(manifest['assets'], list)):
+        raise BuildError("%s: manifest needs an 'assets' list" % path)
+    basedir = os.path.dirname(os.path.abspath(path))
+    return [validate_asset(asset, i, basedir) for i, asset in enumerate(manifest['assets'])]
+
+
+def validate_asset(asset, index, basedir):
+    if not isinstance(asset, dict):
+        raise BuildError("asset %d: must be an object" % index)
+    asset_type = asset.get('type')
+    if asset_type not in ASSET_TYPES:
+        raise BuildError("asset %d: unknown type '%s', must be one of %s" %
+                         (index, asset_type, ", ".join(sorted(ASSET_TYPES))))
+    path_keys, defaults = ASSET_TYPES[asset_type]
+    unknown = set(asset) - set(path_keys) - set(defaults) - {'type', 'name'}
+    if len(unknown) > 0:
+        raise BuildError("asset %d (%s): unknown option(s) %s" %
+                         (index, asset_type, ", ".join(sorted(unknown))))
+    missing = [key for key in path_keys if key not in asset]
+    if len(missing) > 0:
+        raise BuildError("asset %d (%s): missing %s" % (index, asset_type, ", ".join(missing)))
+
+    result = dict(defaults)
+    result.update(asset)
+    for key in path_keys + PATH_OPTIONS:
+        if result.get(key) is not None:
+            result[key] = os.path.join(basedir, result[key])
+    if 'name' not in result:
+        result['name'] = os.path.relpath(result[path_keys[0]], basedir)
+    for key in INPUT_KEYS:
+        if key in path_keys and not os.path.exists(result[key]):
+            raise BuildError("%s (%s): input file '%s' does not exist" %
+                             (result['name'], asset_type, result[key]))
+    return result
+
+
+def codec_id(asset):
+    if asset['codec'] not in compress.CODECS:
+        raise BuildError("unknown codec '%s'" % asset['codec'])
+    return compress.CODECS[asset['codec']]
+
+
+def convert_tiles(asset, verbose, conversion_cache):
+    im = quantize.to_indexed(png_util.open_image(asset['input']), asset['force_depth'], asset['dither'], verbose)
+    codec = codec_id(asset)
+    if asset['tile_size'] is not None:
+        tile_size = tuple(map(int, asset['tile_size'].split('x')))
+    else:
+        tile_size = im.size
+    colors = png_util.make_colors(im, asset['force_depth'], verbose)
+    if asset['level_file'] is not None:
+        if asset['tile_size'] is None:
+            raise BuildError("level_file requires tile_size")
+        if asset['shifts'] > 1:
+            raise BuildError("level_file can not be combined with shifts")
+        write_ripped_tiles = tiles.write_ripped_tiles
+        if conversion_cache is not None:
+            write_ripped_tiles = conversion_cache.write_ripped_tiles
+        write_ripped_tiles(im, asset['output'], asset['level_file'], tile_size, colors,
+                           palette24=asset['palette24'],
+                           non_interleaved=asset['non_interleaved'],
+                           create_mask=asset['create_mask'],
+                           verbose=verbose, codec=codec, crop=asset['crop'])
+    else:
+        write_tiles = tiles.write_tiles if conversion_cache is None else conversion_cache.write_tiles
+        write_tiles(im, asset['output'], tile_size, colors,
+                    palette24=asset['palette24'],
+                    non_interleaved=asset['non_interleaved'],
+                    create_mask=asset['create_mask'],
+                    verbose=verbose, codec=codec, crop=asset['crop'],
+                    shifts=asset['shifts'])
+    if asset['mask_file'] is not None:
+        depth = int(math.log2(len(colors)))
+        tiles.write_mask(asset['mask_file'], im, tile_size, depth,
+                         palette24=asset['palette24'],
+                         non_interleaved=asset['non_interleaved'],
+                         verbose=verbose)
+
+
+def convert_sprites(asset, verbose, conversion_cache):
+    im = quantize.to_indexed(png_util.open_image(asset['input']), asset['depth'], asset['dither'], verbose,
+                             reserve_color0=True)
+    write_sprites = sprites.write_sprites if conversion_cache is None else conversion_cache.write_sprites
+    write_sprites(im, asset['output'], verbose=verbose, generatec=asset['generatec'],
+                  frame_height=asset['frame_height'])
+
+
+def convert_level(asset, verbose, conversion_cache):
+    write_level = levels.write_level if conversion_cache is None else conversion_cache.write_level
+    codec = codec_id(asset)
+    with open(asset['input']) as infile:
+        write_level(json.load(infile), asset['output'], verbose,
+                    codec=codec, strip_width=asset['strip_width'])
+
+
+def convert_tiled(asset, verbose, conversion_cache):
+    with open(asset['tiles']) as infile:
+        tiled.convert_tiles(json.load(infile), os.path.dirname(asset['tiles']),
+                            asset['tiles_output'], asset['non_interleaved'],
+                            asset['palette24'], asset['force_depth'], verbose)
+    with open(asset['level']) as infile:
+        tiled.convert_level(json.load(infile), asset['level_output'], verbose)
+
+
+def convert_copper(asset, verbose, conversion_cache):
+    if conversion_cache is not None:
+        result, indexes = conversion_cache.compile_clist(asset['input'])
+    else:
+        result, indexes = compile_clist.compile_clist(asset['input'])
+    if asset['optimize']:
+        result, indexes, warnings = optimize_clist.optimize_clist(result, indexes)
+        if verbose:
+            for warning in warnings:
+                print("%s: %s" % (asset['name'], warning))
+    if asset['binary']:
+        coplist.write_coplist(result, indexes, asset['output'], verbose)
+    else:
+        compile_clist.write_clist(result, indexes, asset['output'],
+                                  clist_name=asset['listname'])
+
+
+CONVERTERS = {
+    "tiles": convert_tiles,
+    "sprites": convert_sprites,
+    "level": convert_level,
+    "tiled": convert_tiled,
+    "copper": convert_copper
+}
+
+
+def convert_asset(asset, verbose=False, cache_dir=None, cache_size=cache.DEFAULT_MAX_SIZE):
+    """converts a single asset and returns the time it took in seconds,
+    this is run in the worker processes"""
+    start_time = time.perf_counter()
+    try:
+        conversion_cache = None
+        if cache_dir is not None:
+            conversion_cache = cache.ConversionCache(cache_dir, cache_size, verbose)
+        CONVERTERS[asset['type']](asset, verbose, conversion_cache)
+    except Exception as e:
+        raise BuildError("%s (%s): %s" % (asset['name'], asset['type'], e)) from e
+    return time.perf_counter() - start_time
+
+
+def profile_asset(asset, verbose=False, cache_dir=None, cache_size=cache.DEFAULT_MAX_SIZE):
+    """converts a single asset with profiling enabled in the worker process,
+    returns the time it took in seconds and the profile records of its stages"""
+    profiler = profiling.enable(asset=asset['name'], type=asset['type'])
+    try:
+        with profiler.stage('asset'):
+            seconds = convert_asset(asset, verbose, cache_dir, cache_size)
+    finally:
+        profiling.disable()
+    return seconds, profiler.records
+
+
+def build(assets, jobs=None, verbose=False, cache_dir=None, cache_size=cache.DEFAULT_MAX_SIZE,
+          profiler=None):
+    """converts all assets on a pool of jobs processes (default: number of
+    cores) and returns a list of (asset, seconds) in completion order.
+    The build stops at the first failing asset and raises a BuildError.
+    If cache_dir is set, unchanged assets are taken from the conversion cache.
+    If profiler is set, the assets are profiled and the records of their
+    stages are added to it"""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(assets)))
+    timings = []
+    worker = convert_asset if profiler is None else profile_asset
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(worker, asset, verbose, cache_dir, cache_size): asset
+                   for asset in assets}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                # result() raises the BuildError of a failed asset
+                asset = futures[future]
+                if profiler is None:
+                    timings.append((asset, future.result()))
+                else:
+                    seconds, records = future.result()
+                    timings.append((asset, seconds))
+                    profiler.add_records(records)
+                print("%8.3f s  %-8s %s" % (timings[-1][1], asset['type'], asset['name']))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return timings
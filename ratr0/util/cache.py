@@ -0,0 +1,182 @@
+"""
+cache.py - content addressed conversion cache
+
+The result of a conversion only depends on its input data, the options and
+the version of the tools. The cache computes a key from these, stores the
+output files of a conversion under this key and copies them back the next
+time the same conversion is requested, so an unchanged asset costs one hash
+and one file copy.
+
+The cache directory is bounded in size. When it grows beyond the limit, the
+least recently used entries are removed.
+"""
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import tempfile
+
+from ratr0.util import tiles, sprites, levels, compile_clist, compress, profiling
+
+try:
+    TOOL_VERSION = importlib.metadata.version('ratr0_utils')
+except importlib.metadata.PackageNotFoundError:
+    TOOL_VERSION = 'dev'
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def image_bytes(im):
+    """the bytes that identify an image: the contents of the file it was
+    opened from, which avoids decoding it, or otherwise its pixels and palette"""
+    filename = getattr(im, 'filename', None)
+    if filename:
+        with open(filename, 'rb') as infile:
+            return infile.read()
+    palette = im.palette.tobytes() if im.palette is not None else b''
+    return ('%s %dx%d' % (im.mode, im.width, im.height)).encode() + palette + im.tobytes()
+
+
+class ConversionCache:
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE, verbose=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.verbose = verbose
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, kind, inputs, options):
+        """the cache key of a conversion of kind on the inputs (a list of
+        bytes objects) with the options (a JSON compatible dictionary)"""
+        digest = hashlib.sha256()
+        digest.update(('%s\0%s\0' % (kind, TOOL_VERSION)).encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        for data in inputs:
+            digest.update(b'\0%d\0' % len(data))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, outfiles):
+        """copies the cached outputs to outfiles, returns False on a cache miss"""
+        entry = self.entry_path(key)
+        try:
+            for i, outfile in enumerate(outfiles):
+                shutil.copyfile(os.path.join(entry, str(i)), outfile)
+            # the modification time of an entry is its last use
+            os.utime(entry)
+        except OSError:
+            return False
+        return True
+
+    def store(self, key, outfiles):
+        entry = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(dir=self.cache_dir, prefix='tmp')
+        for i, outfile in enumerate(outfiles):
+            shutil.copyfile(outfile, os.path.join(tmpdir, str(i)))
+        try:
+            os.rename(tmpdir, entry)
+        except OSError:
+            # another process stored the same entry in the meantime
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """returns a list of (last use, size, path) of all cache entries"""
+        result = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                try:
+                    size = sum([entry_file.stat().st_size for entry_file in os.scandir(entry)])
+                    result.append((os.stat(entry).st_mtime, size, entry))
+                except OSError:
+                    pass  # removed by another process
+        return result
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits into max_size"""
+        entries = sorted(self.entries())
+        total_size = sum([size for _, size, _ in entries])
+        for _, size, entry in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+    def cached(self, kind, inputs, options, outfiles, convert):
+        """runs convert() to create the outfiles unless the result of the same
+        conversion is in the cache"""
+        with profiling.stage('cache_lookup'):
+            key = self.key(kind, inputs, options)
+            hit = self.fetch(key, outfiles)
+        if hit:
+            if self.verbose:
+                print("cache hit: %s" % ', '.join(outfiles))
+            return
+        convert()
+        with profiling.stage('cache_store'):
+            self.store(key, outfiles)
+
+    def write_tiles(self, im, outfile, tile_size, colors, palette24,
+                    non_interleaved, create_mask, verbose, codec=compress.CODEC_NONE, crop=False,
+                    shifts=1):
+        options = {'tile_size': list(tile_size), 'colors': colors, 'palette24': palette24,
+                   'non_interleaved': non_interleaved, 'create_mask': create_mask,
+                   'codec': codec, 'crop': crop, 'shifts': shifts,
+                   'format': tiles.FILE_FORMAT_VERSION}
+        self.cached('tiles', [image_bytes(im)], options, [outfile],
+                    lambda: tiles.write_tiles(im, outfile, tile_size, colors, palette24,
+                                              non_interleaved, create_mask, verbose, codec, crop,
+                                              shifts))
+
+    def write_ripped_tiles(self, im, outfile, level_outfile, tile_size, colors, palette24,
+                           non_interleaved, create_mask, verbose, codec=compress.CODEC_NONE,
+                           crop=False):
+        options = {'tile_size': list(tile_size), 'colors': colors, 'palette24': palette24,
+                   'non_interleaved': non_interleaved, 'create_mask': create_mask,
+                   'codec': codec, 'crop': crop, 'format': tiles.FILE_FORMAT_VERSION}
+        self.cached('ripped_tiles', [image_bytes(im)], options, [outfile, level_outfile],
+                    lambda: tiles.write_ripped_tiles(im, outfile, level_outfile, tile_size, colors,
+                                                     palette24, non_interleaved, create_mask, verbose,
+                                                     codec, crop))
+
+    def write_sprites(self, im, outpath, verbose, generatec, frame_height=None):
+        options = {'generatec': generatec, 'frame_height': frame_height,
+                   'format': sprites.FILE_FORMAT_VERSION}
+        self.cached('sprites', [image_bytes(im)], options, [outpath],
+                    lambda: sprites.write_sprites(im, outpath, verbose, generatec, frame_height))
+
+    def write_level(self, level, outfile, verbose, codec=compress.CODEC_NONE, strip_width=None):
+        inputs = [json.dumps(level, sort_keys=True).encode()]
+        options = {'codec': codec, 'strip_width': strip_width, 'format': levels.FILE_FORMAT_VERSION}
+        self.cached('level', inputs, options, [outfile],
+                    lambda: levels.write_level(level, outfile, verbose, codec, strip_width))
+
+    def compile_clist(self, inpath):
+        """cached version of compile_clist.compile_clist(), the compiled list
+        and label indexes are stored as JSON"""
+        with open(inpath, 'rb') as infile:
+            key = self.key('copper', [infile.read()], {})
+        entry = self.entry_path(key)
+        try:
+            with open(os.path.join(entry, '0')) as infile:
+                result, indexes = json.load(infile)
+            os.utime(entry)
+            return result, indexes
+        except (OSError, ValueError):
+            pass
+        result, indexes = compile_clist.compile_clist(inpath)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            outfile = os.path.join(tmpdir, 'clist.json')
+            with open(outfile, 'w') as out:
+                json.dump([result, indexes], out)
+            self.store(key, [outfile])
+        return result, indexes
@@ -0,0 +1,68 @@
+"""
+checksum.py - checksums of RATR0 files
+
+The checksum of a file covers all of its bytes, with the checksum field in
+the header taken as 0. Formats with a 16 bit checksum field (RATR0TIL,
+RATR0SPR) store a CRC-16-CCITT, formats with a 32 bit field (RATR0LVL) an
+Adler-32. Both can be computed incrementally: the writers stream their data
+through a ChecksumWriter and patch the checksum field at the end, so the
+data is never traversed twice.
+"""
+import binascii
+import struct
+import zlib
+
+
+class Checksum:
+
+    def __init__(self, bits):
+        if bits not in (16, 32):
+            raise ValueError("unsupported checksum size: %d bits" % bits)
+        self.bits = bits
+        self.value = 0 if bits == 16 else 1
+
+    def update(self, data):
+        if self.bits == 16:
+            self.value = binascii.crc_hqx(data, self.value)
+        else:
+            self.value = zlib.adler32(data, self.value)
+
+    def to_bytes(self):
+        return struct.pack('>H' if self.bits == 16 else '>I', self.value)
+
+
+class ChecksumWriter:
+    """wraps a binary file object that is opened for writing, everything
+    written through it is added to the checksum"""
+
+    def __init__(self, out, bits):
+        self.out = out
+        self.checksum = Checksum(bits)
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        self.checksum.update(data)
+        return self.out.write(data)
+
+    def writelines(self, buffers):
+        for data in buffers:
+            self.write(data)
+
+    def patch(self, field_offset):
+        """writes the checksum into the field at field_offset of the file"""
+        position = self.out.tell()
+        self.out.seek(field_offset)
+        self.out.write(self.checksum.to_bytes())
+        self.out.seek(position)
+
+
+def file_checksum(buffer, field_offset, bits):
+    """the checksum of the file contents in buffer (e.g. a memory map),
+    the checksum field at field_offset counts as 0"""
+    checksum = Checksum(bits)
+    field_size = bits // 8
+    with memoryview(buffer) as view:
+        checksum.update(view[:field_offset])
+        checksum.update(bytes(field_size))
+        checksum.update(view[field_offset + field_size:])
+    return checksum.value
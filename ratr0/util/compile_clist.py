@@ -1,6 +1,33 @@
 #!/usr/bin/env python3
+"""
+compile_clist.py - copper list compiler
 
+The copper list source is a list of instructions, one per line:
+
+  MOVE <dest>,<value>          move a value to a custom chip register
+  WAIT <hpos>,<vpos>           wait for a beam position
+  END                          end of the copper list
+  <label>:                     index of the value of the next instruction
+  <NAME> = <expression>        define a constant
+  REPEAT <count>[,<variable>]  repeat the block up to ENDR, the variable
+  ...                          counts from 0 to count - 1
+  ENDR
+  MACRO <name> [<param>,...]   define a macro, which is used like an
+  ...                          instruction: <name> <arg>,...
+  ENDM
+
+All arguments are integer expressions with the operators of Python
+(/ is the integer division), the names of the registers and the predefined
+values in STD_VARS can be used in them.
+"""
+import ast
 import os
+import re
+from keyword import iskeyword
+
+import numpy as np
+
+from ratr0.util import profiling
 
 STD_VARS = {
     # Registers
@@ -33,63 +60,367 @@ STD_VARS = {
     "DIWSTRT_VALUE_320": 0x2c81, "DIWSTOP_VALUE_PAL_320": 0x2cc1,
 }
 
-def parse_int(s):
-    return int(s, 0)
+# the copper instructions that the language supports
+MOVE_DEST_MAX = 0x1fe
+WAIT_X_MAX = 0x7f
+WAIT_Y_MAX = 0xff
+WAIT_MASK = 0xfffe
+END_WORDS = [0xffff, 0xfffe]
+MAX_MACRO_DEPTH = 64
+BLOCK_ENDS = {'REPEAT': 'ENDR', 'MACRO': 'ENDM'}
 
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+                    ast.LShift, ast.RShift, ast.BitAnd, ast.BitOr, ast.BitXor,
+                    ast.Invert, ast.USub, ast.UAdd)
+# the largest number of bits that the result of ** and << can have
+MAX_RESULT_BITS = 64
+NAME_PATTERN = re.compile(r'^[A-Za-z_]\w*$')
+INTEGER_PATTERN = re.compile(r'^(0[xX][0-9a-fA-F]+|0[oO][0-7]+|0[bB][01]+|[1-9][0-9]*|0+)$')
+ASSIGNMENT_PATTERN = re.compile(r'^([A-Za-z_]\w*)\s*=\s*(.+)$')
+LABEL_PATTERN = re.compile(r'^([A-Za-z_]\w*):$')
 
-def compile_cmove(result, args):
-    dest = args[0]
-    value = args[1]
-    try:
-        dest = parse_int(dest)
-    except ValueError:
-        dest = STD_VARS[dest]
-    try:
-        value = parse_int(value)
-    except:
-        value = STD_VARS[value]
-    result.extend([dest, value])
 
-def compile_cwait(result, args):
-    x = parse_int(args[0])
-    y = parse_int(args[1])
-    # convert to bit mask
-    first_word = (y << 8) | (x << 1) | 1
+class LimitError(ValueError):
+    pass
 
-    # TODO: 1. add optional masks for x and y positions
-    # 2. add blitter wait enable
-    second_word = 0xfffe
-    result.extend([first_word, second_word])
 
+def bit_length(value):
+    """the number of bits of the largest magnitude of an integer or array"""
+    if isinstance(value, np.ndarray):
+        value = np.abs(value).max() if value.size > 0 else 0
+    return abs(int(value)).bit_length()
 
-def compile_clist(inpath):
-    result = []
-    indexes = {}
-    list_index = 0
-    with open(inpath, 'r') as infile:
-        for line in infile:
-            line = line.strip()
-            # comment or empty line
-            if len(line) == 0 or line.startswith('#'):
-                continue
-            comps = line.split()
-            if comps[0] == 'MOVE':
-                compile_cmove(result, comps[1].split(","))
-                list_index += 2
-            elif comps[0] == 'WAIT':
-                compile_cwait(result, comps[1].split(","))
-                list_index += 2
-            elif comps[0] == 'END':
-                result.extend([0xffff, 0xfffe])
-            elif comps[0].endswith(":"):
-                label = comps[0][:-1]
+
+def checked_power(base, exponent):
+    if np.any(np.asarray(exponent) < 0):
+        raise LimitError("negative exponent")
+    if bit_length(base) * int(np.max(exponent)) > MAX_RESULT_BITS:
+        raise LimitError("the result of ** has more than %d bits" % MAX_RESULT_BITS)
+    return base ** exponent
+
+
+def checked_lshift(value, count):
+    if np.any(np.asarray(count) < 0):
+        raise LimitError("negative shift count")
+    if bit_length(value) + int(np.max(count)) > MAX_RESULT_BITS:
+        raise LimitError("the result of << has more than %d bits" % MAX_RESULT_BITS)
+    return value << count
+
+
+# ** and << are replaced by calls of these functions, which reject results
+# that would take too long to compute
+CHECKED_OPERATORS = {ast.Pow: '__power__', ast.LShift: '__lshift__'}
+
+
+class CheckedOperators(ast.NodeTransformer):
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if type(node.op) not in CHECKED_OPERATORS:
+            return node
+        return ast.copy_location(ast.Call(ast.Name(CHECKED_OPERATORS[type(node.op)], ast.Load()),
+                                          [node.left, node.right], []), node)
+
+
+# the expressions are evaluated without any builtins, only with the
+# predefined names
+EXPRESSION_GLOBALS = dict(STD_VARS, __builtins__={}, __power__=checked_power,
+                          __lshift__=checked_lshift)
+
+
+class Expression:
+    """An arithmetic expression of integers and names. The expression is
+    parsed and compiled once, evaluating it in an environment where names
+    are numpy arrays evaluates it for all elements at once. Plain numbers
+    and names, the most common arguments, are not compiled"""
+    __slots__ = ['text', 'location', 'constant', 'name', 'code']
+
+    def __init__(self, text, location):
+        self.text = text.strip()
+        self.location = location
+        self.constant = None
+        self.name = None
+        self.code = None
+        if INTEGER_PATTERN.match(self.text):
+            self.constant = int(self.text, 0)
+            return
+        if NAME_PATTERN.match(self.text) and not iskeyword(self.text):
+            self.name = self.text
+            return
+        try:
+            tree = ast.parse(self.text, mode='eval')
+        except SyntaxError:
+            raise Exception("%s: invalid expression '%s'" % (location, self.text))
+        for node in ast.walk(tree):
+            if (not isinstance(node, EXPRESSION_NODES) or
+                    (isinstance(node, ast.Constant) and type(node.value) is not int)):
+                raise Exception("%s: invalid expression '%s'" % (location, self.text))
+            # all arithmetic is integer arithmetic
+            if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+                node.op = ast.FloorDiv()
+        tree = ast.fix_missing_locations(CheckedOperators().visit(tree))
+        self.code = compile(tree, location, 'eval')
+
+    def evaluate(self, env):
+        if self.constant is not None:
+            return self.constant
+        if self.name is not None:
+            if self.name in env:
+                return env[self.name]
+            if self.name in STD_VARS:
+                return STD_VARS[self.name]
+            raise Exception("%s: name '%s' is not defined in '%s'" %
+                            (self.location, self.name, self.text))
+        try:
+            return eval(self.code, EXPRESSION_GLOBALS, env)
+        except LimitError as e:
+            raise Exception("%s: invalid expression '%s', %s" % (self.location, self.text, e))
+        except NameError as e:
+            raise Exception("%s: %s in '%s'" % (self.location, e, self.text))
+        except (ArithmeticError, ValueError) as e:
+            raise Exception("%s: %s in '%s'" % (self.location, e, self.text))
+
+
+def split_args(text):
+    """splits the arguments at the commas that are not in parentheses"""
+    if '(' not in text:
+        return [arg.strip() for arg in text.split(',')]
+    args = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(text):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return [arg.strip() for arg in args]
+
+
+def parse_args(text, num_args, location, what):
+    args = split_args(text) if len(text.strip()) > 0 else []
+    if num_args is not None and len(args) != num_args:
+        raise Exception("%s: %s expects %d arguments (was %d)" % (location, what, num_args, len(args)))
+    return [Expression(arg, location) for arg in args]
+
+
+def parse_clist(lines, path):
+    """Parses the copper list source into a list of statements and a dictionary
+    of the macros, the source is only tokenized once. Statements are tuples
+    of the kind, the location and the arguments:
+
+      ('MOVE', location, dest, value), ('WAIT', location, x, y), ('END', location),
+      ('label', location, name), ('set', location, name, expression),
+      ('REPEAT', location, count, variable, statements), ('call', location, name, args)"""
+    macros = {}
+    program = []
+    # the open blocks: (statements, kind, name or variable, location)
+    blocks = [(program, None, None, None)]
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        # comment or empty line
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        location = "%s:%d" % (path, lineno)
+        statements = blocks[-1][0]
+        comps = line.split(None, 1)
+        keyword = comps[0]
+        rest = comps[1] if len(comps) > 1 else ''
+
+        # most lines are instructions, only match the patterns that can match
+        assignment = ASSIGNMENT_PATTERN.match(line) if '=' in line else None
+        label = LABEL_PATTERN.match(line) if line.endswith(':') else None
+        if assignment:
+            statements.append(('set', location, assignment.group(1),
+                               Expression(assignment.group(2), location)))
+        elif label:
+            statements.append(('label', location, label.group(1)))
+        elif keyword == 'MOVE':
+            statements.append(('MOVE', location) + tuple(parse_args(rest, 2, location, keyword)))
+        elif keyword == 'WAIT':
+            statements.append(('WAIT', location) + tuple(parse_args(rest, 2, location, keyword)))
+        elif keyword == 'END':
+            statements.append(('END', location))
+        elif keyword == 'REPEAT':
+            args = split_args(rest)
+            if len(args) not in (1, 2) or (len(args) == 2 and not NAME_PATTERN.match(args[1])):
+                raise Exception("%s: expected REPEAT <count>[,<variable>]" % location)
+            body = []
+            statements.append(('REPEAT', location, Expression(args[0], location),
+                               args[1] if len(args) == 2 else None, body))
+            blocks.append((body, 'REPEAT', None, location))
+        elif keyword == 'MACRO':
+            comps = rest.split(None, 1)
+            if len(comps) == 0 or not NAME_PATTERN.match(comps[0]):
+                raise Exception("%s: expected MACRO <name> [<parameter>,...]" % location)
+            if len(blocks) > 1:
+                raise Exception("%s: macros can only be defined at the top level" % location)
+            params = split_args(comps[1]) if len(comps) > 1 else []
+            if not all([NAME_PATTERN.match(param) for param in params]):
+                raise Exception("%s: invalid macro parameters '%s'" % (location, comps[1]))
+            body = []
+            macros[comps[0]] = (params, body)
+            blocks.append((body, 'MACRO', comps[0], location))
+        elif keyword in BLOCK_ENDS.values():
+            if BLOCK_ENDS.get(blocks[-1][1]) != keyword:
+                raise Exception("%s: %s without %s" % (location, keyword,
+                                                        'REPEAT' if keyword == 'ENDR' else 'MACRO'))
+            blocks.pop()
+        elif NAME_PATTERN.match(keyword):
+            statements.append(('call', location, keyword, parse_args(rest, None, location, keyword)))
+        else:
+            raise Exception("%s: can't recognize instruction: '%s'" % (location, keyword))
+    if len(blocks) > 1:
+        raise Exception("%s: %s without %s" % (blocks[-1][3], blocks[-1][1], BLOCK_ENDS[blocks[-1][1]]))
+    return program, macros
+
+
+class ClistCompiler:
+    """Executes the parsed statements. A block is executed for n instances
+    at once: the values in the environment are either integers or arrays of
+    n elements, each instruction produces a (n, 2) array of words. A REPEAT
+    block with count iterations is executed once for n * count instances,
+    so the time to generate a list does not depend on the number of
+    iterations"""
+
+    def __init__(self, macros):
+        self.macros = macros
+        self.indexes = {}
+
+    def words(self, expression, env, n, minimum, maximum):
+        value = np.broadcast_to(np.asarray(expression.evaluate(env), dtype=np.int64), (n,))
+        if n > 0 and (value.min() < minimum or value.max() > maximum):
+            raise Exception("%s: '%s' is out of range (0x%x-0x%x)" %
+                            (expression.location, expression.text, minimum, maximum))
+        return value
+
+    def word(self, expression, env, minimum, maximum):
+        """the word of a single instance"""
+        value = expression.evaluate(env)
+        if type(value) is not int:
+            value = int(value.item() if isinstance(value, np.ndarray) else value)
+        if value < minimum or value > maximum:
+            raise Exception("%s: '%s' is out of range (0x%x-0x%x)" %
+                            (expression.location, expression.text, minimum, maximum))
+        return value
+
+    def run(self, statements, env, n, offset, protected, depth=0):
+        """executes the statements for n instances, offset is the index of
+        the first word in the list if n is 1 and the block is not repeated,
+        otherwise None. The names in protected can not be assigned.
+        Returns the (n, words) array of the generated words. A single
+        instance collects the words in a list, which is much faster than
+        an array for each instruction"""
+        single = n == 1
+        pieces = []
+        words = []
+        position = offset
+        for statement in statements:
+            kind, location = statement[0], statement[1]
+            piece = None
+            if kind == 'MOVE' and single:
+                piece = [self.word(statement[2], env, 0, MOVE_DEST_MAX),
+                         self.word(statement[3], env, 0, 0xffff)]
+            elif kind == 'MOVE':
+                piece = np.stack([self.words(statement[2], env, n, 0, MOVE_DEST_MAX),
+                                  self.words(statement[3], env, n, 0, 0xffff)], axis=1)
+            elif kind == 'WAIT' and single:
+                x = self.word(statement[2], env, 0, WAIT_X_MAX)
+                y = self.word(statement[3], env, 0, WAIT_Y_MAX)
+                piece = [(y << 8) | (x << 1) | 1, WAIT_MASK]
+            elif kind == 'WAIT':
+                x = self.words(statement[2], env, n, 0, WAIT_X_MAX)
+                y = self.words(statement[3], env, n, 0, WAIT_Y_MAX)
+                piece = np.stack([(y << 8) | (x << 1) | 1, np.full(n, WAIT_MASK)], axis=1)
+            elif kind == 'END':
+                piece = END_WORDS if single else np.tile(END_WORDS, (n, 1))
+            elif kind == 'label':
+                if position is None:
+                    raise Exception("%s: labels are not allowed in REPEAT blocks" % location)
+                if statement[2] in self.indexes:
+                    raise Exception("%s: duplicate label '%s'" % (location, statement[2]))
                 # the label points to the value, so we need to add 1
-                indexes[label] = list_index + 1
+                self.indexes[statement[2]] = position + 1
+            elif kind == 'set':
+                if statement[2] in protected:
+                    raise Exception("%s: can't assign '%s' in a REPEAT block, "
+                                    "derive it from the loop variable instead" % (location, statement[2]))
+                env[statement[2]] = statement[3].evaluate(env)
+            elif kind == 'REPEAT':
+                piece = self.repeat(statement, env, n, protected, depth)
+            elif kind == 'call':
+                piece = self.call(statement, env, n, position, protected, depth)
+            if piece is None:
+                continue
+            if single:
+                if isinstance(piece, np.ndarray):
+                    piece = piece[0].tolist()
+                words.extend(piece)
+                length = len(piece)
             else:
-                raise Exception("can't recognize instruction: '%s'" % comps[0])
-    return result, indexes
+                pieces.append(piece)
+                length = piece.shape[1]
+            if position is not None:
+                position += length
+        if single:
+            return np.array(words, dtype=np.int64).reshape(1, -1)
+        if len(pieces) == 0:
+            return np.zeros((n, 0), dtype=np.int64)
+        return np.concatenate(pieces, axis=1)
+
+    def repeat(self, statement, env, n, protected, depth):
+        _, location, count_expr, variable, body = statement
+        counts = np.unique(np.asarray(count_expr.evaluate(env)))
+        if len(counts) > 1:
+            raise Exception("%s: the REPEAT count can't depend on a loop variable" % location)
+        count = int(counts[0]) if len(counts) > 0 else 0
+        if count < 0:
+            raise Exception("%s: negative REPEAT count %d" % (location, count))
+        # instance i * count + j is iteration j of outer instance i
+        inner_env = {name: np.repeat(value, count) if isinstance(value, np.ndarray) else value
+                     for name, value in env.items()}
+        if variable is not None:
+            inner_env[variable] = np.tile(np.arange(count, dtype=np.int64), n)
+        inner_protected = protected | set(inner_env)
+        words = self.run(body, inner_env, n * count, None, inner_protected, depth)
+        return words.reshape(n, -1)
+
+    def call(self, statement, env, n, position, protected, depth):
+        _, location, name, args = statement
+        if name not in self.macros:
+            raise Exception("%s: can't recognize instruction: '%s'" % (location, name))
+        if depth >= MAX_MACRO_DEPTH:
+            raise Exception("%s: macros nested too deeply" % location)
+        params, body = self.macros[name]
+        if len(args) != len(params):
+            raise Exception("%s: macro %s expects %d arguments (was %d)" %
+                            (location, name, len(params), len(args)))
+        # parameters and assignments are local to the macro
+        macro_env = dict(env)
+        macro_env.update({param: arg.evaluate(env) for param, arg in zip(params, args)})
+        return self.run(body, macro_env, n, position, protected - set(params), depth + 1)
+
+
+def compile_source(lines, path='<clist>'):
+    """compiles the lines of a copper list source, returns the list of words
+    and the indexes of the labels"""
+    program, macros = parse_clist(lines, path)
+    compiler = ClistCompiler(macros)
+    words = compiler.run(program, {}, 1, 0, frozenset())
+    return words[0].tolist(), compiler.indexes
+
+
+@profiling.profiled('compile_clist')
+def compile_clist(inpath):
+    with open(inpath, 'r') as infile:
+        return compile_source(infile, inpath)
 
 
+@profiling.profiled('write_clist')
 def write_clist(clist, indexes, outfile, clist_name="default_copper"):
     src_file = os.path.basename(outfile)
     print("Writing %s" % src_file)
@@ -0,0 +1,331 @@
+"""
+compress.py - compression codecs for RATR0 data
+
+The codecs are designed to be decoded by a plain 68000 without any tables,
+the encoders run on the host and can spend the effort.
+
+RLE: the data is encoded row by row as pairs of (count, value) where count
+     is an unsigned byte between 1 and 255 and value is value_size bytes
+     big endian. Runs never cross row boundaries, so a row can be decoded
+     independently.
+
+LZ:  a byte oriented LZ77 variant. Each token starts with a control byte c:
+     c < 0x80: a literal run of c + 1 bytes follows
+     c >= 0x80: copy (c & 0x7f) + 3 bytes from offset bytes before the
+                current output position, the offset follows as 16 bit big
+                endian value
+
+ByteRun1: the RLE variant of IFF ILBM, which works well on bitplane data.
+     Each token starts with a signed control byte n:
+     0 <= n <= 127: n + 1 literal bytes follow
+     -127 <= n <= -1: the following byte is repeated -n + 1 times
+     n = -128: no operation
+     Like RLE, tokens never cross row boundaries.
+
+The decode cost functions estimate the number of 68000 cycles the decoder
+loops need (no wait states, see the loop listings at the constants), which
+makes it possible to compare codecs for a given asset.
+"""
+import numpy as np
+
+CODEC_NONE = 0
+CODEC_RLE = 1
+CODEC_LZ = 2
+CODEC_BYTERUN1 = 3
+
+CODEC_NAMES = {CODEC_NONE: 'none', CODEC_RLE: 'rle', CODEC_LZ: 'lz',
+               CODEC_BYTERUN1: 'byterun1'}
+CODECS = {name: codec for codec, name in CODEC_NAMES.items()}
+
+RLE_MAX_RUN = 255
+LZ_MAX_LITERALS = 128
+LZ_MIN_MATCH = 3
+LZ_MAX_MATCH = 127 + LZ_MIN_MATCH
+LZ_MAX_OFFSET = 0xffff
+BYTERUN1_MIN_REPEAT = 3
+BYTERUN1_MAX_RUN = 128
+
+# estimated 68000 cycles, raw copy:
+#   move.b (a0)+,(a1)+ (12) / dbf d0 (10)
+COPY_CYCLES_PER_BYTE = 22
+
+# RLE run:
+#   move.b (a0)+,d0 (8) / subq.w #1,d0 (4) / move.b (a0)+,d1 (8)
+#   loop: move.b d1,(a1)+ (8) / dbf d0,loop (10), 14 on exit
+#   bra next (10)
+RLE_CYCLES_PER_RUN = 44
+RLE_CYCLES_PER_BYTE = 18
+
+# LZ token:
+#   move.b (a0)+,d0 (8) / bmi match (10) / and.w / subq (8)
+# literal byte: move.b (a0)+,(a1)+ (12) / dbf (10)
+# match: read offset, 2 x move.b + lsl.w (34) / move.l a1,a2 / sub.l (12)
+#   loop: move.b (a2)+,(a1)+ (12) / dbf (10)
+LZ_CYCLES_PER_TOKEN = 26
+LZ_CYCLES_PER_LITERAL = 22
+LZ_CYCLES_PER_MATCH = 46
+LZ_CYCLES_PER_MATCH_BYTE = 22
+
+# ByteRun1 token:
+#   move.b (a0)+,d0 (8) / bmi repeat (8 not taken, 10 taken)
+# literal run: loop: move.b (a0)+,(a1)+ (12) / dbf (10) / bra next (10)
+# repeat run: neg.b d0 (4) / move.b (a0)+,d1 (8)
+#   loop: move.b d1,(a1)+ (8) / dbf (10) / bra next (10)
+BYTERUN1_CYCLES_PER_LITERAL_RUN = 26
+BYTERUN1_CYCLES_PER_LITERAL = 22
+BYTERUN1_CYCLES_PER_REPEAT_RUN = 40
+BYTERUN1_CYCLES_PER_REPEAT_BYTE = 18
+
+
+def value_dtype(value_size):
+    return np.dtype('>u2') if value_size == 2 else np.dtype('u1')
+
+
+def rle_encode(values, row_length, value_size=1):
+    """RLE encodes the values (a sequence of unsigned integers) row by row"""
+    values = np.asarray(values, dtype=value_dtype(value_size))
+    if len(values) == 0:
+        return b''
+    # a run starts at every value change and at every row start
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = values[1:] != values[:-1]
+    starts[::row_length] = True
+    start_idx = np.flatnonzero(starts)
+    lengths = np.diff(np.append(start_idx, len(values)))
+
+    # runs longer than the maximum are split into several
+    num_pieces = (lengths + RLE_MAX_RUN - 1) // RLE_MAX_RUN
+    counts = np.full(num_pieces.sum(), RLE_MAX_RUN, dtype=np.int64)
+    last_piece = np.cumsum(num_pieces) - 1
+    counts[last_piece] = lengths - (num_pieces - 1) * RLE_MAX_RUN
+    run_values = np.repeat(values[start_idx], num_pieces)
+
+    out = np.empty((len(counts), 1 + value_size), dtype=np.uint8)
+    out[:, 0] = counts
+    out[:, 1:] = run_values.view(np.uint8).reshape(-1, value_size)
+    return out.tobytes()
+
+
+def rle_decode(payload, num_values, value_size=1):
+    pairs = np.frombuffer(payload, dtype=np.uint8).reshape(-1, 1 + value_size)
+    run_values = np.ascontiguousarray(pairs[:, 1:]).view(value_dtype(value_size)).ravel()
+    result = np.repeat(run_values, pairs[:, 0])
+    if len(result) != num_values:
+        raise ValueError("RLE data decodes to %d values, expected %d" % (len(result), num_values))
+    return result
+
+
+def rle_decode_cycles(payload, value_size=1):
+    num_runs = len(payload) // (1 + value_size)
+    num_bytes = int(np.frombuffer(payload, dtype=np.uint8)[::1 + value_size].sum()) * value_size
+    return num_runs * RLE_CYCLES_PER_RUN + num_bytes * RLE_CYCLES_PER_BYTE
+
+
+def split_runs(starts, lengths, max_length):
+    """splits the runs (start, length) into pieces of at most max_length,
+    returns the starts and lengths of the pieces and the run of each piece"""
+    num_pieces = (lengths + max_length - 1) // max_length
+    run = np.repeat(np.arange(len(lengths)), num_pieces)
+    first_piece = np.cumsum(num_pieces) - num_pieces
+    piece = np.arange(len(run)) - first_piece[run]
+    piece_starts = starts[run] + piece * max_length
+    piece_lengths = np.minimum(lengths[run] - piece * max_length, max_length)
+    return piece_starts, piece_lengths, run
+
+
+def byterun1_encode(data, row_length):
+    """ByteRun1 encodes data (a bytes-like object or uint8 array) in rows of
+    row_length bytes. Runs of at least 3 equal bytes are repeat runs, the
+    bytes between them are collected into literal runs"""
+    if isinstance(data, np.ndarray):
+        data = np.ascontiguousarray(data).view(np.uint8).ravel()
+    else:
+        data = np.frombuffer(data, dtype=np.uint8)
+    size = len(data)
+    if size == 0:
+        return b''
+    starts = np.ones(size, dtype=bool)
+    starts[1:] = data[1:] != data[:-1]
+    starts[::row_length] = True
+    run_starts = np.flatnonzero(starts)
+    run_lengths = np.diff(np.append(run_starts, size))
+    repeat = run_lengths >= BYTERUN1_MIN_REPEAT
+
+    # a literal run starts at a row start or after a repeat run, consecutive
+    # short runs are merged into it
+    segment = repeat | (run_starts % row_length == 0)
+    segment[1:] |= repeat[:-1]
+    segment_starts = run_starts[segment]
+    segment_lengths = np.diff(np.append(segment_starts, size))
+    piece_starts, piece_lengths, piece_segment = split_runs(segment_starts, segment_lengths,
+                                                            BYTERUN1_MAX_RUN)
+    piece_repeat = repeat[segment][piece_segment]
+
+    # output layout: a control byte followed by either the repeated byte or the literals
+    out_lengths = 1 + np.where(piece_repeat, 1, piece_lengths)
+    out_starts = np.cumsum(out_lengths) - out_lengths
+    out = np.empty(int(out_lengths.sum()), dtype=np.uint8)
+    out[out_starts] = np.where(piece_repeat, (1 - piece_lengths) & 0xff, piece_lengths - 1)
+    out[out_starts[piece_repeat] + 1] = data[piece_starts[piece_repeat]]
+
+    literal = ~piece_repeat
+    lit_lengths = piece_lengths[literal]
+    lit_offsets = np.arange(int(lit_lengths.sum())) - np.repeat(np.cumsum(lit_lengths) - lit_lengths,
+                                                                lit_lengths)
+    out[np.repeat(out_starts[literal] + 1, lit_lengths) + lit_offsets] = \
+        data[np.repeat(piece_starts[literal], lit_lengths) + lit_offsets]
+    return out.tobytes()
+
+
+def byterun1_tokens(payload):
+    """iterates over the tokens of a ByteRun1 payload as (position, control byte)"""
+    pos = 0
+    while pos < len(payload):
+        control = payload[pos]
+        yield pos, control
+        if control < 0x80:
+            pos += control + 2
+        elif control > 0x80:
+            pos += 2
+        else:
+            pos += 1
+
+
+def byterun1_decode(payload, size):
+    out = bytearray()
+    for pos, control in byterun1_tokens(payload):
+        if control < 0x80:
+            out += payload[pos + 1:pos + control + 2]
+        elif control > 0x80:
+            out += payload[pos + 1:pos + 2] * (257 - control)
+    if len(out) != size:
+        raise ValueError("ByteRun1 data decodes to %d bytes, expected %d" % (len(out), size))
+    return bytes(out)
+
+
+def byterun1_decode_cycles(payload):
+    cycles = 0
+    for _, control in byterun1_tokens(payload):
+        if control < 0x80:
+            cycles += BYTERUN1_CYCLES_PER_LITERAL_RUN + (control + 1) * BYTERUN1_CYCLES_PER_LITERAL
+        elif control > 0x80:
+            cycles += BYTERUN1_CYCLES_PER_REPEAT_RUN + (257 - control) * BYTERUN1_CYCLES_PER_REPEAT_BYTE
+    return cycles
+
+
+def lz_encode(data):
+    """greedy LZ77 encoding of data (a bytes-like object), the match candidate
+    at each position is the last earlier position of the same 3 byte sequence"""
+    data = bytes(data)
+    size = len(data)
+    out = bytearray()
+    literals_start = 0
+
+    def flush_literals(end):
+        for start in range(literals_start, end, LZ_MAX_LITERALS):
+            chunk = data[start:min(end, start + LZ_MAX_LITERALS)]
+            out.append(len(chunk) - 1)
+            out.extend(chunk)
+
+    # the 3 byte sequence starting at each position as a single integer,
+    # sorting them groups equal sequences in order of their positions
+    if size >= LZ_MIN_MATCH:
+        array = np.frombuffer(data, dtype=np.uint8).astype(np.int32)
+        keys = (array[:-2] << 16) | (array[1:-1] << 8) | array[2:]
+        order = np.argsort(keys, kind='stable')
+        same = keys[order[1:]] == keys[order[:-1]]
+        previous = np.full(len(keys), -1, dtype=np.int64)
+        previous[order[1:][same]] = order[:-1][same]
+        previous = previous.tolist()
+    else:
+        previous = []
+    pos = 0
+    while pos < len(previous):
+        candidate = previous[pos]
+        if candidate >= 0 and pos - candidate <= LZ_MAX_OFFSET:
+            max_length = min(LZ_MAX_MATCH, size - pos)
+            if data[candidate:candidate + max_length] == data[pos:pos + max_length]:
+                length = max_length
+            else:
+                length = LZ_MIN_MATCH
+                while length < max_length and data[candidate + length] == data[pos + length]:
+                    length += 1
+            flush_literals(pos)
+            offset = pos - candidate
+            out.extend([0x80 | (length - LZ_MIN_MATCH), offset >> 8, offset & 0xff])
+            pos += length
+            literals_start = pos
+        else:
+            pos += 1
+    flush_literals(size)
+    return bytes(out)
+
+
+def lz_tokens(payload):
+    """iterates over the tokens of an LZ payload as (position, control byte)"""
+    pos = 0
+    while pos < len(payload):
+        control = payload[pos]
+        yield pos, control
+        pos += 3 if control & 0x80 else control + 2
+
+
+def lz_decode(payload, size):
+    out = bytearray()
+    for pos, control in lz_tokens(payload):
+        if control & 0x80:
+            offset = (payload[pos + 1] << 8) | payload[pos + 2]
+            start = len(out) - offset
+            # the source may overlap the output, so copy byte by byte
+            for i in range((control & 0x7f) + LZ_MIN_MATCH):
+                out.append(out[start + i])
+        else:
+            out.extend(payload[pos + 1:pos + control + 2])
+    if len(out) != size:
+        raise ValueError("LZ data decodes to %d bytes, expected %d" % (len(out), size))
+    return bytes(out)
+
+
+def lz_decode_cycles(payload):
+    cycles = 0
+    for _, control in lz_tokens(payload):
+        if control & 0x80:
+            cycles += (LZ_CYCLES_PER_TOKEN + LZ_CYCLES_PER_MATCH +
+                       ((control & 0x7f) + LZ_MIN_MATCH) * LZ_CYCLES_PER_MATCH_BYTE)
+        else:
+            cycles += LZ_CYCLES_PER_TOKEN + (control + 1) * LZ_CYCLES_PER_LITERAL
+    return cycles
+
+
+def encode(codec, values, row_length, value_size=1):
+    """encodes the values with the codec, returns the payload bytes"""
+    values = np.asarray(values, dtype=value_dtype(value_size))
+    if codec == CODEC_RLE:
+        return rle_encode(values, row_length, value_size)
+    elif codec == CODEC_LZ:
+        return lz_encode(values.tobytes())
+    elif codec == CODEC_BYTERUN1:
+        return byterun1_encode(values, row_length * value_size)
+    return values.tobytes()
+
+
+def decode(codec, payload, num_values, value_size=1):
+    """decodes the payload back into an array of num_values values"""
+    if codec == CODEC_RLE:
+        return rle_decode(payload, num_values, value_size)
+    elif codec == CODEC_LZ:
+        payload = lz_decode(payload, num_values * value_size)
+    elif codec == CODEC_BYTERUN1:
+        payload = byterun1_decode(payload, num_values * value_size)
+    return np.frombuffer(payload, dtype=value_dtype(value_size), count=num_values)
+
+
+def decode_cycles(codec, payload, value_size=1):
+    """estimated number of 68000 cycles to decode the payload"""
+    if codec == CODEC_RLE:
+        return rle_decode_cycles(payload, value_size)
+    elif codec == CODEC_LZ:
+        return lz_decode_cycles(payload)
+    elif codec == CODEC_BYTERUN1:
+        return byterun1_decode_cycles(payload)
+    return len(payload) * COPY_CYCLES_PER_BYTE
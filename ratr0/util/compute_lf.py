@@ -1,18 +1,221 @@
 #!/usr/bin/env python3
 import argparse
+import re
 
 
 DESCRIPTION = """compute_lf.py - compute the LF byte for the blitter
 
 This tool takes a logical term of A, B and C and computes and prints the LF
-byte value for it"""
+byte value for it, together with the DMA channels the blit needs and its
+cost in DMA cycles.
+
+Terms use ~ or ! for NOT (a lowercase letter is the complement as in the
+Hardware Reference Manual), & or * for AND, which can also be omitted,
+| or + for OR and ^ for XOR, e.g. "AB + ~AC" or "A & B | a & C"."""
+
+# the values of the channels for the 8 combinations of A, B and C, bit i of
+# the LF byte is the result for minterm i, A is the most significant bit
+A = 0xf0
+B = 0xcc
+C = 0xaa
+CHANNEL_VALUES = {'A': A, 'B': B, 'C': C}
+
+# channel enable bits in BLTCON0
+USEA = 0x0800
+USEB = 0x0400
+USEC = 0x0200
+USED = 0x0100
+CHANNEL_BITS = {'A': USEA, 'B': USEB, 'C': USEC, 'D': USED}
+
+# each enabled channel transfers a word per DMA cycle, the model of
+# ratr0-calcnumbobs, where a cookie cut (ABCD) and a restore (AD) of a
+# word take 6 cycles
+CYCLES_PER_CHANNEL = 1
+
+# D = the operation of the sources, A is the mask or the source that can be
+# shifted with masks for the first and last word, C the destination
+OPERATIONS = {
+    'clear': '0',
+    'set': '1',
+    'copy': 'A',
+    'invert': '~C',
+    'xor': 'A ^ C',
+    'or': 'A | C',
+    'cookie-cut': 'AB + ~AC',
+}
+
+TOKEN_PATTERN = re.compile(r'\s*(?:([ABCabc01])|([~!&*|+^()]))')
+
+
+def tokenize(s):
+    tokens = []
+    position = 0
+    s = s.rstrip()
+    while position < len(s):
+        match = TOKEN_PATTERN.match(s, position)
+        if match is None:
+            raise Exception("invalid character in '%s' at %d" % (s, position))
+        tokens.append(match.group(1) or match.group(2))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser:
+    """A recursive descent parser, which evaluates the expression for all
+    8 combinations of A, B and C at once on the bits of the channel values:
+
+      or   := xor (('|' | '+') xor)*
+      xor  := and ('^' and)*
+      and  := not (('&' | '*')? not)*
+      not  := ('~' | '!') not | term
+      term := A | B | C | a | b | c | 0 | 1 | '(' or ')'
+    """
+
+    def __init__(self, s):
+        self.s = s
+        self.tokens = tokenize(s)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise Exception("unexpected end of '%s'" % self.s)
+        self.position += 1
+        return token
+
+    def parse(self):
+        value = self.parse_or()
+        if self.peek() is not None:
+            raise Exception("unexpected '%s' in '%s'" % (self.peek(), self.s))
+        return value
+
+    def parse_or(self):
+        value = self.parse_xor()
+        while self.peek() in ('|', '+'):
+            self.next()
+            value |= self.parse_xor()
+        return value
+
+    def parse_xor(self):
+        value = self.parse_and()
+        while self.peek() == '^':
+            self.next()
+            value ^= self.parse_and()
+        return value
+
+    def parse_and(self):
+        value = self.parse_not()
+        while self.peek() is not None and self.peek() not in ('|', '+', '^', ')'):
+            if self.peek() in ('&', '*'):
+                self.next()
+            value &= self.parse_not()
+        return value
+
+    def parse_not(self):
+        if self.peek() in ('~', '!'):
+            self.next()
+            return self.parse_not() ^ 0xff
+        return self.parse_term()
+
+    def parse_term(self):
+        token = self.next()
+        if token == '(':
+            value = self.parse_or()
+            if self.next() != ')':
+                raise Exception("missing ')' in '%s'" % self.s)
+            return value
+        if token in CHANNEL_VALUES:
+            return CHANNEL_VALUES[token]
+        if token.upper() in CHANNEL_VALUES:
+            return CHANNEL_VALUES[token.upper()] ^ 0xff
+        if token in ('0', '1'):
+            return 0xff if token == '1' else 0
+        raise Exception("unexpected '%s' in '%s'" % (token, self.s))
+
 
 def parse_expression(s):
-    return []
+    """the minterms (0-7) for which the expression is true"""
+    lf = compute_lf(s)
+    return [minterm for minterm in range(8) if lf & (1 << minterm)]
+
+
+def compute_lf(s):
+    """the LF byte of the expression"""
+    return ExpressionParser(s).parse()
+
+
+def used_channels(lf):
+    """the source channels whose values change the result of the LF byte"""
+    channels = ''
+    for channel, value in sorted(CHANNEL_VALUES.items()):
+        # the distance between the minterms that only differ in the channel
+        shift = {A: 4, B: 2, C: 1}[value]
+        if ((lf >> shift) ^ lf) & (value ^ 0xff):
+            channels += channel
+    return channels
+
+
+class BlitPlan:
+    """the channels and the BLTCON0 and BLTCON1 shift values of a blit of
+    the expression, only the source channels the LF byte depends on are
+    enabled and the destination channel D"""
+
+    def __init__(self, name, expression, shift=0):
+        if shift < 0 or shift > 15:
+            raise Exception("shift must be between 0 and 15 (was %d)" % shift)
+        self.name = name
+        self.expression = expression
+        self.lf = compute_lf(expression)
+        self.channels = used_channels(self.lf) + 'D'
+        self.bltcon0 = (shift << 12) | self.lf
+        for channel in self.channels:
+            self.bltcon0 |= CHANNEL_BITS[channel]
+        # the B shift is in BLTCON1
+        self.bltcon1 = shift << 12 if 'B' in self.channels else 0
+
+    @property
+    def cycles_per_word(self):
+        return len(self.channels) * CYCLES_PER_CHANNEL
+
+    def blit_cycles(self, width, height, num_planes=1, shifted=False):
+        """the DMA cycles of a blit of width x height pixels in num_planes
+        planes, a shifted blit needs an extra word per row"""
+        words = (width + 15) // 16 + (1 if shifted else 0)
+        return self.cycles_per_word * words * height * num_planes
+
+    def __str__(self):
+        return ("%s: D = %s, LF = 0x%02x, channels %s, BLTCON0 = 0x%04x, BLTCON1 = 0x%04x, "
+                "%d DMA cycles / word" % (self.name, self.expression, self.lf, self.channels,
+                                          self.bltcon0, self.bltcon1, self.cycles_per_word))
+
+
+def plan_operation(operation, shift=0):
+    """the BlitPlan of one of the OPERATIONS or a logical expression"""
+    if operation in OPERATIONS:
+        return BlitPlan(operation, OPERATIONS[operation], shift)
+    return BlitPlan('custom', operation, shift)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
                                      description=DESCRIPTION)
-    parser.add_argument("expr", help="logical expression")
+    parser.add_argument("expr", nargs='?', default=None,
+                        help="logical expression or one of %s" % ", ".join(sorted(OPERATIONS)))
+    parser.add_argument("--shift", type=int, default=0, help="shift of the A and B channels")
+    parser.add_argument("--size", default=None,
+                        help="widthxheight of the blit in pixels, prints the cycles of the blit")
+    parser.add_argument("--num_planes", type=int, default=1, help="number of bit planes")
     args = parser.parse_args()
-    expr = parse_expression(args.expr)
+    operations = [args.expr] if args.expr is not None else sorted(OPERATIONS)
+    for operation in operations:
+        plan = plan_operation(operation, args.shift)
+        print(plan)
+        print("minterms: %s" % ", ".join(map(str, parse_expression(plan.expression))))
+        if args.size is not None:
+            width, height = map(int, args.size.split('x'))
+            print("%d DMA cycles for %dx%d pixels in %d planes" %
+                  (plan.blit_cycles(width, height, args.num_planes, args.shift > 0),
+                   width, height, args.num_planes))
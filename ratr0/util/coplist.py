@@ -0,0 +1,196 @@
+"""
+coplist.py - binary relocatable copper list files
+
+A RATR0 copper list file contains a compiled copper list, so it can be
+loaded at runtime instead of being linked into the game. Besides the words
+of the list it contains the relocations of the pointer registers and the
+label indexes, so the engine can fill in the addresses of its bitplanes
+and sprites in a single pass over the relocation table and patch other
+values through the labels.
+
+flags:
+
+bit 0: not set -> big endian, set -> little endian
+bit 1: not set -> no checksum
+       set -> checksum contains the Adler-32 of the file (see checksum.py)
+
+Header (32 bytes)
+
+'RATR0COP'       byte 0-7   identifier
+version          byte 8     file format version
+flags            byte 9     special flags
+reserved1        byte 10-11
+num_words        byte 12-15 number of words in the copper list
+num_relocations  byte 16-17 number of relocations
+num_labels       byte 18-19 number of labels
+strings_size     byte 20-23 size of the label name table, a multiple of 2
+checksum         byte 24-27 Adler-32 of the file if bit 1 of flags is set
+reserved2        byte 28-31
+
+relocations      <num_relocations> * 12 bytes:
+                 high     4 bytes  word index of the value of the MOVE to the
+                                   high word of the pointer
+                 low      4 bytes  word index of the value of the MOVE to the
+                                   low word of the pointer
+                 register 2 bytes  the register of the high word (e.g. BPL1PTH)
+                 pointer  2 bytes  the pointer: 0-7 bitplane 1-8, 8-15 sprite 0-7
+labels           <num_labels> * 8 bytes:
+                 name     4 bytes  offset of the name in the name table
+                 index    4 bytes  word index of the label
+label names      <strings_size> bytes of 0 terminated label names
+list_data        <num_words> * 2 bytes copper list
+"""
+import mmap
+import struct
+
+import numpy as np
+
+from ratr0.util import checksum, profiling
+from ratr0.util.compile_clist import STD_VARS
+from ratr0.util.planar import WORD_TYPE
+
+FILE_FORMAT_VERSION = 1
+# identifier, version, flags, num_words, num_relocations, num_labels,
+# strings_size, checksum
+HEADER_FORMAT = ">8s2B2xI2HII4x"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CHECKSUM_OFFSET = 24
+FLAG_CHECKSUM = 0x02
+
+RELOCATION_TYPE = np.dtype([('high', '>u4'), ('low', '>u4'), ('register', '>u2'), ('pointer', '>u2')])
+LABEL_TYPE = np.dtype([('name', '>u4'), ('index', '>u4')])
+
+NUM_BITPLANE_POINTERS = 8
+NUM_SPRITE_POINTERS = 8
+BPL1PTH = STD_VARS['BPL1PTH']
+SPR0PTH = STD_VARS['SPR0PTH']
+
+
+def pointer_number(register):
+    """the pointer number of a pointer high word register, None for other
+    registers"""
+    for first, count, base in [(BPL1PTH, NUM_BITPLANE_POINTERS, 0),
+                               (SPR0PTH, NUM_SPRITE_POINTERS, NUM_BITPLANE_POINTERS)]:
+        if first <= register < first + 4 * count and (register - first) % 4 == 0:
+            return base + (register - first) // 4
+    return None
+
+
+def find_relocations(words):
+    """Returns the relocations of the copper list as an array of
+    RELOCATION_TYPE: every MOVE to a pointer high word register is paired
+    with the next MOVE to its low word register"""
+    pairs = np.asarray(words, dtype=np.int64).reshape(-1, 2)
+    moves = np.flatnonzero(pairs[:, 0] & 1 == 0)
+    registers = pairs[moves, 0] & 0x1fe
+    relocations = []
+    for i, (move, register) in enumerate(zip(moves.tolist(), registers.tolist())):
+        pointer = pointer_number(register)
+        if pointer is None:
+            continue
+        low = np.flatnonzero(registers[i + 1:] == register + 2)
+        if len(low) == 0:
+            raise Exception("MOVE to 0x%03x at index %d has no MOVE to the low word" %
+                            (register, 2 * move))
+        relocations.append((2 * move + 1, 2 * int(moves[i + 1 + low[0]]) + 1, register, pointer))
+    return np.array(relocations, dtype=RELOCATION_TYPE)
+
+
+def label_table(indexes):
+    """the label table and the name table for the label indexes"""
+    labels = np.zeros(len(indexes), dtype=LABEL_TYPE)
+    names = b''
+    for i, (name, index) in enumerate(sorted(indexes.items(), key=lambda item: item[1])):
+        labels[i] = (len(names), index)
+        names += name.encode('ascii') + b'\0'
+    if len(names) % 2 == 1:
+        names += b'\0'
+    return labels, names
+
+
+@profiling.profiled('write_coplist')
+def write_coplist(words, indexes, outfile, verbose=False):
+    """writes the copper list words with the label indexes as RATR0
+    copper list file"""
+    relocations = find_relocations(words)
+    labels, names = label_table(indexes)
+    if verbose:
+        print("copper list: %d words, %d relocations, %d labels" %
+              (len(words), len(relocations), len(labels)))
+    header = struct.pack(HEADER_FORMAT, b'RATR0COP', FILE_FORMAT_VERSION, FLAG_CHECKSUM,
+                         len(words), len(relocations), len(labels), len(names), 0)
+    with open(outfile, 'wb') as out:
+        writer = checksum.ChecksumWriter(out, 32)
+        writer.writelines([header, relocations, labels, names,
+                           np.asarray(words, dtype=np.int64).astype(WORD_TYPE)])
+        writer.patch(CHECKSUM_OFFSET)
+
+
+class CopperList:
+    """Read access to a RATR0 copper list file. The file is memory-mapped,
+    words, relocations and labels are numpy views into the mapped data"""
+
+    def __init__(self, buffer):
+        (fileid, version, flags, num_words, num_relocations, num_labels, strings_size,
+         stored_checksum) = struct.unpack_from(HEADER_FORMAT, buffer)
+        if fileid != b'RATR0COP':
+            raise ValueError("not a RATR0 copper list file")
+        self.buffer = buffer
+        self.version = version
+        self.flags = flags
+        self.checksum = stored_checksum
+        labels_offset = HEADER_SIZE + num_relocations * RELOCATION_TYPE.itemsize
+        names_offset = labels_offset + num_labels * LABEL_TYPE.itemsize
+        words_offset = names_offset + strings_size
+        if words_offset + 2 * num_words > len(buffer):
+            raise ValueError("copper list file is truncated, expected %d bytes" %
+                             (words_offset + 2 * num_words))
+        self.relocations = np.frombuffer(buffer, dtype=RELOCATION_TYPE, count=num_relocations,
+                                         offset=HEADER_SIZE)
+        labels = np.frombuffer(buffer, dtype=LABEL_TYPE, count=num_labels, offset=labels_offset)
+        names = bytes(buffer[names_offset:words_offset])
+        self.labels = {names[offset:names.index(b'\0', offset)].decode('ascii'): int(index)
+                       for offset, index in labels.tolist()}
+        self.words = np.frombuffer(buffer, dtype=WORD_TYPE, count=num_words, offset=words_offset)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as infile:
+            buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def close(self):
+        self.words = self.relocations = None
+        try:
+            self.buffer.close()
+        except BufferError:
+            # views are still referenced, the mapping goes away with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def patched(self, pointers):
+        """a copy of the words with the addresses in pointers (pointer number
+        -> address) filled in, in a single pass over the relocations, the
+        same way the engine does it"""
+        words = self.words.copy()
+        addresses = np.zeros(NUM_BITPLANE_POINTERS + NUM_SPRITE_POINTERS, dtype=np.int64)
+        for pointer, address in pointers.items():
+            addresses[pointer] = address
+        relocated = addresses[self.relocations['pointer']]
+        words[self.relocations['high']] = relocated >> 16
+        words[self.relocations['low']] = relocated & 0xffff
+        return words
+
+    def __str__(self):
+        out = "Version: %d\n" % self.version
+        out += "flags: %d\n" % self.flags
+        out += "# words: %d\n" % len(self.words)
+        out += "# relocations: %d\n" % len(self.relocations)
+        out += "# labels: %d\n" % len(self.labels)
+        out += "# checksum: %08x" % self.checksum
+        return out
@@ -0,0 +1,154 @@
+"""
+dma.py - DMA cycle budget of a PAL frame
+
+The model of ratr0-calcnumbobs, based on the discussion in
+
+https://eab.abime.net/showthread.php?t=101707
+
+and the Javascript tool
+
+https://jsfiddle.net/zkwa9fnu/
+
+A PAL frame has 312 lines of 226 DMA cycles. Refresh, audio, sprites, the
+bitplanes and the copper take their cycles first, the rest is available to
+the blitter. A BOB costs 6 cycles per word and plane to draw and restore
+(A, B, C and D channel for the cookie cut, D to restore) and 8 if the
+background is also saved, with one extra word per row for the shift.
+
+All functions accept numpy arrays as parameters and evaluate all
+combinations at once, sweep() builds the combinations of parameter lists.
+"""
+import csv
+import struct
+
+import numpy as np
+
+from ratr0.util import compile_clist, sprites, profiling
+
+CYCLES_PER_LINE = 226
+LINES_PER_FRAME = 312
+REFRESH_CYCLES_PER_LINE = 4
+AUDIO_CYCLES_PER_LINE = 1
+SPRITE_CYCLES_PER_LINE = 2
+COPPER_MOVE_CYCLES = 2
+COPPER_WAIT_CYCLES = 3
+BOB_DRAW_RESTORE_CYCLES = 6
+BOB_SAVE_DRAW_RESTORE_CYCLES = 8
+
+# the parameters of the model and their defaults
+DEFAULT_PARAMETERS = {
+    'bob_width': 32, 'bob_height': 32,
+    'display_width': 320, 'display_height': 256,
+    'num_planes': 4, 'num_sprites': 0, 'audio_channels': 0,
+    'copper_moves': 0, 'copper_waits': 0, 'scrolling': 0
+}
+RESULT_COLUMNS = ['display_dma_cycles', 'free_dma_cycles', 'bobs_dr', 'bobs_sdr']
+
+
+def display_dma_cycles(display_width, display_height, num_planes, scrolling=0):
+    """the cycles of the bitplane DMA, scrolling fetches one more word per line"""
+    return (np.asarray(display_width) / 16 + np.asarray(scrolling)) * display_height * num_planes
+
+
+def free_dma_cycles(display_width, display_height, num_planes, num_sprites=0, audio_channels=0,
+                    copper_moves=0, copper_waits=0, scrolling=0):
+    """the cycles of a frame that are left for the blitter"""
+    refresh_cycles = LINES_PER_FRAME * REFRESH_CYCLES_PER_LINE
+    audio_cycles = LINES_PER_FRAME * AUDIO_CYCLES_PER_LINE * np.asarray(audio_channels)
+    sprite_cycles = np.asarray(display_height) * num_sprites * SPRITE_CYCLES_PER_LINE
+    copper_cycles = (np.asarray(copper_moves) * COPPER_MOVE_CYCLES +
+                     np.asarray(copper_waits) * COPPER_WAIT_CYCLES)
+    return (CYCLES_PER_LINE * LINES_PER_FRAME -
+            display_dma_cycles(display_width, display_height, num_planes, scrolling) -
+            refresh_cycles - audio_cycles - sprite_cycles - copper_cycles)
+
+
+def bob_dma_cycles(bob_width, bob_height, num_planes, save_background=False):
+    """the cycles to draw and restore a BOB, and to save its background if
+    save_background is set"""
+    words = (np.asarray(bob_width) + 16 + 15) // 16
+    per_word = BOB_SAVE_DRAW_RESTORE_CYCLES if save_background else BOB_DRAW_RESTORE_CYCLES
+    return per_word * words * bob_height * num_planes
+
+
+def evaluate(params):
+    """Evaluates the model for the parameters (a dictionary of the names in
+    DEFAULT_PARAMETERS to scalars or arrays of the same shape), returns a
+    dictionary of the result columns"""
+    p = dict(DEFAULT_PARAMETERS)
+    p.update(params)
+    free = free_dma_cycles(p['display_width'], p['display_height'], p['num_planes'],
+                           p['num_sprites'], p['audio_channels'], p['copper_moves'],
+                           p['copper_waits'], p['scrolling'])
+    return {
+        'display_dma_cycles': display_dma_cycles(p['display_width'], p['display_height'],
+                                                 p['num_planes'], p['scrolling']),
+        'free_dma_cycles': free,
+        'bobs_dr': free / bob_dma_cycles(p['bob_width'], p['bob_height'], p['num_planes']),
+        'bobs_sdr': free / bob_dma_cycles(p['bob_width'], p['bob_height'], p['num_planes'], True)
+    }
+
+
+@profiling.profiled('sweep')
+def sweep(**params):
+    """Evaluates the model for all combinations of the parameter values,
+    each parameter is a single value or a list of values. Returns a
+    dictionary of equally long columns: the parameters followed by the
+    results"""
+    p = dict(DEFAULT_PARAMETERS)
+    p.update(params)
+    for name in p:
+        if name not in DEFAULT_PARAMETERS:
+            raise Exception("unknown parameter '%s'" % name)
+    names = list(DEFAULT_PARAMETERS)
+    grids = np.meshgrid(*[np.atleast_1d(p[name]) for name in names], indexing='ij')
+    table = {name: grid.ravel() for name, grid in zip(names, grids)}
+    table.update(evaluate(table))
+    return table
+
+
+def table_rows(table):
+    """the rows of a sweep table as lists of values"""
+    columns = list(table)
+    return columns, [list(row) for row in zip(*[table[column].tolist() for column in columns])]
+
+
+def write_csv(table, out):
+    columns, rows = table_rows(table)
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+def format_table(table):
+    """the lines of a sweep table as text"""
+    columns, rows = table_rows(table)
+    widths = [max(len(column), 8) for column in columns]
+    lines = ['  '.join(['%*s' % (width, column) for width, column in zip(widths, columns)])]
+    for row in rows:
+        lines.append('  '.join([('%*.2f' if isinstance(value, float) else '%*d') % (width, value)
+                                for width, value in zip(widths, row)]))
+    return lines
+
+
+def copper_load(inpath):
+    """the number of MOVE and WAIT instructions of a copper list source file"""
+    words, _ = compile_clist.compile_clist(inpath)
+    first_words = np.asarray(words, dtype=np.int64)[0::2]
+    num_moves = int(np.count_nonzero(first_words & 1 == 0))
+    return num_moves, len(first_words) - num_moves
+
+
+def sprite_channels(inpath):
+    """the number of sprite channels that a sprite of a RATR0 sprite file
+    needs: 2 for attached sprites, otherwise 1"""
+    with open(inpath, 'rb') as infile:
+        data = infile.read()
+    (fileid, _, _, _, num_colors, num_sprites, _,
+     _) = struct.unpack_from(sprites.HEADER_FORMAT, data)
+    if fileid != b'RATR0SPR':
+        raise Exception("'%s' is not a RATR0 sprite file" % inpath)
+    # the second control word of the first sprite has the attach bit
+    data_offset = struct.calcsize(sprites.HEADER_FORMAT) + 2 * num_sprites + 2 * num_colors
+    attach = struct.unpack_from('>H', data, data_offset + 2)[0]
+    return 2 if attach & 0x80 else 1
@@ -3,10 +3,24 @@
 """
 A tool to get the information of a RATR0 file type
 """
-from . import tiles, sprites
+import concurrent.futures
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from . import tiles, sprites, levels, compress, checksum, coplist, profiling
 
 RATR0_FILE_ID_LENGTH = 8
 
+# verification results
+VERIFY_OK = 'ok'
+VERIFY_FAILED = 'FAILED'
+VERIFY_NO_CHECKSUM = 'no checksum'
+
+V1_LEVEL_HEADER_SIZE = 16
+
 
 def print_tiles_info(infile):
     tiles_info = tiles.read_tiles_info(infile)
@@ -30,11 +44,19 @@ def print_sprite_info(infile):
 
 class LevelInfo:
 
-    def __init__(self, version, flags, width, height):
+    def __init__(self, version, flags, width, height,
+                 vp_width=None, vp_height=None, init_vp_row=0, init_vp_col=0,
+                 strip_width=0, checksum=0):
         self.version = version
         self.flags = flags
         self.width = width
         self.height = height
+        self.vp_width = width if vp_width is None else vp_width
+        self.vp_height = height if vp_height is None else vp_height
+        self.init_vp_row = init_vp_row
+        self.init_vp_col = init_vp_col
+        self.strip_width = strip_width
+        self.checksum = checksum
 
     def __str__(self):
         if self.flags & 0x01 == 1:
@@ -47,8 +69,28 @@ class LevelInfo:
         out = "Version: %d\n" % self.version
         out += "Endianess: %s\n" % byte_order
         out += "size: %dx%d tiles\n" % (self.width, self.height)
+        out += "viewport: %dx%d tiles at row %d, column %d\n" % (self.vp_width, self.vp_height,
+                                                                self.init_vp_row, self.init_vp_col)
+        out += "tile numbers: %d bit\n" % self.tile_num_bits
+        if self.flags & levels.FLAG_COLUMNS:
+            out += "Layout: columns, strips of %d columns\n" % self.strip_width
+        else:
+            out += "Layout: rows\n"
+        out += "Compression: %s\n" % self.compression
         return out
 
+    @property
+    def tile_num_bits(self):
+        return 16 if self.flags & levels.FLAG_16BIT else 8
+
+    @property
+    def codec(self):
+        return (self.flags & levels.FLAG_CODEC_MASK) >> levels.FLAG_CODEC_SHIFT
+
+    @property
+    def compression(self):
+        return compress.CODEC_NAMES.get(self.codec, "unknown (%d)" % self.codec)
+
 
 def read_level_info(infile):
     version = ord(infile.read(1))
@@ -63,7 +105,19 @@ def read_level_info(infile):
 
     width = int.from_bytes(infile.read(2), byteorder=byte_order)
     height = int.from_bytes(infile.read(2), byteorder=byte_order)
-    return LevelInfo(version, flags, width, height)
+    if version < 2:
+        checksum = int.from_bytes(infile.read(2), byteorder=byte_order)
+        return LevelInfo(version, flags, width, height, checksum=checksum)
+
+    vp_width = int.from_bytes(infile.read(2), byteorder=byte_order)
+    vp_height = int.from_bytes(infile.read(2), byteorder=byte_order)
+    init_vp_row = int.from_bytes(infile.read(2), byteorder=byte_order)
+    init_vp_col = int.from_bytes(infile.read(2), byteorder=byte_order)
+    strip_width = int.from_bytes(infile.read(2), byteorder=byte_order)
+    checksum = int.from_bytes(infile.read(4), byteorder=byte_order)
+    reserved2 = infile.read(4)
+    return LevelInfo(version, flags, width, height, vp_width, vp_height,
+                     init_vp_row, init_vp_col, strip_width, checksum)
 
 
 def print_level_info(infile):
@@ -72,6 +126,17 @@ def print_level_info(infile):
     print(level_info)
 
 
+def print_coplist_info(infile):
+    copper_list = coplist.CopperList(b'RATR0COP' + infile.read())
+    print("RATR0 Copper List File")
+    print(copper_list)
+    for high, low, register, pointer in copper_list.relocations.tolist():
+        print("relocation: pointer %d, register 0x%03x, words %d/%d" % (pointer, register, high, low))
+    for name, index in copper_list.labels.items():
+        print("label %s: %d" % (name, index))
+
+
+@profiling.profiled('file_info')
 def file_info(infile):
     """infile is a file object opened in binary mode"""
     fileid = infile.read(RATR0_FILE_ID_LENGTH).decode('utf-8')
@@ -81,5 +146,126 @@ def file_info(infile):
         print_level_info(infile)
     elif fileid == "RATR0SPR":
         print_sprite_info(infile)
+    elif fileid == "RATR0COP":
+        print_coplist_info(infile)
     else:
         print("unknown file type")
+
+
+def tiles_layout(buffer):
+    """returns (expected file size, checksum field offset, checksum bits or
+    None if the file has no checksum) of a RATR0TIL file"""
+    byte_order = '<' if buffer[9] & 0x01 else '>'
+    (_, version, flags, codec, depth, width, height, tile_size_h, tile_size_v,
+     num_tiles_h, num_tiles_v, palette_size, imgdata_size,
+     _) = struct.unpack_from(byte_order + tiles.HEADER_FORMAT[1:], buffer)
+    info = tiles.TilesInfo(version, flags, depth, width, height, tile_size_h, tile_size_v,
+                           num_tiles_h, num_tiles_v, palette_size, imgdata_size, 0, codec=codec)
+    data_offset = struct.calcsize(tiles.HEADER_FORMAT) + palette_size * (3 if flags & 0x02 else 2)
+    if flags & tiles.FLAG_CROP_TABLE:
+        data_offset += num_tiles_h * num_tiles_v * tiles.CROP_ENTRY_WORDS * 2
+    if flags & tiles.FLAG_PRESHIFTED:
+        data_offset += tiles.shift_table_size(buffer, data_offset, num_tiles_h * num_tiles_v,
+                                              np.dtype(byte_order + 'u2'))
+    size = data_offset + imgdata_size
+    if flags & tiles.FLAG_COMPRESSED:
+        num_blocks = len(tiles.image_block_sizes(info))
+        index_size = (num_blocks + 1) * tiles.BLOCK_INDEX_TYPE.itemsize
+        if data_offset + index_size > len(buffer):
+            size = data_offset + index_size
+        else:
+            size = (data_offset + index_size +
+                    struct.unpack_from(byte_order + 'I', buffer, data_offset + index_size - 4)[0])
+    bits = 16 if flags & tiles.FLAG_CHECKSUM else None
+    return size, tiles.CHECKSUM_OFFSET, bits
+
+
+def sprites_layout(buffer):
+    (_, version, flags, _, num_colors, num_sprites, imgdata_size,
+     _) = struct.unpack_from(sprites.HEADER_FORMAT, buffer)
+    size = struct.calcsize(sprites.HEADER_FORMAT) + 2 * num_sprites + 2 * num_colors + imgdata_size
+    bits = 16 if flags & sprites.FLAG_CHECKSUM else None
+    return size, sprites.CHECKSUM_OFFSET, bits
+
+
+def levels_layout(buffer):
+    if buffer[8] < 2:
+        # version 1 files have no size information and no checksum
+        return None, 0, None
+    if len(buffer) < levels.HEADER_SIZE:
+        return levels.HEADER_SIZE, levels.CHECKSUM_OFFSET, None
+    (_, version, flags, width, height, _, _, _, _, strip_width,
+     _, _) = struct.unpack_from(levels.HEADER_FORMAT, buffer)
+    value_size = 2 if flags & levels.FLAG_16BIT else 1
+    size = None
+    if flags & levels.FLAG_COLUMNS:
+        num_strips = (width + strip_width - 1) // max(strip_width, 1)
+        index_size = (num_strips + 1) * levels.INDEX_ENTRY_TYPE.itemsize
+        size = levels.HEADER_SIZE + index_size
+        if size <= len(buffer):
+            size += struct.unpack_from('>I', buffer, size - 4)[0]
+    elif (flags & levels.FLAG_CODEC_MASK) >> levels.FLAG_CODEC_SHIFT == compress.CODEC_NONE:
+        size = levels.HEADER_SIZE + width * height * value_size
+    bits = 32 if flags & levels.FLAG_CHECKSUM else None
+    return size, levels.CHECKSUM_OFFSET, bits
+
+
+def coplist_layout(buffer):
+    (_, _, flags, num_words, num_relocations, num_labels, strings_size,
+     _) = struct.unpack_from(coplist.HEADER_FORMAT, buffer)
+    size = (coplist.HEADER_SIZE + num_relocations * coplist.RELOCATION_TYPE.itemsize +
+            num_labels * coplist.LABEL_TYPE.itemsize + strings_size + 2 * num_words)
+    bits = 32 if flags & coplist.FLAG_CHECKSUM else None
+    return size, coplist.CHECKSUM_OFFSET, bits
+
+
+# file id -> (header size, layout function)
+FILE_LAYOUTS = {
+    b'RATR0TIL': (struct.calcsize(tiles.HEADER_FORMAT), tiles_layout),
+    b'RATR0SPR': (struct.calcsize(sprites.HEADER_FORMAT), sprites_layout),
+    b'RATR0LVL': (V1_LEVEL_HEADER_SIZE, levels_layout),
+    b'RATR0COP': (coplist.HEADER_SIZE, coplist_layout)
+}
+
+
+def verify_buffer(buffer):
+    """verifies the contents of a RATR0 file, returns a (result, message) pair.
+    Only the header and index are parsed before the checksum is computed,
+    files that have the wrong size fail without being read completely"""
+    fileid = bytes(buffer[:RATR0_FILE_ID_LENGTH])
+    if fileid not in FILE_LAYOUTS:
+        return VERIFY_FAILED, "not a RATR0 file"
+    header_size, layout = FILE_LAYOUTS[fileid]
+    if len(buffer) < header_size:
+        return VERIFY_FAILED, "truncated header"
+    size, checksum_offset, bits = layout(buffer)
+    if size is not None and size != len(buffer):
+        return VERIFY_FAILED, "file size is %d bytes, expected %d" % (len(buffer), size)
+    if bits is None:
+        return VERIFY_NO_CHECKSUM, fileid.decode('ascii')
+    stored = int.from_bytes(buffer[checksum_offset:checksum_offset + bits // 8], 'big')
+    actual = checksum.file_checksum(buffer, checksum_offset, bits)
+    if stored != actual:
+        return VERIFY_FAILED, "checksum mismatch: stored %0*x, computed %0*x" % (bits // 4, stored,
+                                                                              bits // 4, actual)
+    return VERIFY_OK, fileid.decode('ascii')
+
+
+def verify_file(path):
+    """verifies the file at path by memory mapping it, returns (path, result, message)"""
+    try:
+        with open(path, 'rb') as infile:
+            if os.fstat(infile.fileno()).st_size == 0:
+                return path, VERIFY_FAILED, "empty file"
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return (path,) + verify_buffer(buffer)
+    except (OSError, ValueError, struct.error) as e:
+        return path, VERIFY_FAILED, str(e)
+
+
+@profiling.profiled('verify')
+def verify_files(paths, jobs=None):
+    """verifies all files on a pool of jobs threads, returns the results of
+    verify_file() in the order of paths"""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(verify_file, paths))
@@ -9,6 +9,14 @@ dimension and position are all defined in tiles.
 flags:
 
 bit 0: not set -> big endian, set -> little endian
+bit 1-2: codec of the level data: 0 -> uncompressed, 1 -> RLE, 2 -> LZ,
+         3 -> ByteRun1 (see compress.py)
+bit 3: not set -> 8 bit tile numbers, set -> 16 bit tile numbers
+bit 4: not set -> row-major level data
+       set -> column layout, the level is stored as vertical strips of
+              strip_width columns, each column of a strip from top to bottom
+bit 5: not set -> no checksum
+       set -> checksum contains the Adler-32 of the file (see checksum.py)
 
 Header (32 bytes)
 
@@ -21,10 +29,20 @@ vp_width       byte 14-15 viewort width in tiles
 vp_height      byte 16-17 viewort height in tiles
 init_vp_row    byte 18-19 initial row position for viewport
 init_vp_col    byte 20-21 initial column position for viewport
-reserved       byte 22-23 reserved, currently only padding
-checksum       byte 24-27 checksum of the entire file
+strip_width    byte 22-23 width of a strip in the column layout, otherwise 0
+checksum       byte 24-27 Adler-32 of the entire file if bit 5 of flags is set
+reserved2      byte 28-31 reserved, currently only padding
 
-level_data     <width * height bytes> tile numbers, 1-based
+strip_index    only in the column layout: <num_strips + 1> 32 bit offsets of
+               the strips relative to the start of the level data, the last
+               entry is the size of the level data
+level_data     <width * height> 8 or 16 bit tile numbers, 1-based, or
+               the level data encoded by the codec. In the column layout each
+               strip is encoded separately, so it can be read and decoded with
+               a single contiguous read
+
+Version 1 files have a 16 byte header that only contains the identifier,
+version, flags, width, height and a 16 bit checksum.
 
 Note:
 
@@ -35,18 +53,140 @@ For license, see gpl-3.0.txt
 """
 import struct
 import json
+import numpy as np
+
+from ratr0.util import compress, checksum, profiling
+
+FILE_FORMAT_VERSION = 2
+
+# identifier, version, flags, width, height, vp_width, vp_height,
+# init_vp_row, init_vp_col, strip_width, checksum, reserved2
+HEADER_FORMAT = ">8s2B7HII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_ENTRY_TYPE = np.dtype('>u4')
+CHECKSUM_OFFSET = 24
+
+# bits 1-2 of the flags select the codec of the level data
+FLAG_CODEC_SHIFT = 1
+FLAG_CODEC_MASK = 0x06
+FLAG_16BIT = 0x08
+FLAG_COLUMNS = 0x10
+FLAG_CHECKSUM = 0x20
+
+# Tiled stores flipping and rotation in the upper bits of the tile ids
+TILED_FLIP_FLAGS = 0xf0000000
+
+
+def validate_map(level):
+    """checks the tile numbers of the level in a single pass and returns
+    them as an array of the smallest tile number type that fits them"""
+    width = level['width']
+    height = level['height']
+    tile_nums = np.asarray(level['map'], dtype=np.int64)
+    if tile_nums.shape != (width * height,):
+        raise Exception("level map has %d entries, but the level has %dx%d tiles" %
+                        (tile_nums.size, width, height))
+    if tile_nums.size == 0:
+        return tile_nums.astype(np.uint8)
+    flipped = np.flatnonzero(tile_nums & TILED_FLIP_FLAGS)
+    if len(flipped) > 0:
+        raise Exception("%d tiles are flipped or rotated, which is not supported "
+                        "(first at row %d, column %d)" %
+                        (len(flipped), flipped[0] // width, flipped[0] % width))
+    if tile_nums.min() < 0:
+        raise Exception("tile numbers must not be negative")
+    max_tile_num = tile_nums.max()
+    if max_tile_num > 0xffff:
+        raise Exception("tile number %d exceeds the maximum of 65535" % max_tile_num)
+    return tile_nums.astype(np.uint8 if max_tile_num <= 0xff else np.uint16)
+
 
-def write_level(level, outfile, verbose):
+def encode_level(level, codec, strip_width=None):
+    """returns the level data of the level encoded with codec, the size of a
+    tile number in bytes and the strip offsets. If strip_width is None, the
+    data is row-major and there are no strip offsets, otherwise the level is
+    stored in vertical strips of strip_width columns which are encoded
+    separately"""
+    tile_nums = validate_map(level)
+    value_size = tile_nums.itemsize
+    width = level['width']
+    height = level['height']
+    if strip_width is None:
+        return compress.encode(codec, tile_nums, width, value_size), value_size, None
+
+    if strip_width < 1:
+        raise Exception("strip width must be at least 1")
+    # codecs see a strip as a sequence of columns
+    columns = tile_nums.reshape(height, width).T
+    strips = [compress.encode(codec, columns[x:x + strip_width].ravel(), height, value_size)
+              for x in range(0, width, strip_width)]
+    offsets = np.zeros(len(strips) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(strip) for strip in strips])
+    return b''.join(strips), value_size, offsets
+
+
+def compression_report(level, strip_width=None):
+    """returns (codec name, size in bytes, estimated 68000 decode cycles)
+    of the level data for each codec"""
+    report = []
+    for codec, name in compress.CODEC_NAMES.items():
+        payload, value_size, _ = encode_level(level, codec, strip_width)
+        report.append((name, len(payload), compress.decode_cycles(codec, payload, value_size)))
+    return report
+
+
+@profiling.profiled('write_level')
+def write_level(level, outfile, verbose, codec=compress.CODEC_NONE, strip_width=None):
+    """write the level file, if strip_width is set, the level data is stored
+    in the column layout"""
+    payload, value_size, offsets = encode_level(level, codec, strip_width)
+    flags = (codec << FLAG_CODEC_SHIFT) | FLAG_CHECKSUM
+    if value_size == 2:
+        flags |= FLAG_16BIT
+    index = b''
+    if offsets is not None:
+        flags |= FLAG_COLUMNS
+        index = offsets.astype(INDEX_ENTRY_TYPE).tobytes()
+    width = level['width']
+    height = level['height']
+    viewport = level.get('viewport', {})
+    header = struct.pack(HEADER_FORMAT, b'RATR0LVL', FILE_FORMAT_VERSION, flags,
+                         width, height,
+                         viewport.get('width', width), viewport.get('height', height),
+                         viewport.get('y', 0), viewport.get('x', 0),
+                         strip_width or 0, 0, 0)
+    if verbose:
+        print("%d bit tile numbers" % (value_size * 8))
+        for name, size, cycles in compression_report(level, strip_width):
+            print("%-5s %7d bytes %9d cycles (est. 68000 decode)" % (name, size, cycles))
     with open(outfile, 'wb') as out:
-        out.write(b'RATR0LVL')
-        out.write(bytes([1, 0]))
-        height = level['height']
-        width = level['width']
-        checksum = 0
-
-        out.write(struct.pack(">H", width))
-        out.write(struct.pack(">H", height))
-        out.write(struct.pack(">H", checksum))
-
-        for tile_num in level['map']:
-            out.write(struct.pack("B", tile_num))
+        writer = checksum.ChecksumWriter(out, 32)
+        writer.writelines([header, index, payload])
+        writer.patch(CHECKSUM_OFFSET)
+
+
+def read_column(infile, column):
+    """Reads a single column of a level file in the column layout. infile is
+    a seekable file object opened in binary mode. Only the header, the index
+    entries and the strip that contains the column are read. Returns the
+    column's tile numbers from top to bottom"""
+    infile.seek(0)
+    (fileid, version, flags, width, height, vp_width, vp_height,
+     init_vp_row, init_vp_col, strip_width, checksum,
+     reserved2) = struct.unpack(HEADER_FORMAT, infile.read(HEADER_SIZE))
+    if fileid != b'RATR0LVL' or version < 2 or not flags & FLAG_COLUMNS:
+        raise Exception("not a level file in column layout")
+    if column < 0 or column >= width:
+        raise IndexError("column %d out of range (width %d)" % (column, width))
+    num_strips = (width + strip_width - 1) // strip_width
+    strip = column // strip_width
+    infile.seek(HEADER_SIZE + strip * INDEX_ENTRY_TYPE.itemsize)
+    start, end = np.frombuffer(infile.read(2 * INDEX_ENTRY_TYPE.itemsize), dtype=INDEX_ENTRY_TYPE)
+    infile.seek(HEADER_SIZE + (num_strips + 1) * INDEX_ENTRY_TYPE.itemsize + int(start))
+    payload = infile.read(int(end - start))
+
+    codec = (flags & FLAG_CODEC_MASK) >> FLAG_CODEC_SHIFT
+    value_size = 2 if flags & FLAG_16BIT else 1
+    strip_columns = min(strip_width, width - strip * strip_width)
+    values = compress.decode(codec, payload, strip_columns * height, value_size)
+    return values.reshape(strip_columns, height)[column % strip_width]
@@ -0,0 +1,192 @@
+"""
+optimize_clist.py - copper list optimizer and scanline timing
+
+Every copper instruction costs DMA cycles that are not available to the
+blitter. The optimizer removes instructions from a compiled copper list
+that can not change what is displayed:
+
+  - a MOVE that writes the value that the register already has
+  - a MOVE in the vertical blank that is overwritten before the next WAIT
+  - a WAIT for a position that has already been reached, either because
+    an earlier WAIT waited for the same or a later position or because
+    the WAITs are not sorted; its MOVEs are merged into the preceding
+    block, where the copper executes them anyway
+  - a WAIT that is directly followed by a WAIT for a later position
+  - everything after the END instruction
+
+Only registers that keep the value written to them are optimized (colors,
+display window, data fetch, modulos and the bitplane control registers),
+pointer registers are changed by the DMA and strobe registers trigger
+actions on every write. Instructions that labels point to are patched at
+runtime, so they are never removed and the values they write are unknown.
+The optimizer assumes that the registers are only written by the copper
+list, the CPU should patch the list through the labels instead.
+
+The timing report uses the costs of ratr0-calcnumbobs: a MOVE takes 2 DMA
+cycles, a WAIT 3. The copper can only use the even DMA slots, so at most
+COPPER_SLOTS_PER_LINE cycles are available in a scanline.
+"""
+import numpy as np
+
+from ratr0.util import dma, profiling
+from ratr0.util.compile_clist import STD_VARS, WAIT_MASK, END_WORDS
+
+MOVE_CYCLES = dma.COPPER_MOVE_CYCLES
+WAIT_CYCLES = dma.COPPER_WAIT_CYCLES
+# 226 DMA slots per line, the copper only gets the even ones
+COPPER_SLOTS_PER_LINE = 113
+# the first line of the display window, the lines before are in the vertical blank
+DEFAULT_DISPLAY_START = STD_VARS['DIWSTRT_VALUE_320'] >> 8
+# the last line that a WAIT can specify, the following lines wrap around to 0
+WRAP_LINE = 0xff
+
+# registers that keep their value until they are written again
+VALUE_REGISTERS = set(range(STD_VARS['COLOR00'], STD_VARS['COLOR31'] + 2, 2)) | {
+    STD_VARS[name] for name in ['DIWSTRT', 'DIWSTOP', 'DDFSTRT', 'DDFSTOP', 'BPLCON0',
+                                'BPLCON1', 'BPLCON2', 'BPL1MOD', 'BPL2MOD', 'FMODE']} | {
+    0x106, 0x10c, 0x1e4}  # BPLCON3, BPLCON4, DIWHIGH
+# COPJMP1, COPJMP2: jumps, nothing is known about the state after them
+JUMP_REGISTERS = {0x088, 0x08a}
+
+
+def instructions(words):
+    """the (first word, second word) pairs of a copper list"""
+    return np.asarray(words, dtype=np.int64).reshape(-1, 2).tolist()
+
+
+def is_move(first):
+    return first & 1 == 0
+
+
+def is_wait(first, second):
+    """a WAIT with the full position mask, the only kind the optimizer moves"""
+    return first & 1 == 1 and second == WAIT_MASK
+
+
+def wait_position(first):
+    """(line, horizontal position) of a WAIT"""
+    return first >> 8, (first >> 1) & 0x7f
+
+
+@profiling.profiled('optimize_clist')
+def optimize_clist(words, indexes, display_start=DEFAULT_DISPLAY_START):
+    """Returns the optimized list, the label indexes adjusted to it and a
+    list of warnings about WAITs that are not sorted"""
+    pairs = instructions(words)
+    labelled = {(index - 1) // 2 for index in indexes.values()}
+    keep = [True] * len(pairs)
+    warnings = []
+
+    values = {}           # register -> the value it has
+    block_moves = {}      # register -> the instruction that wrote it since the last WAIT
+    position = (0, 0)     # the beam position the copper has at least reached, None if unknown
+    in_vblank = True
+    previous_wait = None  # the last kept WAIT, if no instruction followed it
+
+    for i, (first, second) in enumerate(pairs):
+        if [first, second] == END_WORDS:
+            # nothing after the END is executed
+            if not any([j > i for j in labelled]):
+                keep[i + 1:] = [False] * (len(pairs) - i - 1)
+            break
+        if is_move(first):
+            register = first & 0x1fe
+            previous_wait = None
+            if register in JUMP_REGISTERS:
+                values, block_moves, position, in_vblank = {}, {}, None, False
+            elif register not in VALUE_REGISTERS:
+                pass
+            elif i in labelled:
+                values.pop(register, None)
+                block_moves.pop(register, None)
+            elif values.get(register) == second:
+                keep[i] = False
+            else:
+                if in_vblank and register in block_moves:
+                    # overwritten before anything is displayed
+                    keep[block_moves[register]] = False
+                values[register] = second
+                block_moves[register] = i
+        elif is_wait(first, second) and i not in labelled:
+            wait = wait_position(first)
+            if position is not None and wait <= position:
+                # the copper does not wait, the MOVEs that follow stay in the current block
+                if wait < position:
+                    warnings.append("WAIT %d,%d at index %d is already satisfied at line %d, "
+                                    "its instructions are executed earlier" %
+                                    (wait[1], wait[0], 2 * i, position[0]))
+                keep[i] = False
+                continue
+            if previous_wait is not None:
+                keep[previous_wait] = False
+            previous_wait = i
+            block_moves = {}
+            if wait[0] == WRAP_LINE:
+                # the next WAITs are for lines that wrap around to 0, this
+                # WAIT can not be merged into them
+                position, in_vblank, previous_wait = None, False, None
+            else:
+                position = wait
+                in_vblank = in_vblank and wait[0] < display_start
+        else:
+            # a SKIP, a WAIT with masks or a labelled WAIT: the beam position is unknown
+            values, block_moves, position, in_vblank = {}, {}, None, False
+            previous_wait = None
+            if first & 1 == 1 and second & 1 == 1 and i + 1 < len(pairs):
+                # the instruction after a SKIP is conditional
+                labelled.add(i + 1)
+
+    new_positions = np.concatenate([[0], np.cumsum(keep)])
+    result = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)[np.array(keep, dtype=bool)]
+    new_indexes = {label: int(2 * new_positions[(index - 1) // 2] + 1)
+                   for label, index in indexes.items()}
+    return result.ravel().tolist(), new_indexes, warnings
+
+
+def scanline_cycles(words):
+    """Returns a list of (line, moves, waits, cycles) for every line that
+    executes copper instructions. The instructions after a WAIT are counted
+    in the line it waits for, lines after a WAIT for line 255 are counted
+    from 256 on"""
+    lines = {}
+    line = 0
+    wrapped = False
+    for first, second in instructions(words):
+        if is_move(first):
+            moves, waits = lines.get(line, (0, 0))
+            lines[line] = (moves + 1, waits)
+            continue
+        wait_line = wait_position(first)[0]
+        if [first, second] != END_WORDS and second & 1 == 0:
+            if wrapped and wait_line < WRAP_LINE:
+                wait_line += WRAP_LINE + 1
+            if wait_line > line:
+                line = wait_line
+            if wait_line == WRAP_LINE:
+                wrapped = True
+        moves, waits = lines.get(line, (0, 0))
+        lines[line] = (moves, waits + 1)
+    return [(line, moves, waits, moves * MOVE_CYCLES + waits * WAIT_CYCLES)
+            for line, (moves, waits) in sorted(lines.items())]
+
+
+def total_cycles(words):
+    pairs = np.asarray(words, dtype=np.int64).reshape(-1, 2)
+    num_moves = int(np.count_nonzero(pairs[:, 0] & 1 == 0))
+    return num_moves * MOVE_CYCLES + (len(pairs) - num_moves) * WAIT_CYCLES
+
+
+def timing_report(words, budget=COPPER_SLOTS_PER_LINE):
+    """the lines of the scanline timing report, lines that need more than
+    budget cycles are marked"""
+    lines = ["line  moves  waits  cycles"]
+    over_budget = 0
+    for line, moves, waits, cycles in scanline_cycles(words):
+        marker = ''
+        if cycles > budget:
+            marker = '  > %d' % budget
+            over_budget += 1
+        lines.append("%4d  %5d  %5d  %6d%s" % (line, moves, waits, cycles, marker))
+    lines.append("total: %d cycles, %d lines over the budget of %d cycles" %
+                 (total_cycles(words), over_budget, budget))
+    return lines
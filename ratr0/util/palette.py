@@ -0,0 +1,76 @@
+"""
+palette.py - a shared palette for a set of images
+
+Images that are displayed on the same screen share the hardware palette. This
+module computes a single palette of 2^depth 12 bit colors for a set of
+indexed or truecolor images and remaps every image to it:
+
+  1. the color histograms of all images are added up, so each color is
+     weighted by the number of pixels that use it in the whole set
+  2. the palette is selected from the joint histogram by a median cut and
+     refined with k-means (see quantize.py)
+  3. every image is remapped with the lookup table of the nearest palette
+     color of each 12 bit color
+
+Color 0 is reserved as the transparent/background color: pixels with index 0
+in indexed images and transparent pixels in truecolor images keep color 0.
+Its value is color 0 of the first indexed image, or black.
+"""
+import numpy as np
+
+from ratr0.util import quantize, profiling
+
+
+def image_pixels(im):
+    """the rgb components of the pixels of im and the mask of the pixels that
+    do not have color 0"""
+    rgb, opaque = quantize.image_pixels(im)
+    if im.mode == 'P':
+        opaque = opaque & (np.asarray(im) != 0)
+    return rgb, opaque
+
+
+def background_color(images):
+    """color 0 of the first indexed image in 12 bit precision, black if
+    there is none"""
+    for im in images:
+        palette = im.getpalette() if im.mode == 'P' else None
+        if palette:
+            return tuple((quantize.to_4bit(palette[:3]) * quantize.COMPONENT_STEP).tolist())
+    return (0, 0, 0)
+
+
+def shared_palette(images, depth):
+    """the 12 bit palette keys of at most 2^depth - 1 colors (color 0 is
+    reserved) that represent the colors of all images"""
+    if depth < 1 or depth > quantize.MAX_DEPTH:
+        raise Exception("depth must be between 1 and %d (was %d)" % (quantize.MAX_DEPTH, depth))
+    histogram = np.zeros(4096, dtype=np.int64)
+    for im in images:
+        rgb, opaque = image_pixels(im)
+        histogram += quantize.color_histogram(rgb[opaque])
+    palette_keys = quantize.histogram_palette(histogram, 2 ** depth - 1)
+    if len(palette_keys) == 0:
+        palette_keys = np.zeros(1, dtype=np.int64)
+    return palette_keys
+
+
+@profiling.profiled('shared_palette')
+def remap_images(images, depth, dither=quantize.DITHER_NONE, verbose=False):
+    """Remaps all images to a shared palette of 2^depth entries, returns the
+    indexed images, which all have the identical palette"""
+    palette_keys = shared_palette(images, depth)
+    color0 = background_color(images)
+    result = []
+    for i, im in enumerate(images):
+        rgb, opaque = image_pixels(im)
+        remapped = quantize.remap(rgb, opaque, palette_keys, depth, dither, 1, color0)
+        if verbose:
+            palette = np.array(remapped.getpalette()[:3 * 2 ** depth]).reshape(-1, 3)
+            errors = (palette[np.asarray(remapped)] - rgb.astype(np.int32))[opaque]
+            error = np.sqrt((errors ** 2).sum(axis=1).mean()) if len(errors) > 0 else 0.0
+            print("image %d: %dx%d, rms color error %.1f" % (i, im.width, im.height, error))
+        result.append(remapped)
+    if verbose:
+        print("shared palette: %d of %d colors used" % (len(palette_keys) + 1, 2 ** depth))
+    return result
@@ -0,0 +1,96 @@
+"""
+planar.py - compact planar image data
+
+A PlanarImage holds the bit planes of an image in a single contiguous buffer
+of big endian 16 bit words, stored plane after plane (non-interleaved), which
+is exactly the layout of the data in a RATR0 file. Rows, planes, tiles and
+the interleaved arrangement are all returned as views into this buffer, so
+the words are only copied when they are written out.
+"""
+import numpy as np
+
+WORD_TYPE = np.dtype('>u2')
+
+
+class PlanarImage:
+
+    __slots__ = ('data', 'width')
+
+    def __init__(self, data, width):
+        """data is an array of the shape (depth, height, words per row)"""
+        self.data = data
+        self.width = width
+
+    @classmethod
+    def from_planes(cls, planes, width, height):
+        """create a PlanarImage from a list of planes, each being a list of words"""
+        words_per_row = (width + 15) // 16
+        data = np.array(planes, dtype=WORD_TYPE).reshape(len(planes), height, words_per_row)
+        return cls(data, width)
+
+    @property
+    def depth(self):
+        return self.data.shape[0]
+
+    @property
+    def height(self):
+        return self.data.shape[1]
+
+    @property
+    def words_per_row(self):
+        return self.data.shape[2]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def plane(self, index):
+        """the words of a single plane as a (height, words per row) view"""
+        return self.data[index]
+
+    def row(self, y):
+        """row y of all planes as a (depth, words per row) view"""
+        return self.data[:, y]
+
+    def tile(self, tile_x, tile_y, tile_width, tile_height):
+        """the tile at tile position (tile_x, tile_y) as a PlanarImage view.
+        The tile width has to be a multiple of 16"""
+        if tile_width % 16 > 0:
+            raise ValueError("tile width must be a multiple of 16 (was %d)" % tile_width)
+        tile_words = tile_width // 16
+        y0 = tile_y * tile_height
+        x0 = tile_x * tile_words
+        return PlanarImage(self.data[:, y0:y0 + tile_height, x0:x0 + tile_words],
+                           tile_width)
+
+    def non_interleaved(self):
+        """the planes one after another: (depth, height, words per row)"""
+        return self.data
+
+    def interleaved(self):
+        """the rows of all planes one after another: (height, depth, words per row)"""
+        return self.data.transpose(1, 0, 2)
+
+    def mask(self, depth=1):
+        """a PlanarImage that contains the bitwise "OR" of all planes. If depth
+        is larger than 1, the mask plane is repeated without copying it"""
+        mask_plane = np.bitwise_or.reduce(self.data, axis=0, keepdims=True).astype(WORD_TYPE)
+        return PlanarImage(np.broadcast_to(mask_plane, (depth,) + mask_plane.shape[1:]),
+                           self.width)
+
+    def with_depth(self, depth):
+        """returns a PlanarImage that has additional empty planes up to depth"""
+        if depth <= self.depth:
+            return self
+        data = np.zeros((depth,) + self.data.shape[1:], dtype=WORD_TYPE)
+        data[:self.depth] = self.data
+        return PlanarImage(data, self.width)
+
+    def buffer(self, interleaved=False):
+        """the image data in file layout as a contiguous array, which is only
+        copied if the requested layout differs from the stored one"""
+        view = self.interleaved() if interleaved else self.non_interleaved()
+        return np.ascontiguousarray(view)
+
+    def tobytes(self, interleaved=False):
+        return self.buffer(interleaved).tobytes()
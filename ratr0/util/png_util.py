@@ -1,9 +1,22 @@
 from PIL import Image
+import numpy as np
 import math
 
+from ratr0.util import profiling
+from ratr0.util.planar import PlanarImage
+
+
+def open_image(path):
+    """opens and decodes the image file at path, PIL decodes lazily, so
+    the decoding is forced here to be profiled as a separate stage"""
+    with profiling.stage('decode'):
+        im = Image.open(path)
+        im.load()
+    return im
+
 
 def chunks(l, n):
-    for i in range(0, len(list(l)), n):
+    for i in range(0, len(l), n):
         yield l[i:i+n]
 
 
@@ -16,47 +29,62 @@ def color_to_plane_bits(color, depth):
     return result
 
 
-def extract_planes(im, depth, verbose):
-    """check extract_planes(), seems to be wrong and lose data !!!"""
-    imdata = im.getdata()
+def image_indexes(im):
+    """returns the palette indexes of the image as a 2-dimensional
+    (height x width) array"""
     width, height = im.size
+    if hasattr(im, '__array_interface__'):
+        indexes = np.asarray(im)
+    else:
+        indexes = np.fromiter(im.getdata(), dtype=np.uint8, count=width * height)
+    return indexes.reshape(height, width).astype(np.uint8, copy=False)
+
 
-    map_words_per_row = int(width / 16)
-    if width % 16 > 0:
-        map_words_per_row += 1
+@profiling.profiled('extract_planes')
+def extract_planes_array(im, depth, verbose):
+    """chunky-to-planar conversion of the entire image at once.
+    Returns the planes as a (depth x height x words per row) array of 16 bit
+    words and the number of words per row"""
+    width, height = im.size
+    map_words_per_row = (width + 15) // 16
 
     if verbose:
         print('source image width: %d height: %d' % (width, height))
         print('bitmap words/row: %d'  % map_words_per_row)
 
-    # create the converted planar data
-    planes = [[0] * (map_words_per_row * height) for _ in range(depth)]
-    #print(planes)
-    for y in range(height):
-        x = 0
-        while x < width:
-            # build a word for each plane
-            for i in range(min(16, width - x)):
-                # get the palette index for pixel (x + i, y)
-                color = imdata[y * width + x + i]  # color index
-                planebits = color_to_plane_bits(color, depth)
-                # now we need to "or" the bits into the words in their respective planes
-                wordidx = (x + i) / 16  # word number in current row
-                pos = int(y * map_words_per_row + wordidx)  # list index in the plane
-                for planeidx in range(depth):
-                    if planebits[planeidx]:
-                        planes[planeidx][pos] |= (1 << (15 - (x + i) % 16)) # 1 << ((x + i) % 16)
-            x += 16
+    # pad the rows to a multiple of 16 pixels, then slice out a bit for each
+    # plane and pack 16 of them into a big endian word
+    indexes = np.zeros((height, map_words_per_row * 16), dtype=np.uint8)
+    indexes[:, :width] = image_indexes(im)
+    shifts = np.arange(depth, dtype=np.uint8).reshape(depth, 1, 1)
+    bits = (indexes[np.newaxis] >> shifts) & 1
+    packed = np.packbits(bits, axis=-1)
+    planes = packed.view('>u2').reshape(depth, height, map_words_per_row)
 
     if verbose:
         for i, plane in enumerate(planes):
             print("Plane %d: " % i)
-            words = ['%04x' % w for w in plane]
+            words = ['%04x' % w for w in plane.ravel()]
             print(' '.join(words))
 
     return planes, map_words_per_row
 
 
+def extract_planar_image(im, depth, verbose):
+    """returns the bit planes of the image as a PlanarImage"""
+    planes, map_words_per_row = extract_planes_array(im, depth, verbose)
+    return PlanarImage(planes, im.size[0])
+
+
+def extract_planes(im, depth, verbose):
+    """returns the bit planes of the image as lists of 16 bit words and the
+    number of words per row"""
+    planes, map_words_per_row = extract_planes_array(im, depth, verbose)
+    num_words = planes.shape[1] * planes.shape[2]
+    return planes.reshape(depth, num_words).tolist(), map_words_per_row
+
+
+@profiling.profiled('interleave_planes')
 def interleave_planes(planes, map_words_per_row):
     """transforms a set of bitplanes into a large array of 16-bit
     word rows. each representing a line of an image
@@ -75,6 +103,7 @@ def interleave_planes(planes, map_words_per_row):
     return result
 
 
+@profiling.profiled('make_colors')
 def make_colors(im, final_depth, verbose):
     """
     Extract the palette entries from the image and fills it with 0 entries if
@@ -0,0 +1,192 @@
+"""
+profiling.py - per-stage profiling of the converters
+
+The conversion functions of the library mark their stages (decoding the
+PNG, quantizing, building the palette, the chunky-to-planar conversion,
+the writers, ...) with stage() or the profiled() decorator. While a
+Profiler is enabled, each stage records its wall time, its CPU time and
+the peak memory that was traced by tracemalloc during the stage on top of
+the memory in use when it started. Stages can be nested, a stage includes
+the time and memory of the stages it contains. If no Profiler is enabled,
+the stages cost nothing but a check of a global.
+
+The tools enable the profiler with --profile, which prints a summary of
+the stages to stderr, and --profile_json, which appends a JSON object for
+every stage to a file, so runs can be compared over time:
+
+{"tool": "ratr0-maketiles", "stage": "extract_planes", "depth": 1,
+ "start": 0.012, "wall": 0.0021, "cpu": 0.0020, "peak_memory": 81920}
+
+Tracing memory slows down the conversions, the times of a profiled run
+are only comparable to those of other profiled runs.
+"""
+import contextlib
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+
+class Profiler:
+    """collects the records of the stages, context contains additional
+    fields for every record, like the tool or the asset"""
+
+    def __init__(self, trace_memory=True, **context):
+        self.trace_memory = trace_memory
+        self.context = context
+        self.records = []
+        self.started_tracing = False
+        self.start_time = time.perf_counter()
+        # the traced memory at the start and the peak so far of each open stage
+        self.stack = []
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def traced_memory(self):
+        """(current, peak) traced memory, the peak is reset"""
+        if not tracemalloc.is_tracing():
+            return 0, 0
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        return current, peak
+
+    def add_records(self, records):
+        """adds the records of another Profiler (e.g. of a worker process)
+        as if they were recorded in the current stage"""
+        for record in records:
+            record = dict(record)
+            record.update(self.context)
+            record['depth'] += len(self.stack)
+            self.records.append(record)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        current, peak = self.traced_memory()
+        if self.stack:
+            # the peak of the enclosing stage until now
+            self.stack[-1][1] = max(self.stack[-1][1], peak)
+        self.stack.append([current, current])
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_time
+            cpu = time.process_time() - start_cpu
+            _, peak = self.traced_memory()
+            stage_start, stage_peak = self.stack.pop()
+            stage_peak = max(stage_peak, peak)
+            if self.stack:
+                self.stack[-1][1] = max(self.stack[-1][1], stage_peak)
+            record = dict(self.context)
+            record.update({'stage': name, 'depth': len(self.stack),
+                           'start': start_time - self.start_time, 'wall': wall, 'cpu': cpu,
+                           'peak_memory': stage_peak - stage_start})
+            self.records.append(record)
+
+
+# the enabled Profiler, None if profiling is off
+_profiler = None
+
+
+def enable(trace_memory=True, **context):
+    """enables a new Profiler and returns it"""
+    global _profiler
+    _profiler = Profiler(trace_memory, **context)
+    _profiler.start()
+    return _profiler
+
+
+def disable():
+    """disables the enabled Profiler and returns it"""
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def stage(name):
+    """a context manager that records the stage name if profiling is enabled"""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+
+def profiled(name):
+    """a decorator that records each call of the function as stage name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary(records):
+    """the lines of the summary table: the calls, the total wall and CPU
+    time and the largest peak memory of each stage, in order of the first
+    start of the stages and indented by their nesting depth"""
+    stages = {}
+    for record in sorted(records, key=lambda record: record['start']):
+        entry = stages.setdefault(record['stage'], {'depth': record['depth'], 'calls': 0,
+                                                    'wall': 0.0, 'cpu': 0.0, 'peak_memory': 0})
+        entry['calls'] += 1
+        entry['wall'] += record['wall']
+        entry['cpu'] += record['cpu']
+        entry['peak_memory'] = max(entry['peak_memory'], record['peak_memory'])
+    lines = ["%-28s %6s %10s %10s %12s" % ("stage", "calls", "wall s", "cpu s", "peak KB")]
+    for name, entry in stages.items():
+        lines.append("%-28s %6d %10.4f %10.4f %12.1f" %
+                     ('  ' * entry['depth'] + name, entry['calls'], entry['wall'], entry['cpu'],
+                      entry['peak_memory'] / 1024))
+    return lines
+
+
+def write_json_lines(records, out):
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True))
+        out.write('\n')
+
+
+def add_arguments(parser):
+    """adds the profiling options to the argparse parser of a tool"""
+    parser.add_argument('--profile', action='store_true',
+                        help="print the wall time, CPU time and peak memory of each stage")
+    parser.add_argument('--profile_json', default=None,
+                        help="append the profile of each stage as a JSON line to this file")
+
+
+@contextlib.contextmanager
+def session(args, tool):
+    """Profiles the body as stage 'total' if the profiling options of the
+    tool are set and reports the stages at the end, even if the tool exits
+    early. Returns the Profiler or None"""
+    if not args.profile and args.profile_json is None:
+        yield None
+        return
+    profiler = enable(tool=tool)
+    try:
+        with profiler.stage('total'):
+            yield profiler
+    finally:
+        disable()
+        if args.profile:
+            for line in summary(profiler.records):
+                print(line, file=sys.stderr)
+        if args.profile_json is not None:
+            with open(args.profile_json, 'a') as out:
+                write_json_lines(profiler.records, out)
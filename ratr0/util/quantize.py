@@ -0,0 +1,240 @@
+"""
+quantize.py - color reduction of truecolor images for the Amiga
+
+The OCS and ECS chipsets display 12 bit colors, 4 bits per component, so
+truecolor images are reduced in that color space:
+
+  1. all pixels are mapped to their nearest 12 bit color and counted in a
+     histogram of the 4096 possible colors
+  2. if there are more distinct colors than palette entries, a median cut on
+     the histogram selects the palette, which is refined by a few k-means
+     iterations over the histogram
+  3. a lookup table maps each of the 4096 colors to its nearest palette entry,
+     the image is remapped through it, optionally with ordered (Bayer) or
+     Floyd-Steinberg dithering
+
+Pixels with an alpha value below ALPHA_THRESHOLD become color 0, which is
+reserved for them, so transparent areas end up in neither the image planes
+nor the mask.
+"""
+import time
+import numpy as np
+from PIL import Image
+
+from ratr0.util import profiling
+
+DITHER_NONE = 'none'
+DITHER_ORDERED = 'ordered'
+DITHER_FLOYD_STEINBERG = 'floyd-steinberg'
+DITHER_MODES = [DITHER_NONE, DITHER_ORDERED, DITHER_FLOYD_STEINBERG]
+
+ALPHA_THRESHOLD = 128
+MAX_DEPTH = 8
+# the depth truecolor images are reduced to if no depth is specified, the
+# maximum number of freely selectable colors on OCS/ECS
+DEFAULT_DEPTH = 5
+
+# difference between 2 neighboring 4 bit component values in 8 bit
+COMPONENT_STEP = 17
+KMEANS_ITERATIONS = 8
+
+BAYER_4X4 = np.array([[0, 8, 2, 10],
+                      [12, 4, 14, 6],
+                      [3, 11, 1, 9],
+                      [15, 7, 13, 5]])
+
+
+def to_4bit(values):
+    """rounds 8 bit color components to the nearest 4 bit value"""
+    return (np.asarray(values, dtype=np.int32) * 15 + 127) // 255
+
+
+def color_keys(rgb4):
+    """the 12 bit color values of (..., 3) arrays of 4 bit components"""
+    return (rgb4[..., 0] << 8) | (rgb4[..., 1] << 4) | rgb4[..., 2]
+
+
+def key_colors(keys):
+    """the (..., 3) 4 bit components of 12 bit color values"""
+    keys = np.asarray(keys)
+    return np.stack([(keys >> 8) & 0x0f, (keys >> 4) & 0x0f, keys & 0x0f], axis=-1)
+
+
+def median_cut(keys, counts, num_colors):
+    """Selects at most num_colors 12 bit colors that represent the colors
+    keys (distinct 12 bit values) which occur counts times. The box with the
+    widest component range is split at the median of its pixels until there
+    are num_colors boxes, each box is represented by its weighted mean"""
+    colors = key_colors(keys)
+    boxes = [np.arange(len(keys))]
+    while len(boxes) < num_colors:
+        best, best_range = None, 0
+        for i, box in enumerate(boxes):
+            box_range = (colors[box].max(axis=0) - colors[box].min(axis=0)).max()
+            if box_range > best_range:
+                best, best_range = i, box_range
+        if best is None:
+            break  # every box contains a single color
+        box = boxes.pop(best)
+        box_colors = colors[box]
+        channel = np.argmax(box_colors.max(axis=0) - box_colors.min(axis=0))
+        box = box[np.argsort(box_colors[:, channel], kind='stable')]
+        cumulative = np.cumsum(counts[box])
+        split = np.searchsorted(cumulative, cumulative[-1] / 2.0)
+        split = min(max(split, 1), len(box) - 1)
+        boxes.extend([box[:split], box[split:]])
+
+    palette = np.array([np.rint(np.average(colors[box], axis=0, weights=counts[box]))
+                        for box in boxes], dtype=np.int32)
+    return np.unique(color_keys(palette))
+
+
+def kmeans_refine(keys, counts, palette_keys, iterations=KMEANS_ITERATIONS):
+    """Moves the palette colors to the weighted mean of the histogram colors
+    that are nearest to them, which reduces the total error of a median cut
+    palette. Works on the distinct colors, so the cost does not depend on the
+    number of pixels"""
+    colors = key_colors(keys).astype(np.float64)
+    centers = key_colors(palette_keys).astype(np.float64)
+    weights = counts.astype(np.float64)
+    for _ in range(iterations):
+        distances = ((colors[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+        nearest = np.argmin(distances, axis=1)
+        totals = np.bincount(nearest, weights=weights, minlength=len(centers))
+        used = totals > 0
+        for channel in range(3):
+            sums = np.bincount(nearest, weights=weights * colors[:, channel], minlength=len(centers))
+            centers[used, channel] = sums[used] / totals[used]
+    return np.unique(color_keys(np.clip(np.rint(centers), 0, 15).astype(np.int32)))
+
+
+def nearest_table(palette_keys):
+    """a lookup table of the index of the nearest palette entry for each of
+    the 4096 12 bit colors"""
+    all_colors = key_colors(np.arange(4096))
+    palette_colors = key_colors(palette_keys)
+    distances = ((all_colors[:, np.newaxis, :] - palette_colors[np.newaxis, :, :]) ** 2).sum(axis=2)
+    return np.argmin(distances, axis=1)
+
+
+def color_histogram(rgb):
+    """the number of pixels of each of the 4096 12 bit colors in the
+    (..., 3) 8 bit rgb pixels"""
+    return np.bincount(color_keys(to_4bit(rgb)).ravel(), minlength=4096)
+
+
+def histogram_palette(histogram, num_colors):
+    """the 12 bit palette of at most num_colors colors for a color histogram"""
+    keys = np.flatnonzero(histogram)
+    if len(keys) <= num_colors:
+        return keys
+    palette_keys = median_cut(keys, histogram[keys], num_colors)
+    return kmeans_refine(keys, histogram[keys], palette_keys)
+
+
+def select_palette(rgb, num_colors):
+    """the 12 bit palette of at most num_colors colors for the (n, 3) 8 bit rgb pixels"""
+    return histogram_palette(color_histogram(rgb), num_colors)
+
+
+def dither_ordered(rgb, table, num_colors):
+    """ordered dithering with a 4x4 Bayer matrix, the threshold offsets span
+    the average distance between the palette colors in each component, which
+    is estimated as 255 / cube root of the number of colors"""
+    height, width = rgb.shape[:2]
+    thresholds = (BAYER_4X4 + 0.5) / 16.0 - 0.5
+    offsets = np.tile(thresholds, ((height + 3) // 4, (width + 3) // 4))[:height, :width]
+    spread = max(COMPONENT_STEP, 255.0 / num_colors ** (1 / 3.0))
+    values = np.clip(rgb + offsets[:, :, np.newaxis] * spread, 0, 255)
+    return table[color_keys(to_4bit(np.rint(values)))]
+
+
+def dither_floyd_steinberg(rgb, table, palette8, opaque):
+    """Floyd-Steinberg dithering. A pixel only depends on its left neighbor
+    and the 3 pixels above, so all pixels on a line x + 2y = t can be
+    processed together, which needs width + 2 * height vectorized steps"""
+    height, width = rgb.shape[:2]
+    values = np.zeros((height + 1, width + 2, 3), dtype=np.float32)
+    values[:height, 1:width + 1] = rgb
+    indexes = np.zeros((height, width), dtype=np.intp)
+    for t in range(width + 2 * (height - 1)):
+        ys = np.arange(max(0, (t - width + 2) // 2), min(height - 1, t // 2) + 1)
+        xs = t - 2 * ys
+        # values has a border of 1 column on each side and 1 row at the bottom
+        old = np.clip(values[ys, xs + 1], 0, 255)
+        index = table[color_keys(to_4bit(np.rint(old)))]
+        indexes[ys, xs] = index
+        error = (old - palette8[index]) * opaque[ys, xs, np.newaxis]
+        values[ys, xs + 2] += error * (7 / 16.0)
+        values[ys + 1, xs] += error * (3 / 16.0)
+        values[ys + 1, xs + 1] += error * (5 / 16.0)
+        values[ys + 1, xs + 2] += error * (1 / 16.0)
+    return indexes
+
+
+def image_pixels(im):
+    """the 8 bit rgb components of the pixels as a (height, width, 3) array
+    and the mask of the opaque pixels"""
+    rgba = np.asarray(im.convert('RGBA'))
+    return rgba[:, :, :3], rgba[:, :, 3] >= ALPHA_THRESHOLD
+
+
+def remap(rgb, opaque, palette_keys, depth, dither=DITHER_NONE, first_color=0, color0=(0, 0, 0)):
+    """Maps the (height, width, 3) rgb pixels to the 12 bit palette colors
+    palette_keys, which start at index first_color of the resulting palette
+    of 2^depth entries. Pixels that are not opaque become color 0. Returns the
+    indexed image"""
+    rgb = rgb.astype(np.float32)
+    table = nearest_table(palette_keys)
+    palette8 = key_colors(palette_keys).astype(np.float32) * COMPONENT_STEP
+
+    if dither == DITHER_ORDERED:
+        indexes = dither_ordered(rgb, table, len(palette_keys))
+    elif dither == DITHER_FLOYD_STEINBERG:
+        indexes = dither_floyd_steinberg(rgb, table, palette8, opaque)
+    else:
+        indexes = table[color_keys(to_4bit(rgb.astype(np.int32)))]
+
+    indexes = np.where(opaque, indexes + first_color, 0).astype(np.uint8)
+    palette = np.zeros((2 ** depth, 3), dtype=np.uint8)
+    palette[0] = color0
+    palette[first_color:first_color + len(palette_keys)] = palette8.astype(np.uint8)
+    result = Image.fromarray(indexes, mode='P')
+    result.putpalette(palette.ravel().tolist())
+    return result
+
+
+def quantize(im, depth=DEFAULT_DEPTH, dither=DITHER_NONE, verbose=False, reserve_color0=False):
+    """Reduces the image to 2^depth 12 bit colors and returns it as an
+    indexed image with a palette of 2^depth entries. If the image has
+    transparent pixels or reserve_color0 is set (e.g. for sprites, where
+    color 0 is always transparent), transparent pixels are mapped to
+    color 0, which is black and not used for any other pixel"""
+    if depth < 1 or depth > MAX_DEPTH:
+        raise Exception("depth must be between 1 and %d (was %d)" % (MAX_DEPTH, depth))
+    if dither not in DITHER_MODES:
+        raise Exception("unknown dither mode '%s', must be one of %s" % (dither, ", ".join(DITHER_MODES)))
+    start_time = time.perf_counter()
+    rgb, opaque = image_pixels(im)
+    transparent = reserve_color0 or not opaque.all()
+
+    # color 0 is reserved for transparent pixels
+    num_colors = 2 ** depth - (1 if transparent else 0)
+    palette_keys = select_palette(rgb[opaque], num_colors)
+    if len(palette_keys) == 0:
+        palette_keys = np.zeros(1, dtype=np.int64)
+    result = remap(rgb, opaque, palette_keys, depth, dither, 1 if transparent else 0)
+    if verbose:
+        print("quantized to %d of %d colors (%s dithering%s) in %.3f s" %
+              (len(palette_keys), 2 ** depth, dither,
+               ", color 0 transparent" if transparent else "", time.perf_counter() - start_time))
+    return result
+
+
+@profiling.profiled('quantize')
+def to_indexed(im, depth=None, dither=DITHER_NONE, verbose=False, reserve_color0=False):
+    """returns indexed images unchanged and quantizes all other images to
+    2^depth colors (default: DEFAULT_DEPTH)"""
+    if im.mode in ('P', '1'):
+        return im
+    return quantize(im, DEFAULT_DEPTH if depth is None else depth, dither, verbose, reserve_color0)
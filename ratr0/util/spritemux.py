@@ -0,0 +1,250 @@
+"""
+spritemux.py - offline sprite channel multiplexing
+
+The Amiga has 8 hardware sprite channels, but a channel can display another
+sprite further down the screen once its current sprite has ended: the sprite
+DMA fetches the control words of the next sprite in the line after the last
+line of the previous one. This module plans the reuse of the channels for
+every frame of a game offline, so the runtime only has to follow a table.
+
+The input is a list of frames, each a list of sprite placements:
+
+{
+  "frames": [
+    [{"name": "enemy1", "x": 40, "y": 30, "height": 16},
+     {"name": "boss", "x": 100, "y": 80, "height": 32, "width": 32, "attached": true}],
+    ...
+  ]
+}
+
+or a Tiled map in JSON format, where each object layer is a frame and each
+object a placement (a boolean custom property "attached" marks attached
+sprites).
+
+A placement wider than 16 pixels needs a channel for each 16 pixel column,
+an attached (16 color) placement needs an even/odd pair of channels for each
+column. The channels are assigned with the greedy interval partitioning
+algorithm: the placements are processed by their top line, each one takes
+the channel (or pair) that is free at this line and became free last, a
+channel is free again reuse_gap lines after the end of its sprite. For
+placements that do not use attached pairs, this uses the minimum number of
+channels that is possible. Placements that do not find a channel overflow
+and are reported.
+"""
+import json
+import os
+
+from ratr0.util import profiling
+
+NUM_CHANNELS = 8
+SPRITE_WIDTH = 16
+# lines between the end of a sprite and the start of the next sprite on the
+# same channel, the DMA needs a line to fetch the next control words
+DEFAULT_REUSE_GAP = 1
+# set in the channel word of the odd channel of an attached pair
+CHANNEL_ATTACHED = 0x80
+ENTRY_WORDS = 5
+
+
+class Placement:
+
+    def __init__(self, name, x, y, height, width=SPRITE_WIDTH, attached=False):
+        if height < 1 or width < 1:
+            raise Exception("sprite '%s' has an invalid size %dx%d" % (name, width, height))
+        self.name = name
+        self.x = x
+        self.y = y
+        self.height = height
+        self.width = width
+        self.attached = attached
+
+    def num_columns(self):
+        return (self.width + SPRITE_WIDTH - 1) // SPRITE_WIDTH
+
+    def num_channels(self):
+        return self.num_columns() * (2 if self.attached else 1)
+
+    def __str__(self):
+        return "%s (%d,%d %dx%d%s)" % (self.name, self.x, self.y, self.width, self.height,
+                                       ", attached" if self.attached else "")
+
+
+def read_frames(data):
+    """the frames as lists of Placements from the frames JSON format or a
+    Tiled map with object layers"""
+    if 'layers' in data:
+        return [[tiled_placement(obj) for obj in layer['objects']]
+                for layer in data['layers'] if layer.get('type') == 'objectgroup']
+    if 'frames' not in data:
+        raise Exception("expected a 'frames' list or a Tiled map with object layers")
+    return [[Placement(sprite.get('name', 'sprite%d' % i), sprite['x'], sprite['y'],
+                       sprite['height'], sprite.get('width', SPRITE_WIDTH),
+                       sprite.get('attached', False))
+             for i, sprite in enumerate(frame)]
+            for frame in data['frames']]
+
+
+def tiled_placement(obj):
+    properties = {prop['name']: prop['value'] for prop in obj.get('properties', [])}
+    y = int(obj['y'])
+    # the position of tile objects is their bottom left corner
+    if 'gid' in obj:
+        y -= int(obj['height'])
+    return Placement(obj.get('name') or 'object%d' % obj['id'], int(obj['x']), y,
+                     int(obj['height']), int(obj['width']),
+                     properties.get('attached', False))
+
+
+class FramePlan:
+    """the channel assignment of a frame: entries is a list of
+    (channel, placement index, column, attached) sorted by channel and
+    top line, overflows the indexes of the placements without channels"""
+
+    def __init__(self, placements, entries, overflows, max_channels):
+        self.placements = placements
+        self.entries = entries
+        self.overflows = overflows
+        self.max_channels = max_channels
+
+
+def free_group(free_at, placement):
+    """the channel, or the even/odd channel pair of an attached placement,
+    that is free at the top line of placement and became free last, None
+    if there is none. Taking the channel that became free last keeps the
+    channels that are free earlier for the placements further up"""
+    if placement.attached:
+        groups = [(channel, channel + 1) for channel in free_at
+                  if channel % 2 == 0 and channel + 1 in free_at]
+    else:
+        groups = [(channel,) for channel in free_at]
+    best, best_free = None, None
+    for group in groups:
+        group_free = max([free_at[channel] for channel in group])
+        if group_free <= placement.y and (best is None or group_free > best_free):
+            best, best_free = group, group_free
+    return best
+
+
+def assign_channels(placements, channels=range(NUM_CHANNELS), reuse_gap=DEFAULT_REUSE_GAP):
+    """assigns the channels to the placements of a frame, returns a FramePlan"""
+    # the first line at which each channel is free
+    free_at = {channel: -reuse_gap for channel in channels}
+    entries = []
+    overflows = []
+    for i in sorted(range(len(placements)), key=lambda i: (placements[i].y, placements[i].x)):
+        placement = placements[i]
+        # a placement either gets channels for all of its columns or none
+        tentative = dict(free_at)
+        assigned = []
+        for column in range(placement.num_columns()):
+            group = free_group(tentative, placement)
+            if group is None:
+                break
+            for channel in group:
+                tentative[channel] = placement.y + placement.height + reuse_gap
+                assigned.append((channel, i, column, placement.attached and channel % 2 == 1))
+        if len(assigned) == placement.num_channels():
+            free_at = tentative
+            entries.extend(assigned)
+        else:
+            overflows.append(i)
+
+    entries.sort(key=lambda entry: (entry[0], placements[entry[1]].y))
+    return FramePlan(placements, entries, overflows, channel_demand(placements, reuse_gap))
+
+
+def channel_demand(placements, reuse_gap=DEFAULT_REUSE_GAP):
+    """the maximum number of channels that are needed at the same time,
+    including the reuse gap, this is a lower bound of the channels that a
+    frame needs"""
+    events = []
+    for placement in placements:
+        events.append((placement.y + placement.height + reuse_gap, -placement.num_channels()))
+        events.append((placement.y, placement.num_channels()))
+    result = current = 0
+    # at the same line, ending sprites are counted before starting ones
+    for _, change in sorted(events):
+        current += change
+        result = max(result, current)
+    return result
+
+
+@profiling.profiled('plan_frames')
+def plan_frames(frames, channels=range(NUM_CHANNELS), reuse_gap=DEFAULT_REUSE_GAP):
+    return [assign_channels(placements, channels, reuse_gap) for placements in frames]
+
+
+def overflow_report(plans):
+    """the lines of the report of the frames that overflow"""
+    lines = []
+    for frame, plan in enumerate(plans):
+        if len(plan.overflows) == 0:
+            continue
+        lines.append("frame %d: %d of %d sprites without a channel, %d channels needed" %
+                     (frame, len(plan.overflows), len(plan.placements), plan.max_channels))
+        for i in plan.overflows:
+            lines.append("  %s" % plan.placements[i])
+    return lines
+
+
+def channel_table(plans):
+    """the start index of each frame's entries (with a final entry for the
+    end) and the words of the entries: channel, placement, x, y, height"""
+    frame_starts = [0]
+    words = []
+    for plan in plans:
+        for channel, i, column, attached in plan.entries:
+            placement = plan.placements[i]
+            words.extend([channel | (CHANNEL_ATTACHED if attached else 0), i,
+                          placement.x + column * SPRITE_WIDTH, placement.y, placement.height])
+        frame_starts.append(len(words) // ENTRY_WORDS)
+    return frame_starts, words
+
+
+@profiling.profiled('write_tables')
+def write_tables(plans, outfile, table_name="sprite_mux"):
+    """writes the channel tables as C source file outfile and a header file"""
+    src_file = os.path.basename(outfile)
+    header_file = os.path.join(os.path.dirname(outfile), src_file.replace(".c", ".h"))
+    header_name = table_name.upper()
+    frame_starts, words = channel_table(plans)
+
+    with open(header_file, "w") as out:
+        out.write("#pragma once\n")
+        out.write("#ifndef __%s__\n" % header_name)
+        out.write("#define __%s__\n" % header_name)
+        out.write("\n#define %s_NUM_FRAMES (%d)\n" % (header_name, len(plans)))
+        out.write("#define %s_ENTRY_WORDS (%d)\n" % (header_name, ENTRY_WORDS))
+        out.write("#define %s_CHANNEL_ATTACHED (0x%02x)\n" % (header_name, CHANNEL_ATTACHED))
+        out.write("\n/* index of the first entry of each frame, the last element is the end */\n")
+        out.write("extern UINT16 %s_frames[];\n" % table_name)
+        out.write("/* channel, sprite, x, y, height of each entry, sorted by channel and y */\n")
+        out.write("extern UINT16 %s_entries[];\n\n" % table_name)
+        out.write("#endif /* __%s__ */\n" % header_name)
+
+    with open(outfile, "w") as out:
+        out.write("#include <ratr0/data_types.h>\n\n")
+        out.write("UINT16 %s_frames[] = {\n" % table_name)
+        out.write("\t%s\n" % ', '.join(['%d' % start for start in frame_starts]))
+        out.write("};\n\n")
+        out.write("UINT16 %s_entries[] = {\n" % table_name)
+        for i in range(0, len(words), ENTRY_WORDS):
+            out.write("\t%s,\n" % ', '.join(['%d' % word for word in words[i:i + ENTRY_WORDS]]))
+        if len(words) == 0:
+            out.write("\t0\n")
+        out.write("};\n")
+
+
+def plan_file(inpath, outfile, table_name="sprite_mux", channels=range(NUM_CHANNELS),
+              reuse_gap=DEFAULT_REUSE_GAP, verbose=False):
+    """plans the frames in the JSON file inpath, writes the tables and
+    returns the overflow report"""
+    with open(inpath) as infile:
+        frames = read_frames(json.load(infile))
+    plans = plan_frames(frames, channels, reuse_gap)
+    if verbose:
+        for frame, plan in enumerate(plans):
+            print("frame %d: %d sprites, %d channel entries, %d channels needed" %
+                  (frame, len(plan.placements), len(plan.entries), plan.max_channels))
+    write_tables(plans, outfile, table_name)
+    return overflow_report(plans)
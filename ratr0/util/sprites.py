@@ -8,6 +8,8 @@ A sprite sheet file has this format:
 flags:
 
 bit 0: not set -> big endian, set -> little endian
+bit 1: not set -> no checksum
+       set -> checksum contains the CRC-16 of the file (see checksum.py)
 
 Header (20 bytes)
 
@@ -18,7 +20,7 @@ reserved1      byte 10
 palette_size   byte 11    number of color entries in the palette (max 16)
 num_sprites    byte 12-13 number of sprites in the data
 imgdata_size   byte 14-17 size of image data
-checksum       byte 18-19 checksum of the header (unused)
+checksum       byte 18-19 CRC-16 of the file if bit 1 of flags is set
 
 spr0_offset    byte 20-21 offset in the sprite data
 ...
@@ -27,12 +29,14 @@ image_data     <imgdata_size> bytes
 """
 
 from PIL import Image
+import numpy as np
 import struct
 import math
 import sys
 import os
 
-from ratr0.util import png_util
+from ratr0.util import png_util, checksum, profiling
+from ratr0.util.planar import WORD_TYPE
 
 """
 Write a format that can be instantly used as a sprite sheet.
@@ -46,27 +50,33 @@ So, each sprite is
 if a 4 bitplane source was used, the following data structure will be the same,
 except that the ATTACH flag is set
 
-if the width was a multiple of 16, there will be data for up to 8 sprites in a row
+if the width was a multiple of 16, there will be data for up to 8 sprites in a row,
+the image can contain several rows of frames (see write_sprites())
 
 """
 FILE_FORMAT_VERSION = 1
+# identifier, version, flags, reserved1, palette_size, num_sprites,
+# imgdata_size, checksum
+HEADER_FORMAT = ">8s4BHIH"
+CHECKSUM_OFFSET = 18
+FLAG_CHECKSUM = 0x02
 
 class SpriteInfoHeader:
 
-    def __init__(self, version, flags, num_colors, num_sprites, imgdata_size):
+    def __init__(self, version, flags, num_colors, num_sprites, imgdata_size, checksum=0):
         self.version = version
         self.flags = flags
         self.num_colors = num_colors
         self.imgdata_size = imgdata_size
         self.num_sprites = num_sprites
-        self.checksum = 0
+        self.checksum = checksum
+
+    def header_bytes(self):
+        return struct.pack(HEADER_FORMAT, b'RATR0SPR', self.version, self.flags, 0,
+                           self.num_colors, self.num_sprites, self.imgdata_size, self.checksum)
 
     def write(self, outfile):
-        outfile.write(b'RATR0SPR')
-        outfile.write(bytes([self.version, self.flags, 0, self.num_colors]))
-        outfile.write(struct.pack(">H", self.num_sprites))
-        outfile.write(struct.pack(">I", self.imgdata_size))
-        outfile.write(struct.pack(">H", self.checksum))
+        outfile.write(self.header_bytes())
 
     def __str__(self):
         out = "Version: %d\n" % self.version
@@ -78,10 +88,47 @@ class SpriteInfoHeader:
         return out
 
 
-def write_sprites(im, outpath, verbose, generatec):
+def sprite_structures(image, frame_height, attach):
+    """Builds the sprite structures of all frames in a single array pass.
+    image is a PlanarImage with 2 or 4 planes, whose height is a multiple of
+    frame_height. The sprites are ordered by frame row, then 16 pixel column,
+    then plane pair. Returns a (num sprites, frame_height + 2, 2) array of
+    words: the 2 control words, the words of both planes for each row and
+    the 2 end-of-data words"""
+    depth, height, columns = image.data.shape
+    rows = height // frame_height
+    # (pairs, 2, rows, frame_height, columns) -> (rows, columns, pairs, frame_height, 2)
+    words = (image.data.reshape(depth // 2, 2, rows, frame_height, columns)
+             .transpose(2, 4, 0, 3, 1)
+             .reshape(-1, frame_height, 2))
+    result = np.zeros((len(words), frame_height + 2, 2), dtype=WORD_TYPE)
+    # the control words store the height and the attachment bit in the file
+    result[:, 0] = (frame_height, attach)
+    result[:, 1:-1] = words
+    return result
+
+
+def c_source(colors, structures):
+    """the C source code of the palette and the sprite structures, built
+    with a single format operation"""
+    num_sprites, num_rows = structures.shape[:2]
+    palette = "UWORD palette[] = {\n  %s\n};\n\n" % ', '.join(['0x%04x' % (color & 0x0fff)
+                                                             for color in colors])
+    sprite_format = ("UWORD __chip sprdata%d[] = {\n" +
+                     "  0x%04x, 0x%04x,\n" * (num_rows - 1) +
+                     "  0x0000, 0x0000\n};\n\n")
+    values = np.empty((num_sprites, 1 + 2 * (num_rows - 1)), dtype=np.int64)
+    values[:, 0] = np.arange(num_sprites)
+    values[:, 1:] = structures[:, :-1].reshape(num_sprites, -1)
+    return palette + (sprite_format * num_sprites) % tuple(values.ravel().tolist())
+
+
+@profiling.profiled('write_sprites')
+def write_sprites(im, outpath, verbose, generatec, frame_height=None):
     """
-    This function expects sprites to be layed out in a single row that has a width
-    of a multiple of 16
+    Sprite frames are 16 pixels wide and frame_height (default: the image
+    height) pixels high, the image contains rows of frames. A frame row of
+    a width that is a multiple of 16 contains width / 16 frames
     """
     colors = png_util.make_colors(im, None, verbose)
     depth = int(math.log2(len(colors)))
@@ -92,129 +139,49 @@ def write_sprites(im, outpath, verbose, generatec):
         print("Sprite Colors:")
         print(['%03x' % c for c in colors])
 
-    planes, map_words_per_row = png_util.extract_planes(im, depth, verbose)
+    if frame_height is None:
+        frame_height = im.height
+    if im.width % 16 > 0:
+        raise Exception("Image width must be a multiple of 16 (was %d)" % im.width)
+    if frame_height < 1 or im.height % frame_height > 0:
+        raise Exception("Image height must be a multiple of the frame height %d (was %d)" %
+                        (frame_height, im.height))
+    if depth > 4:
+        raise Exception('%d exceeded maximum number of planes (should be at most %d)' % (depth, 4))
+
+    image = png_util.extract_planar_image(im, depth, verbose)
     # introduce a zero plane if the number of planes is 1 or 3
-    if len(planes) == 1 or len(planes) == 3:
-        ref_plane = planes[-1]
-        add_plane = [0] * len(ref_plane)
-        planes.append(add_plane)
+    if depth == 1 or depth == 3:
         depth += 1
+        image = image.with_depth(depth)
 
-    if im.width % 16 > 0:
-        raise Exception("Image width must be a multiple of 16 (was %d)" % im.width)
-    if len(planes) > 4:
-        raise Exception('%d exceeded maximum number of planes (should be at most %d)' % (len(planes), 4))
-    num_sprites = int((im.width / 16) * (depth / 2))
-
-    imgdata_size = 0
-    if len(planes) == 4:
-        attach = 0x80
-        if verbose:
-            print("writing %d sprites (attached)" % num_sprites)
-    else:
-        attach = 0x00
-        if verbose:
-            print("writing %d sprites" % num_sprites)
-
-    for i, plane in enumerate(planes):
-        if verbose:
-            print('--  PLANE %d ---------------' % i)
-        for w in plane:
-            hexstr = '%04x' % w
-            binstr = format(w, '016b')
-            if verbose:
-                print('%s %s' % (hexstr, binstr))
-            imgdata_size += 2  # add up the size
-    imgdata_size += 8 * num_sprites  # add the sprite control words for each sprite
-
-
-    # subdivide image data by planes and horizontal size
-    if len(planes) == 2:
-        vbatches = [planes]
-    else:  # 4 planes
-        vbatches = [planes[:2], planes[2:]]
-    xparts = int(im.width / 16)
-    sprite_height = im.height
+    attach = 0x80 if depth == 4 else 0x00
+    structures = sprite_structures(image, frame_height, attach)
+    num_sprites = len(structures)
+    if verbose:
+        print("writing %d sprites%s, %d frames of %dx%d" %
+              (num_sprites, " (attached)" if attach else "",
+               (im.width // 16) * (im.height // frame_height), 16, frame_height))
 
     if generatec:
-        outstr = ""  # for generating C source code
-        outstr += "UWORD palette[] = {\n"
-        outcols = []
-        for color in colors:
-            outcols.append('0x%04x' % (color & 0x0fff))
-        outstr += "  " + ', '.join(outcols)
-        outstr += "\n};\n\n"
-
-        sprite_num = 0
-        xpos = 0  # xpos if we have wide sprites
-        while xpos < xparts:
-            for write_planes in vbatches:
-                p0 = write_planes[0]
-                p1 = write_planes[1]
-
-                if verbose:
-                    print("writing sprite number %d (height: %d, attach: %02x)" % (sprite_num, sprite_height, attach))
-                outstr += "UWORD __chip sprdata%d[] = {\n" % sprite_num
-                outstr += "  0x%04x, 0x%04x,\n" % (sprite_height, attach)
-
-                num_rows = int(len(p0) / xparts)
-                for i in range(num_rows):
-                    idx = i * xparts + xpos
-                    outstr += "  0x%04x, 0x%04x,\n" % (p0[idx], p1[idx])
-
-                # end-of-data
-                outstr += "  0x0000, 0x0000\n"
-                outstr += "};\n\n"
-
-                # next sprite
-                sprite_num += 1
-            xpos += 1  # advance x position by 16 pixel in case the sprite is wide
-
         with open(outpath, 'w') as outfile:
-            outfile.write(outstr)
-    else:
-        header = SpriteInfoHeader(FILE_FORMAT_VERSION, 0, len(colors), num_sprites, imgdata_size)
-        with open(outpath, 'wb') as outfile:
-            header.write(outfile)
-
-            # 1. write sprite descriptors
-            for i in range(num_sprites):
-                # offset into the data, height * num planes * 2 bytes (16 pixels) + 8 bytes overhead
-                outfile.write(struct.pack(">H", i * (im.height * 4 + 8)))
-
-            # 2. write the palette entries used
-            for color in colors:
-                outfile.write(struct.pack(">H", (color & 0x0fff)))
-
-            # 3. write sprite data
-            sprite_num = 0
-            xpos = 0  # xpos if we have wide sprites
-            while xpos < xparts:
-                for write_planes in vbatches:
-                    p0 = write_planes[0]
-                    p1 = write_planes[1]
-
-                    if verbose:
-                        print("writing sprite number %d (height: %d, attach: %02x)" % (sprite_num, sprite_height, attach))
-                    # now write the sprite structures
-                    # The 2 start words, write the height in rows into the sprite
-                    # so the reader knows where the next sprite is
-                    outfile.write(struct.pack('>H', sprite_height))  # vstart/hstart word, but in file stores height
-                    outfile.write(struct.pack('>H', attach))  # vstop+control, but in file it stores attachment bit
-
-                    num_rows = int(len(p0) / xparts)
-                    for i in range(num_rows):
-                        idx = i * xparts + xpos
-                        outfile.write(struct.pack('>H', p0[idx]))
-                        outfile.write(struct.pack('>H', p1[idx]))
-
-                    # end-of-data
-                    outfile.write(struct.pack('>H', 0))
-                    outfile.write(struct.pack('>H', 0))
-
-                    # next sprite
-                    sprite_num += 1
-                xpos += 1  # advance x position by 16 pixel in case the sprite is wide
+            outfile.write(c_source(colors, structures))
+        return
+
+    sprite_size = structures[0].nbytes
+    if (num_sprites - 1) * sprite_size > 0xffff:
+        raise Exception("too many sprites for 16 bit offsets (%d sprites of %d bytes)" %
+                        (num_sprites, sprite_size))
+    header = SpriteInfoHeader(FILE_FORMAT_VERSION, FLAG_CHECKSUM, len(colors), num_sprites,
+                              structures.nbytes)
+    # offsets of the sprites in the sprite data
+    offsets = (np.arange(num_sprites) * sprite_size).astype(WORD_TYPE)
+    with open(outpath, 'wb') as out:
+        # the checksum is computed while the data is written
+        outfile = checksum.ChecksumWriter(out, 16)
+        outfile.writelines([header.header_bytes(), offsets,
+                            (np.array(colors) & 0x0fff).astype(WORD_TYPE), structures])
+        outfile.patch(CHECKSUM_OFFSET)
 
 
 def read_sprite_info(infile):
@@ -226,4 +193,4 @@ def read_sprite_info(infile):
     num_sprites = int.from_bytes(infile.read(2), byteorder=byte_order)
     imgdata_size = int.from_bytes(infile.read(4), byteorder=byte_order)
     checksum = int.from_bytes(infile.read(2), byteorder=byte_order)
-    return SpriteInfoHeader(version, flags, num_colors, num_sprites, imgdata_size)
+    return SpriteInfoHeader(version, flags, num_colors, num_sprites, imgdata_size, checksum)
@@ -7,7 +7,6 @@ RATR0 engine.
 """
 import json
 import os
-from PIL import Image
 
 from ratr0.util import tiles, levels, png_util
 
@@ -17,7 +16,7 @@ def convert_tiles(intiles, indir, outfile, non_interleaved,
     imagepath = os.path.join(indir, intiles["image"])
     tile_width = intiles['tilewidth']
     tile_height = intiles['tileheight']
-    im = Image.open(imagepath)
+    im = png_util.open_image(imagepath)
     colors = png_util.make_colors(im, force_depth, verbose)
     tiles.write_tiles(im, outfile, [tile_width, tile_height], colors,
                       palette24=palette24,
@@ -17,13 +17,21 @@ bit 2: not set -> interleaved format
        set -> non-interleaved
 bit 3: not set -> no mask
        set -> contains mask plane
+bit 4: not set -> raw image data
+       set -> compressed image data, reserved1 contains the codec id
+bit 5: not set -> no checksum
+       set -> checksum contains the CRC-16 of the file (see checksum.py)
+bit 6: not set -> no crop table
+       set -> the palette is followed by the crop table
+bit 7: not set -> no shift table
+       set -> pre-shifted BOB sheet, the image data is preceded by the shift table
 
 Header (32 bytes)
 
 'RATR0TIL'     byte 0-7   identifier
 version        byte 8     file format version
 flags          byte 9     special flags
-reserved1      byte 10    reserved, currently padding
+reserved1      byte 10    codec id of compressed image data (see compress.py), 0 otherwise
 bmdepth        byte 11    image depth in number of bits
 width          byte 12-13 image width in pixels
 height         byte 14-15 image height in pixels
@@ -32,27 +40,71 @@ tile_size_v    byte 18-19 tile size vertically
 num_tiles_h    byte 20-21 number of tiles horizontally
 num_tiles_v    byte 22-23 number of tiles vertically
 palette_size   byte 24-25 number of color entries in the palette
-imgdata_size   byte 26-29 size of image data
-checksum       byte 30-31 checksum of the header (unused)
-
-palette_data   byte 30-<30 + |size palette_data|>
-image_data     <palette_data + |size palette_data|>
+imgdata_size   byte 26-29 size of image data (uncompressed)
+checksum       byte 30-31 CRC-16 of the file if bit 5 of flags is set
+
+palette_data   byte 32-<32 + |size palette_data|>
+crop_table     num_tiles_h * num_tiles_v * 8 bytes if bit 6 of flags is set
+shift_table    2 + num_tiles_h * num_tiles_v / num_shifts * 2 bytes if bit 7 of flags is set
+image_data     <palette_data + |size palette_data| + |size crop_table| + |size shift_table|>
+
+The crop table has an entry of 4 words for each tile, in the order of the
+tiles in the sheet: the offset of the tight bounding box of the non-zero
+pixels within the tile in words and rows, followed by its width in words
+and its height in rows. An empty tile has an entry of 0 words. The engine
+can restrict the blits of a tile or BOB to this region.
+
+A pre-shifted BOB sheet contains num_shifts copies of each BOB of the
+source image, copy k is shifted right by k * 16 / num_shifts pixels and
+one word wider than the BOB, so the shifted copies still need the extra
+word per row of a shifted blit. The crop table trims it from the unshifted
+copy. The copies of a BOB are a row of the sheet.
+The shift table is the number of shifts, followed by the index of the
+unshifted copy of each BOB in the sheet, the other copies follow it.
+
+Compressed image data is split into blocks that are encoded separately:
+non-interleaved data has a block for each plane and the mask plane,
+interleaved data a block for the image rows and one for the mask rows.
+The blocks are preceded by an index of num_blocks + 1 32 bit big endian
+offsets, relative to the end of the index, so block i is found between
+offsets i and i + 1. Codecs that work on rows restart at each plane row.
 """
 from PIL import Image
+import numpy as np
 import struct
 import math
 import sys
 import os
+import mmap
+import time
 
-from ratr0.util import png_util
+from ratr0.util import png_util, levels, compress, checksum, profiling
+from ratr0.util.planar import PlanarImage, WORD_TYPE
 
 FILE_FORMAT_VERSION = 2  # revised to be more compact
 
+# identifier, version, flags, reserved1, depth, width, height,
+# tile_size_h, tile_size_v, num_tiles_h, num_tiles_v, palette_size,
+# imgdata_size, checksum
+# unsigned short = H, unsigned int = I
+# > = big endian, < = little endian
+HEADER_FORMAT = ">8s4B7HIH"
+CHECKSUM_OFFSET = 30
+FLAG_COMPRESSED = 0x10
+FLAG_CHECKSUM = 0x20
+FLAG_CROP_TABLE = 0x40
+FLAG_PRESHIFTED = 0x80
+CROP_ENTRY_WORDS = 4
+SHIFT_COUNTS = [1, 2, 4, 8, 16]
+
+BLOCK_INDEX_TYPE = np.dtype('>u4')
+
 
 class TilesInfo:
     def __init__(self, version, flags, depth, width, height,
                  tile_size_h, tile_size_v, num_tiles_h, num_tiles_v,
-                 palette_size, imgdata_size, checksum, palette=None, palette24=False):
+                 palette_size, imgdata_size, checksum, palette=None, palette24=False,
+                 codec=compress.CODEC_NONE):
         self.version = version
         self.flags = flags
         self.depth = depth
@@ -67,6 +119,7 @@ class TilesInfo:
         self.checksum = checksum
         self.palette = palette
         self.palette24 = palette24
+        self.codec = codec
 
     def __str__(self):
         if self.flags & 0x01 == 1:
@@ -87,6 +140,10 @@ class TilesInfo:
         out += "RGB Format: %d\n" % rgb_format
         out += "Interleaved: %s\n" % str(interleaved)
         out += "Contains Mask: %s\n" % str(contains_mask)
+        out += "Crop Table: %s\n" % str(self.flags & FLAG_CROP_TABLE == FLAG_CROP_TABLE)
+        out += "Pre-shifted: %s\n" % str(self.flags & FLAG_PRESHIFTED == FLAG_PRESHIFTED)
+        if self.flags & FLAG_COMPRESSED:
+            out += "Compression: %s\n" % compress.CODEC_NAMES.get(self.codec, "unknown (%d)" % self.codec)
         out += "width: %d, height: %d\n" % (self.width, self.height)
         out += "# bitplanes: %d\n" % self.depth
         out += "tile size: %dx%d\n" % (self.tile_size_h, self.tile_size_v)
@@ -97,29 +154,27 @@ class TilesInfo:
         if self.palette is not None:
             out += "Palette entries (%d):\n" % len(self.palette)
             for i, color in enumerate(self.palette):
-                out += '%02d: %03x\n' % (i, color)
+                if self.palette24:
+                    out += '%02d: %02x%02x%02x\n' % (i, color[0], color[1], color[2])
+                else:
+                    out += '%02d: %03x\n' % (i, color)
         return out
 
+    def header_bytes(self):
+        return struct.pack(HEADER_FORMAT, b'RATR0TIL',
+                           FILE_FORMAT_VERSION, self.flags, self.codec, self.depth,
+                           self.width, self.height,
+                           self.tile_size_h, self.tile_size_v,
+                           self.num_tiles_h, self.num_tiles_v,
+                           self.palette_size, self.imgdata_size, self.checksum)
+
+    def palette_bytes(self):
+        if self.palette24:
+            return bytes([component for color in self.palette for component in color])
+        return np.array(self.palette, dtype=WORD_TYPE).tobytes()
+
     def write(self, out):
-        out.write(b'RATR0TIL')
-        out.write(bytes([FILE_FORMAT_VERSION, self.flags, 0, self.depth]))
-
-        # unsigned short = H, unsigned int = I
-        # > = big endian, < = little endian
-        out.write(struct.pack(">H", self.width))
-        out.write(struct.pack(">H", self.height))
-        out.write(struct.pack(">H", self.tile_size_h))
-        out.write(struct.pack(">H", self.tile_size_v))
-        out.write(struct.pack(">H", self.num_tiles_h))
-        out.write(struct.pack(">H", self.num_tiles_v))
-        out.write(struct.pack(">H", self.palette_size))
-        out.write(struct.pack(">I", self.imgdata_size))
-        out.write(struct.pack(">H", self.checksum))
-        for color in self.palette:
-            if self.palette24:
-                out.write(bytes(color))
-            else:
-                out.write(struct.pack(">H", color))
+        out.write(self.header_bytes() + self.palette_bytes())
 
 
 def read_tiles_info(infile):
@@ -136,7 +191,7 @@ def read_tiles_info(infile):
     else:
         rgb_format = 12
 
-    reserved1 = infile.read(1)
+    codec = ord(infile.read(1))
     depth = ord(infile.read(1))
 
     width = int.from_bytes(infile.read(2), byteorder=byte_order)
@@ -158,54 +213,268 @@ def read_tiles_info(infile):
             color &= 0x0fff
             palette.append(color)
     else:
-        print("24 bit palette, num palette entries: %d" % palette_size)
-        palette = None
-
+        palette = list(png_util.chunks(list(infile.read(palette_size * 3)), 3))
 
     return TilesInfo(version, flags, depth, width, height,
                      tile_size_h, tile_size_v, num_tiles_h, num_tiles_v,
                      palette_size, imgdata_size, checksum,
-                     palette)
-
-
+                     palette, rgb_format == 24, codec)
+
+
+def image_block_sizes(info):
+    """the sizes in bytes of the blocks compressed image data is split into"""
+    plane_size = (info.width + 15) // 16 * 2 * info.height
+    contains_mask = info.flags & 0x08 == 8
+    if info.flags & 0x04:
+        return [plane_size] * (info.depth + (1 if contains_mask else 0))
+    return [plane_size * info.depth] * (2 if contains_mask else 1)
+
+
+def encode_image_data(blocks, codec, row_bytes):
+    """encodes each of the blocks (bytes-like objects) with the codec and
+    returns the block index followed by the encoded blocks"""
+    payloads = [compress.encode(codec, np.frombuffer(block, dtype=np.uint8), row_bytes)
+                for block in blocks]
+    offsets = np.zeros(len(payloads) + 1, dtype=BLOCK_INDEX_TYPE)
+    offsets[1:] = np.cumsum([len(payload) for payload in payloads])
+    return offsets.tobytes() + b''.join(payloads)
+
+
+def decode_image_data(buffer, offset, codec, block_sizes):
+    """decodes the compressed image data starting at offset in buffer"""
+    index_size = (len(block_sizes) + 1) * BLOCK_INDEX_TYPE.itemsize
+    if offset + index_size > len(buffer):
+        raise ValueError("tile sheet is truncated, the block index is incomplete")
+    offsets = np.frombuffer(buffer, dtype=BLOCK_INDEX_TYPE, count=len(block_sizes) + 1,
+                            offset=offset).tolist()
+    data_offset = offset + index_size
+    if data_offset + offsets[-1] > len(buffer):
+        raise ValueError("tile sheet is truncated, expected %d bytes of compressed data" %
+                         offsets[-1])
+    return b''.join([compress.decode(codec, buffer[data_offset + start:data_offset + end], size).tobytes()
+                     for start, end, size in zip(offsets[:-1], offsets[1:], block_sizes)])
+
+
+class TileSheet:
+    """Read access to a tile sheet file. The file is memory-mapped and
+    the tiles are returned as PlanarImage views into the mapped data, so only
+    the pages of the tiles that are actually used are read from disk.
+    Compressed image data is decoded into memory when the sheet is opened"""
+
+    def __init__(self, info, buffer, data_offset):
+        self.info = info
+        self.buffer = buffer
+        self.interleaved = info.flags & 0x04 == 0
+        self.contains_mask = info.flags & 0x08 == 8
+
+        word_type = np.dtype('<u2' if info.flags & 0x01 == 1 else '>u2')
+        words_per_row = (info.width + 15) // 16
+        num_words = info.imgdata_size // 2
+        self.crop_table = None
+        if info.flags & FLAG_CROP_TABLE:
+            crop_size = self.num_tiles * CROP_ENTRY_WORDS * 2
+            if data_offset + crop_size > len(buffer):
+                raise ValueError("tile sheet is truncated, the crop table is incomplete")
+            self.crop_table = np.frombuffer(buffer, dtype=word_type, count=crop_size // 2,
+                                            offset=data_offset).reshape(-1, CROP_ENTRY_WORDS)
+            data_offset += crop_size
+        self.num_shifts = 1
+        self.shift_table = None
+        if info.flags & FLAG_PRESHIFTED:
+            shift_size = shift_table_size(buffer, data_offset, self.num_tiles, word_type)
+            if data_offset + shift_size > len(buffer):
+                raise ValueError("tile sheet is truncated, the shift table is incomplete")
+            table = np.frombuffer(buffer, dtype=word_type, count=shift_size // 2, offset=data_offset)
+            self.num_shifts = int(table[0])
+            self.shift_table = table[1:]
+            data_offset += shift_size
+        if info.flags & FLAG_COMPRESSED:
+            buffer = decode_image_data(buffer, data_offset, info.codec, image_block_sizes(info))
+            data_offset = 0
+        if data_offset + info.imgdata_size > len(buffer):
+            raise ValueError("tile sheet is truncated, expected %d bytes of image data" %
+                             info.imgdata_size)
+        words = np.frombuffer(buffer, dtype=word_type, count=num_words, offset=data_offset)
+        depth = info.depth
+        if self.interleaved:
+            # rows of all planes, followed by the rows of the repeated mask
+            rows = words.reshape(-1, depth, words_per_row)
+            self.image = PlanarImage(rows[:info.height].transpose(1, 0, 2), info.width)
+            mask_rows = rows[info.height:]
+            self.mask = PlanarImage(mask_rows.transpose(1, 0, 2), info.width) if self.contains_mask else None
+        else:
+            # all planes, followed by a single mask plane
+            planes = words.reshape(-1, info.height, words_per_row)
+            self.image = PlanarImage(planes[:depth], info.width)
+            self.mask = PlanarImage(planes[depth:], info.width) if self.contains_mask else None
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as infile:
+            if infile.read(8) != b'RATR0TIL':
+                raise ValueError("'%s' is not a RATR0 tile file" % path)
+            info = read_tiles_info(infile)
+            data_offset = infile.tell()
+            buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(info, buffer, data_offset)
+
+    def close(self):
+        self.image = self.mask = self.crop_table = self.shift_table = None
+        try:
+            self.buffer.close()
+        except BufferError:
+            # views are still referenced, the mapping goes away with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def num_tiles(self):
+        return self.info.num_tiles_h * self.info.num_tiles_v
+
+    def tile_position(self, index):
+        if index < 0 or index >= self.num_tiles:
+            raise IndexError("tile index %d out of range (%d tiles)" % (index, self.num_tiles))
+        return index % self.info.num_tiles_h, index // self.info.num_tiles_h
+
+    def tile(self, index):
+        """the image data of the tile with the given index as a PlanarImage,
+        use its plane(), interleaved() and non_interleaved() views to access
+        the words"""
+        tile_x, tile_y = self.tile_position(index)
+        return self.image.tile(tile_x, tile_y, self.info.tile_size_h, self.info.tile_size_v)
+
+    def tile_mask(self, index):
+        """the mask data of the tile with the given index as a PlanarImage,
+        it has the image depth in interleaved files and 1 plane otherwise"""
+        if self.mask is None:
+            raise ValueError("tile sheet does not contain a mask")
+        tile_x, tile_y = self.tile_position(index)
+        return self.mask.tile(tile_x, tile_y, self.info.tile_size_h, self.info.tile_size_v)
+
+    def tile_crop(self, index):
+        """the crop table entry of the tile: (x offset in words, y offset in
+        rows, width in words, height in rows)"""
+        if self.crop_table is None:
+            raise ValueError("tile sheet does not contain a crop table")
+        self.tile_position(index)
+        return tuple(self.crop_table[index].tolist())
+
+    def shifted_tile_index(self, index, x):
+        """the index of the copy of BOB index in a pre-shifted sheet for the
+        x position and the shift that is left for the blitter"""
+        if self.shift_table is None:
+            raise ValueError("tile sheet is not pre-shifted")
+        if index < 0 or index >= len(self.shift_table):
+            raise IndexError("BOB index %d out of range (%d BOBs)" % (index, len(self.shift_table)))
+        step = 16 // self.num_shifts
+        return int(self.shift_table[index]) + (x & 15) // step, (x & 15) % step
+
+    def cropped_tile(self, index):
+        """the bounding box of the tile's non-zero pixels as a PlanarImage
+        view, this is the data the engine blits"""
+        x, y, width, height = self.tile_crop(index)
+        tile = self.tile(index)
+        return PlanarImage(tile.data[:, y:y + height, x:x + width], width * 16)
+
+
+@profiling.profiled('write_planes')
 def write_planes_to_c(im, outfile, colors, non_interleaved, verbose, indent=4):
     """write tile file using the specifications"""
     depth = int(math.log2(len(colors)))
-    planes, map_words_per_row = png_util.extract_planes(im, depth, verbose)
-    print("#Planes: %d map words per row: %d" % (len(planes), map_words_per_row))
+    image = png_util.extract_planar_image(im, depth, verbose)
+    map_words_per_row = image.words_per_row
+    print("#Planes: %d map words per row: %d" % (image.depth, map_words_per_row))
     with open(outfile, 'w') as out:
         out.write("UINT16 data[] = {\n")
-        out_data = []
-        if non_interleaved:
-            for plane in planes:
-                for word in plane:
-                    out_data.append("0x%04x" % word)
-        else:
-            interleaved_data = png_util.interleave_planes(planes, map_words_per_row)
-            for row in interleaved_data:
-                for word in row:
-                    out_data.append("0x%04x" % word)
-        out_rows = png_util.chunks(out_data, map_words_per_row)
-        for row in out_rows:
+        words = image.buffer(interleaved=not non_interleaved)
+        for row in words.reshape(-1, map_words_per_row).tolist():
             out.write(" " * indent)
-            out.write(", ".join(row))
+            out.write(", ".join(["0x%04x" % word for word in row]))
             out.write(",\n")
         out.write("\n};\n")
 
 
 def write_tiles(im, outfile, tile_size, colors, palette24,
-                non_interleaved, create_mask, verbose):
-    """write tile file using the specifications"""
+                non_interleaved, create_mask, verbose, codec=compress.CODEC_NONE, crop=False,
+                shifts=1):
+    """write tile file using the specifications, if shifts is larger than 1,
+    a pre-shifted BOB sheet with shifts copies of each tile is written"""
     depth = int(math.log2(len(colors)))
-    planes, map_words_per_row = png_util.extract_planes(im, depth, verbose)
-    write_tile_file(outfile, im, tile_size, planes, colors, map_words_per_row,
-                    palette24, non_interleaved, create_mask, verbose)
+    image = png_util.extract_planar_image(im, depth, verbose)
+    if shifts > 1:
+        shifted, shifted_tile_size = preshift_tiles(image, tile_size, shifts)
+        if verbose:
+            print(preshift_report(image, tile_size, shifts, create_mask, non_interleaved, crop))
+        image, tile_size = shifted, shifted_tile_size
+    write_tile_file(outfile, im, tile_size, image, colors, image.words_per_row,
+                    palette24, non_interleaved, create_mask, verbose, codec, crop, shifts)
+
+
+def image_blocks(image, non_interleaved, create_mask):
+    """the image data split into the blocks that are compressed separately,
+    see image_block_sizes()"""
+    mask_depth = 1 if non_interleaved else image.depth
+    mask = image.mask(mask_depth) if create_mask else None
+    if non_interleaved:
+        planes = image.buffer(interleaved=False)
+        blocks = [planes[i] for i in range(image.depth)]
+        if create_mask:
+            blocks.append(mask.buffer(interleaved=False)[0])
+        return blocks
+    blocks = [image.buffer(interleaved=True)]
+    if create_mask:
+        blocks.append(mask.buffer(interleaved=True))
+    return blocks
+
+
+@profiling.profiled('compression_report')
+def compression_report(image, non_interleaved, create_mask):
+    """returns (codec name, size in bytes, estimated 68000 decode cycles,
+    host encoding time in seconds) of the image data for each codec"""
+    blocks = image_blocks(image, non_interleaved, create_mask)
+    row_bytes = image.words_per_row * 2
+    report = []
+    for codec, name in compress.CODEC_NAMES.items():
+        start_time = time.perf_counter()
+        data = encode_image_data(blocks, codec, row_bytes) if codec != compress.CODEC_NONE else None
+        elapsed = time.perf_counter() - start_time
+        if data is None:
+            size = sum([block.nbytes for block in blocks])
+            cycles = size * compress.COPY_CYCLES_PER_BYTE
+        else:
+            size = len(data)
+            cycles = image_data_decode_cycles(data, codec, len(blocks))
+        report.append((name, size, cycles, elapsed))
+    return report
+
 
+def image_data_decode_cycles(data, codec, num_blocks):
+    """estimated 68000 cycles to decode all blocks of the encoded image data"""
+    offsets = np.frombuffer(data, dtype=BLOCK_INDEX_TYPE, count=num_blocks + 1).tolist()
+    index_size = (num_blocks + 1) * BLOCK_INDEX_TYPE.itemsize
+    return sum([compress.decode_cycles(codec, data[index_size + start:index_size + end])
+                for start, end in zip(offsets[:-1], offsets[1:])])
 
+
+@profiling.profiled('write_tiles')
 def write_tile_file(outfile, im, tile_size,
                     planes, colors, map_words_per_row,
-                    palette24, non_interleaved, create_mask, verbose):
-    checksum = 0  # TODO: add adler-32
+                    palette24, non_interleaved, create_mask, verbose,
+                    codec=compress.CODEC_NONE, crop=False, shifts=1):
+    """write the tile sheet file. planes is either a PlanarImage or a list
+    of planes that each are a list of words. If codec is not CODEC_NONE,
+    the image data is compressed, if crop is set, the file contains the
+    crop table of the tiles. If shifts is larger than 1, planes is a
+    pre-shifted sheet from preshift_tiles() and a shift table is written"""
+    start_time = time.perf_counter()
+    if not isinstance(planes, PlanarImage):
+        planes = PlanarImage.from_planes(planes, im.width, im.height)
+    width, height = planes.width, planes.height
     mask_depth = 0
     flags = 4 if non_interleaved else 0
     if palette24:
@@ -224,76 +493,258 @@ def write_tile_file(outfile, im, tile_size,
         flags |= 8
         # if interleaved, mask depth is same as image depth
         mask_depth = 1 if non_interleaved else depth
+    if codec != compress.CODEC_NONE:
+        flags |= FLAG_COMPRESSED
+    if crop:
+        flags |= FLAG_CROP_TABLE
+    if shifts > 1:
+        flags |= FLAG_PRESHIFTED
+    flags |= FLAG_CHECKSUM
 
 
-    imgdata_size = map_words_per_row * 2 * im.height * (depth + mask_depth)
-    tile_sheet_dim = (int(im.width / tile_size[0]), int(im.height / tile_size[1]))
+    imgdata_size = map_words_per_row * 2 * height * (depth + mask_depth)
+    tile_sheet_dim = (int(width / tile_size[0]), int(height / tile_size[1]))
     if verbose:
         print('tile size h: %d v: %d' % (tile_size[0], tile_size[1]))
         print('tile sheet width: %d height: %d' % (tile_sheet_dim[0], tile_sheet_dim[1]))
 
-    # add an additional plane that merges down the 1 bits of the planes list
-    if create_mask:
-        mask_plane = [0] * len(planes[0])
-        for i in range(len(mask_plane)):
-            w = 0
-            for plane in planes:
-                w |= plane[i]
-            mask_plane[i] = w
+    tiles_info = TilesInfo(FILE_FORMAT_VERSION, flags,
+                           depth, width, height,
+                           tile_size[0], tile_size[1],
+                           tile_sheet_dim[0], tile_sheet_dim[1],
+                           palette_size, imgdata_size, 0,
+                           colors, palette24, codec)
+    interleaved = not non_interleaved
+    buffers = [tiles_info.header_bytes(), tiles_info.palette_bytes()]
+    if crop:
+        table = crop_table(planes, tile_size)
+        buffers.append(table)
+        if verbose:
+            print(crop_report(table, tile_size))
+    if shifts > 1:
+        buffers.append(shift_table(tile_sheet_dim[0] * tile_sheet_dim[1] // shifts, shifts))
+    if codec != compress.CODEC_NONE:
+        data = encode_image_data(image_blocks(planes, non_interleaved, create_mask),
+                                 codec, map_words_per_row * 2)
+        buffers.append(data)
+        if verbose:
+            print('%s compressed image data: %d of %d bytes, %d cycles (est. 68000 decode)' %
+                  (compress.CODEC_NAMES[codec], len(data), imgdata_size,
+                   image_data_decode_cycles(data, codec, len(image_block_sizes(tiles_info)))))
+    else:
+        buffers.append(planes.buffer(interleaved))
+        if create_mask:
+            # a plane that merges down the 1 bits of all planes, in interleaved
+            # mode it is repeated for each plane of a row
+            buffers.append(planes.mask(mask_depth).buffer(interleaved))
 
     with open(outfile, 'wb') as out:
-        tiles_info = TilesInfo(FILE_FORMAT_VERSION, flags,
-                               depth, im.width, im.height,
-                               tile_size[0], tile_size[1],
-                               tile_sheet_dim[0], tile_sheet_dim[1],
-                               palette_size, imgdata_size, checksum,
-                               colors)
-        tiles_info.write(out)
-        if non_interleaved:
-            if create_mask:
-                planes.append(mask_plane)
-            for plane in planes:
-                for word in plane:
-                    out.write(struct.pack(">H", word))
-        else:
-            interleaved_data = png_util.interleave_planes(planes, map_words_per_row)
-            for row in interleaved_data:
-                for word in row:
-                    out.write(struct.pack(">H", word))
-            if create_mask:
-                # interleaved mask
-                # we need to multiply the mask plane data
-                mask_planes = [mask_plane for i in range(depth)]
-                interleaved_mask = png_util.interleave_planes(mask_planes, map_words_per_row)
-                for row in interleaved_mask:
-                    for word in row:
-                        out.write(struct.pack(">H", word))
-
-
-def setornot(v):
-    return 1 if v > 0 else 0
-
+        writer = checksum.ChecksumWriter(out, 16)
+        writer.writelines(buffers)
+        writer.patch(CHECKSUM_OFFSET)
 
+    if verbose:
+        elapsed = time.perf_counter() - start_time
+        num_bytes = sum([memoryview(buffer).nbytes for buffer in buffers])
+        print('wrote %d bytes in %.3f s (%.2f MB/s)' %
+              (num_bytes, elapsed, num_bytes / (1024 * 1024) / max(elapsed, 1e-9)))
+
+
+@profiling.profiled('crop_table')
+def crop_table(image, tile_size):
+    """Returns the crop table of the tiles of the PlanarImage as a
+    (num tiles, 4) array of words: the x offset in words and the y offset
+    in rows of the tight bounding box of the non-zero pixels in each tile,
+    its width in words and its height in rows, all 0 for an empty tile.
+    The tile width has to be a multiple of 16"""
+    tile_width, tile_height = tile_size
+    if tile_width % 16 > 0:
+        raise Exception("a crop table needs a tile width that is a multiple of 16 (was %d)" %
+                        tile_width)
+    tile_words = tile_width // 16
+    num_tiles_h = image.width // tile_width
+    num_tiles_v = image.height // tile_height
+    # the non-zero words of the mask plane of each tile: (tile, rows, words)
+    used = (image.mask().plane(0)[:num_tiles_v * tile_height, :num_tiles_h * tile_words]
+            .reshape(num_tiles_v, tile_height, num_tiles_h, tile_words)
+            .transpose(0, 2, 1, 3)
+            .reshape(-1, tile_height, tile_words) != 0)
+    used_rows = used.any(axis=2)
+    used_words = used.any(axis=1)
+    top = used_rows.argmax(axis=1)
+    bottom = tile_height - used_rows[:, ::-1].argmax(axis=1)
+    left = used_words.argmax(axis=1)
+    right = tile_words - used_words[:, ::-1].argmax(axis=1)
+    table = np.stack([left, top, right - left, bottom - top], axis=1)
+    table[~used_rows.any(axis=1)] = 0
+    return table.astype(WORD_TYPE)
+
+
+@profiling.profiled('preshift_tiles')
+def preshift_tiles(image, tile_size, shifts):
+    """Returns a sheet with shifts copies of each tile of the PlanarImage and
+    the tile size of the copies. Copy k is shifted right by k * 16 / shifts
+    pixels and has an additional word per row for the shifted out pixels,
+    the copies of a tile form a row of the sheet. The tile width has to be
+    a multiple of 16"""
+    tile_width, tile_height = tile_size
+    if shifts not in SHIFT_COUNTS:
+        raise Exception("the number of shifts must be one of %s (was %d)" %
+                        (", ".join(map(str, SHIFT_COUNTS)), shifts))
+    if tile_width % 16 > 0:
+        raise Exception("pre-shifted tiles need a tile width that is a multiple of 16 (was %d)" %
+                        tile_width)
+    tile_words = tile_width // 16
+    num_tiles_h = image.width // tile_width
+    num_tiles_v = image.height // tile_height
+    depth = image.depth
+    # (depth, tile, rows, words + 1), the last word receives the shifted out pixels
+    padded = np.zeros((depth, num_tiles_v * num_tiles_h, tile_height, tile_words + 1),
+                      dtype=np.uint32)
+    padded[..., :tile_words] = (image.data[:, :num_tiles_v * tile_height, :num_tiles_h * tile_words]
+                                .reshape(depth, num_tiles_v, tile_height, num_tiles_h, tile_words)
+                                .transpose(0, 1, 3, 2, 4)
+                                .reshape(depth, -1, tile_height, tile_words))
+    # the word to the left of each word, its low bits are shifted in
+    previous = np.zeros_like(padded)
+    previous[..., 1:] = padded[..., :-1]
+    copies = np.stack([(padded >> shift) | ((previous << (16 - shift)) & 0xffff)
+                       for shift in range(0, 16, 16 // shifts)], axis=2)
+    # (depth, tile, copy, rows, words) -> a row of copies for each tile
+    data = (copies.transpose(0, 1, 3, 2, 4)
+            .reshape(depth, -1, shifts * (tile_words + 1))
+            .astype(WORD_TYPE))
+    return PlanarImage(data, shifts * (tile_width + 16)), (tile_width + 16, tile_height)
+
+
+def shift_table(num_bobs, shifts):
+    """the shift table of a pre-shifted sheet: the number of shifts and the
+    index of the unshifted copy of each BOB"""
+    return np.concatenate([[shifts], np.arange(num_bobs) * shifts]).astype(WORD_TYPE)
+
+
+def shift_table_size(buffer, offset, num_tiles, word_type=WORD_TYPE):
+    """the size in bytes of the shift table at offset in buffer"""
+    if offset + 2 > len(buffer):
+        return 2
+    shifts = int(np.frombuffer(buffer, dtype=word_type, count=1, offset=offset)[0])
+    if shifts not in SHIFT_COUNTS:
+        raise ValueError("invalid number of shifts in the shift table: %d" % shifts)
+    return 2 + num_tiles // shifts * 2
+
+
+def preshift_report(image, tile_size, shifts, create_mask, non_interleaved, crop=False):
+    """the memory cost of a pre-shifted sheet compared to the unshifted one
+    and the words that a draw of a BOB blits per channel. The shifted
+    copies need the extra word per row like a shifted blit of the BOB, only
+    the unshifted copy can be blitted without it if the crop table trims it"""
+    tile_width, tile_height = tile_size
+    num_bobs = (image.width // tile_width) * (image.height // tile_height)
+    planes = image.depth + (0 if not create_mask else (1 if non_interleaved else image.depth))
+    bob_bytes = tile_width // 8 * tile_height * planes
+    copy_bytes = (tile_width + 16) // 8 * tile_height * planes
+    bob_words = tile_width // 16 * tile_height * image.depth
+    copy_words = (tile_width + 16) // 16 * tile_height * image.depth
+    return ('pre-shifted: %d BOBs with %d copies of %dx%d pixels, %d bytes instead of %d (%.1fx)\n'
+            'blitted words per draw: %d for the unshifted copy%s, %d for the shifted copies, '
+            '%d for a shifted blit of the BOB' %
+            (num_bobs, shifts, tile_width + 16, tile_height, num_bobs * shifts * copy_bytes,
+             num_bobs * bob_bytes, shifts * copy_bytes / max(bob_bytes, 1),
+             bob_words if crop else copy_words, '' if crop else ' (use a crop table to trim it)',
+             copy_words, copy_words))
+
+
+def crop_report(table, tile_size):
+    """a summary of the blitter area that the crop table saves"""
+    tile_area = (tile_size[0] // 16) * tile_size[1]
+    cropped_area = int(np.sum(table[:, 2].astype(np.int64) * table[:, 3]))
+    full_area = tile_area * len(table)
+    return ('crop table: %d tiles, %d empty, %d of %d words per plane (%.1f %%)' %
+            (len(table), int(np.count_nonzero(table[:, 3] == 0)), cropped_area, full_area,
+             100.0 * cropped_area / max(full_area, 1)))
+
+
+@profiling.profiled('rip_tiles')
+def rip_tiles(im, tile_size, verbose):
+    """Cut the image into tiles of tile_size and remove the duplicates.
+    Returns the pixels of the unique tiles in order of their first occurrence
+    as a (num unique tiles, tile height, tile width) array and the tile map, a
+    (rows, columns) array of indexes into the unique tiles"""
+    tile_width, tile_height = tile_size
+    if im.width % tile_width > 0 or im.height % tile_height > 0:
+        raise Exception("image size %dx%d is not a multiple of the tile size %dx%d" %
+                        (im.width, im.height, tile_width, tile_height))
+    num_tiles_h = im.width // tile_width
+    num_tiles_v = im.height // tile_height
+    tile_pixels = np.ascontiguousarray(
+        png_util.image_indexes(im)
+        .reshape(num_tiles_v, tile_height, num_tiles_h, tile_width)
+        .transpose(0, 2, 1, 3))
+
+    # hash index over the pixel bytes of each tile
+    tile_bytes = tile_pixels.tobytes()
+    tile_len = tile_width * tile_height
+    unique_tiles = {}
+    # the index of the first occurrence of each unique tile
+    first = []
+    tile_map = np.empty(num_tiles_h * num_tiles_v, dtype=np.int32)
+    for i in range(len(tile_map)):
+        key = tile_bytes[i * tile_len:(i + 1) * tile_len]
+        tile_map[i] = unique_tiles.setdefault(key, len(unique_tiles))
+        if tile_map[i] == len(first):
+            first.append(i)
+    if verbose:
+        print('%d tiles, %d unique' % (len(tile_map), len(unique_tiles)))
+    return (tile_pixels.reshape(-1, tile_height, tile_width)[first],
+            tile_map.reshape(num_tiles_v, num_tiles_h))
+
+
+def write_ripped_tiles(im, outfile, level_outfile, tile_size, colors, palette24,
+                       non_interleaved, create_mask, verbose, codec=compress.CODEC_NONE,
+                       crop=False):
+    """Cut the image into tiles, write a tile sheet that contains each distinct
+    tile only once and a level file with the tile map that rebuilds the image.
+    The sheet has the same number of tiles per row as the image, at most"""
+    unique_tiles, tile_map = rip_tiles(im, tile_size, verbose)
+    tile_width, tile_height = tile_size
+    num_unique = len(unique_tiles)
+    sheet_tiles_h = min(num_unique, im.width // tile_width)
+    sheet_tiles_v = (num_unique + sheet_tiles_h - 1) // sheet_tiles_h
+
+    # arrange the unique tiles in a sheet, the remainder of the last row is empty
+    sheet = np.zeros((sheet_tiles_v * sheet_tiles_h, tile_height, tile_width), dtype=np.uint8)
+    sheet[:num_unique] = unique_tiles
+    sheet = (sheet.reshape(sheet_tiles_v, sheet_tiles_h, tile_height, tile_width)
+             .transpose(0, 2, 1, 3)
+             .reshape(sheet_tiles_v * tile_height, sheet_tiles_h * tile_width))
+    sheet_im = Image.fromarray(sheet, mode='P')
+    write_tiles(sheet_im, outfile, tile_size, colors, palette24,
+                non_interleaved, create_mask, verbose, codec, crop)
+
+    num_tiles_v, num_tiles_h = tile_map.shape
+    level = {
+        "name": "level",
+        "viewport": {
+            "x": 0, "y": 0,
+            "width": num_tiles_h,
+            "height": num_tiles_v
+        },
+        "width": num_tiles_h,
+        "height": num_tiles_v,
+        # tile numbers in levels are 1-based
+        "map": (tile_map.ravel() + 1).tolist()
+    }
+    levels.write_level(level, level_outfile, verbose)
+
+
+@profiling.profiled('write_mask')
 def write_mask(outfile, im, tile_size, depth,
                palette24,
                non_interleaved, verbose):
     """Write a preview mask in png format, as a quick visual control"""
-    # Non-interleaved: just write one bitplane at the end
-    if non_interleaved:
-        colors = [setornot(c) for c in im.getdata()]
-        mask_img = Image.new(mode="1", size=im.size)
-        mask_img.putdata(colors)
-        # write a debug PNG file as visual control
-        mask_img.save(outfile)
-    else:
+    mask = png_util.image_indexes(im) > 0
+    if not non_interleaved:
         # interleaved: duplicate each row times the depth
-        colors = [setornot(c) for c in im.getdata()]
-        color_rows = list(png_util.chunks(colors, im.width))
-        final_colors = []
-        for row in color_rows:
-            new_row = row * depth
-            final_colors.extend(row * depth)
-        mask_img = Image.new(mode="1", size=(im.width, im.height * depth))
-        mask_img.putdata(final_colors)
-        # write a debug PNG file as visual control
-        mask_img.save(outfile)
+        mask = np.repeat(mask, depth, axis=0)
+    # write a debug PNG file as visual control
+    Image.fromarray(mask).save(outfile)
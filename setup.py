@@ -30,7 +30,7 @@ CLASSIFIERS = [
     "Programming Language :: Python :: Implementation :: CPython",
     "Topic :: Software Development :: Libraries :: Python Modules"
     ]
-INSTALL_REQUIRES = ['pillow']
+INSTALL_REQUIRES = ['pillow', 'numpy']
 
 PACKAGE_DATA = {
     'ratr0.util': []
@@ -56,7 +56,8 @@ if __name__ == '__main__':
           classifiers=CLASSIFIERS,
           install_requires=INSTALL_REQUIRES,
           include_package_data=True, package_data=PACKAGE_DATA,
-          scripts=['bin/ratr0-makecoplist',
+          scripts=['bin/ratr0-build',
+                   'bin/ratr0-makecoplist',
                    'bin/ratr0-maketiles',
                    'bin/ratr0-makesprites',
                    'bin/ratr0-makelevel',
@@ -64,4 +65,8 @@ if __name__ == '__main__':
                    'bin/ratr0-converttiled',
                    'bin/ratr0-file',
                    'bin/ratr0-wav2raw8',
-                   'bin/ratr0-calcnumbobs'])
+                   'bin/ratr0-calcnumbobs',
+                   'bin/ratr0-tilecodecs',
+                   'bin/ratr0-sharepalette',
+                   'bin/ratr0-spritemux',
+                   'bin/ratr0-benchmark'])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""benchmark_test.py
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+from ratr0.util import benchmark
+
+
+def make_document(seconds):
+    return {'format': benchmark.FORMAT_VERSION,
+            'results': {key: {'seconds': value} for key, value in seconds.items()}}
+
+
+class BenchmarkTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for benchmark"""
+
+    def test_synthetic_image_is_deterministic(self):
+        """the same parameters give the same image, the pixels are within the depth"""
+        im1 = benchmark.synthetic_image(32, 16, 3)
+        im2 = benchmark.synthetic_image(32, 16, 3)
+        self.assertTrue(np.array_equal(np.asarray(im1), np.asarray(im2)))
+        self.assertEqual((32, 16), im1.size)
+        self.assertTrue(np.asarray(im1).max() < 8)
+
+    def test_run(self):
+        """a run has a result for each variant and size and depth the benchmark supports"""
+        keys = []
+        document = benchmark.run(sizes=[(32, 16)], depths=[2, 5], repeat=1,
+                                 progress=lambda key, seconds: keys.append(key))
+        self.assertEqual(benchmark.FORMAT_VERSION, document['format'])
+        results = document['results']
+        self.assertEqual(sorted(keys), sorted(results))
+        self.assertIn('tiles.write_tile_file/mask/32x16/d5', results)
+        self.assertIn('sprites.write_sprites/binary/32x16/d2', results)
+        self.assertNotIn('sprites.write_sprites/binary/32x16/d5', results)
+        self.assertIn('levels.write_level/default/32x16', results)
+        self.assertTrue(all([result['seconds'] >= 0 for result in results.values()]))
+
+    def test_run_unknown_benchmark(self):
+        """an unknown benchmark name is an error"""
+        with self.assertRaises(Exception):
+            benchmark.run(['unknown'], sizes=[(32, 16)], depths=[1], repeat=1)
+
+    def test_compare(self):
+        """only results slower than the tolerance and the minimum difference are regressions"""
+        baseline = make_document({'a': 0.1, 'b': 0.1, 'c': 0.0001, 'd': 0.1})
+        document = make_document({'a': 0.15, 'b': 0.11, 'c': 0.0005, 'e': 1.0})
+        comparison = benchmark.compare(document, baseline, 0.2)
+        self.assertEqual(['c', 'a', 'b'], [entry[0] for entry in comparison])
+        self.assertEqual([False, True, False], [entry[4] for entry in comparison])
+        self.assertEqual("3 results compared, 1 regressions",
+                         benchmark.comparison_report(comparison)[-1])
+
+    def test_write_read_results(self):
+        """written results can be read back, other files are rejected"""
+        document = make_document({'a': 0.5})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'results.json')
+            benchmark.write_results(document, path)
+            self.assertEqual(document, benchmark.read_results(path))
+            benchmark.write_results({'results': {}}, path)
+            with self.assertRaises(Exception):
+                benchmark.read_results(path)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(BenchmarkTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""build_test.py
+"""
+import json
+import os
+import tempfile
+import unittest
+from PIL import Image
+from ratr0.util import build, tiles
+
+
+class BuildTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the build module"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        im = Image.new('P', (32, 16))
+        im.putdata([i % 4 for i in range(32 * 16)])
+        im.putpalette([0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0, 255])
+        im.save(self.path('tiles.png'))
+        with open(self.path('level.json'), 'w') as outfile:
+            json.dump({"width": 2, "height": 1, "map": [1, 2]}, outfile)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def write_manifest(self, assets):
+        with open(self.path('manifest.json'), 'w') as outfile:
+            json.dump({"assets": assets}, outfile)
+        return self.path('manifest.json')
+
+    def test_load_manifest(self):
+        """paths are made absolute and defaults are filled in"""
+        assets = build.load_manifest(self.write_manifest([
+            {"type": "tiles", "input": "tiles.png", "output": "tiles.ts", "tile_size": "16x16"}]))
+        self.assertEqual(1, len(assets))
+        self.assertEqual(self.path('tiles.png'), assets[0]['input'])
+        self.assertEqual('tiles.png', assets[0]['name'])
+        self.assertFalse(assets[0]['create_mask'])
+
+    def test_unknown_type(self):
+        """unknown asset types are rejected"""
+        path = self.write_manifest([{"type": "music", "input": "tiles.png", "output": "x"}])
+        self.assertRaises(build.BuildError, build.load_manifest, path)
+
+    def test_unknown_option(self):
+        """misspelled options are rejected"""
+        path = self.write_manifest([{"type": "tiles", "input": "tiles.png", "output": "x",
+                                     "tilesize": "16x16"}])
+        self.assertRaises(build.BuildError, build.load_manifest, path)
+
+    def test_missing_input(self):
+        """missing input files are reported before converting anything"""
+        path = self.write_manifest([{"type": "level", "input": "nolevel.json", "output": "x"}])
+        self.assertRaises(build.BuildError, build.load_manifest, path)
+
+    def test_unreadable_manifest(self):
+        """missing and malformed manifests are reported as a BuildError"""
+        self.assertRaises(build.BuildError, build.load_manifest, self.path('missing.json'))
+        with open(self.path('broken.json'), 'w') as outfile:
+            outfile.write('{')
+        self.assertRaises(build.BuildError, build.load_manifest, self.path('broken.json'))
+        with open(self.path('broken.toml'), 'w') as outfile:
+            outfile.write('[[assets]\n')
+        self.assertRaises(build.BuildError, build.load_manifest, self.path('broken.toml'))
+
+    def test_malformed_manifest(self):
+        """manifests and assets that are not objects are reported as a BuildError"""
+        for manifest in ['{"assets": [1]}', '"assets"', '["assets"]', '{"assets": "x"}']:
+            with open(self.path('manifest.json'), 'w') as outfile:
+                outfile.write(manifest)
+            self.assertRaises(build.BuildError, build.load_manifest, self.path('manifest.json'))
+
+    def test_build(self):
+        """converts all assets"""
+        assets = build.load_manifest(self.write_manifest([
+            {"type": "tiles", "input": "tiles.png", "output": "tiles.ts", "tile_size": "16x16"},
+            {"type": "level", "input": "level.json", "output": "level.lvl"}]))
+        timings = build.build(assets, jobs=2)
+        self.assertEqual(2, len(timings))
+        self.assertTrue(os.path.exists(self.path('tiles.ts')))
+        self.assertTrue(os.path.exists(self.path('level.lvl')))
+
+    def test_build_level_file(self):
+        """a tiles asset with a level_file rips the unique tiles"""
+        assets = build.load_manifest(self.write_manifest([
+            {"type": "tiles", "input": "tiles.png", "output": "tiles.ts", "tile_size": "16x16",
+             "level_file": "ripped.lvl"}]))
+        build.build(assets, jobs=1)
+        self.assertTrue(os.path.exists(self.path('tiles.ts')))
+        self.assertTrue(os.path.exists(self.path('ripped.lvl')))
+
+    def test_build_shifts(self):
+        """a tiles asset with shifts writes a pre-shifted BOB sheet"""
+        assets = build.load_manifest(self.write_manifest([
+            {"type": "tiles", "input": "tiles.png", "output": "tiles.ts", "tile_size": "32x16",
+             "shifts": 4}]))
+        build.build(assets, jobs=1)
+        with tiles.TileSheet.open(self.path('tiles.ts')) as sheet:
+            self.assertEqual(4, sheet.num_shifts)
+            self.assertEqual(4 * 48, sheet.info.width)
+
+    def test_build_failure(self):
+        """a failing asset stops the build"""
+        with open(self.path('broken.json'), 'w') as outfile:
+            outfile.write('{')
+        assets = build.load_manifest(self.write_manifest([
+            {"type": "level", "input": "broken.json", "output": "level.lvl"}]))
+        self.assertRaises(build.BuildError, build.build, assets, 1)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(BuildTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""cache_test.py
+"""
+import os
+import tempfile
+import unittest
+from ratr0.util import cache
+
+
+class ConversionCacheTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for ConversionCache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = cache.ConversionCache(self.path('cache'))
+        self.num_conversions = 0
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def convert(self, outfile, data):
+        def write():
+            self.num_conversions += 1
+            with open(outfile, 'wb') as out:
+                out.write(data)
+        return write
+
+    def test_key(self):
+        """keys depend on kind, inputs and options, but not on the option order"""
+        key = self.cache.key('tiles', [b'abc'], {'a': 1, 'b': 2})
+        self.assertEqual(key, self.cache.key('tiles', [b'abc'], {'b': 2, 'a': 1}))
+        self.assertNotEqual(key, self.cache.key('sprites', [b'abc'], {'a': 1, 'b': 2}))
+        self.assertNotEqual(key, self.cache.key('tiles', [b'abd'], {'a': 1, 'b': 2}))
+        self.assertNotEqual(key, self.cache.key('tiles', [b'abc'], {'a': 1, 'b': 3}))
+        self.assertNotEqual(self.cache.key('tiles', [b'ab', b'c'], {}),
+                            self.cache.key('tiles', [b'a', b'bc'], {}))
+
+    def test_cached(self):
+        """the second conversion is copied from the cache"""
+        outfile = self.path('out.bin')
+        self.cache.cached('test', [b'input'], {}, [outfile], self.convert(outfile, b'result'))
+        os.remove(outfile)
+        self.cache.cached('test', [b'input'], {}, [outfile], self.convert(outfile, b'result'))
+        self.assertEqual(1, self.num_conversions)
+        with open(outfile, 'rb') as infile:
+            self.assertEqual(b'result', infile.read())
+
+    def test_evict(self):
+        """the least recently used entries are removed when the cache is full"""
+        self.cache.max_size = 25
+        outfile = self.path('out.bin')
+        for i in range(3):
+            self.cache.cached('test', [b'%d' % i], {}, [outfile], self.convert(outfile, b'x' * 10))
+        self.assertEqual(2, len(self.cache.entries()))
+        self.cache.cached('test', [b'0'], {}, [outfile], self.convert(outfile, b'x' * 10))
+        self.assertEqual(4, self.num_conversions)
+
+    def test_compile_clist(self):
+        """compiled copper lists are cached"""
+        inpath = self.path('clist.txt')
+        with open(inpath, 'w') as out:
+            out.write("MOVE COLOR00,0x0f00\nlabel:\nMOVE COLOR01,0x00f0\nEND\n")
+        expected = self.cache.compile_clist(inpath)
+        self.assertEqual(1, len(self.cache.entries()))
+        self.assertEqual(expected, self.cache.compile_clist(inpath))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ConversionCacheTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
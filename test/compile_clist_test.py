@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""compile_clist_test.py
+"""
+import timeit
+import unittest
+from ratr0.util import compile_clist
+
+
+class CompileClistTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the copper list compiler"""
+
+    def compile(self, source):
+        return compile_clist.compile_source(source.strip().split('\n'))
+
+    def test_instructions(self):
+        """MOVE, WAIT, END and labels"""
+        words, indexes = self.compile("""
+# comment
+    MOVE COLOR00,0x0f00
+color1:
+    MOVE 0x182,15
+    WAIT 0,0x2c
+    END""")
+        self.assertEqual([0x180, 0xf00, 0x182, 15, 0x2c01, 0xfffe, 0xffff, 0xfffe], words)
+        self.assertEqual({'color1': 3}, indexes)
+
+    def test_constants(self):
+        """constants and expressions with integer division"""
+        words, _ = self.compile("""
+TOP = 0x2c
+BASE = TOP + 7 / 2
+    MOVE COLOR00 + 2, (BASE << 4) | 1""")
+        self.assertEqual([0x182, 0x2f1], words)
+
+    def test_power_and_shift_limits(self):
+        """** and << work, but results that are too large are rejected quickly"""
+        words, _ = self.compile("MOVE COLOR00,2 ** 3 << 4")
+        self.assertEqual([0x180, 0x80], words)
+        for source in ["X = 9**9**9", "X = 1 << 100000000", "X = 2 ** -1",
+                       "REPEAT 2,i\nMOVE COLOR00,1 << (i * 1000)\nENDR"]:
+            with self.assertRaisesRegex(Exception, "invalid expression"):
+                self.compile(source)
+
+    def test_repeat(self):
+        """REPEAT blocks with loop variables, also nested"""
+        words, _ = self.compile("""
+REPEAT 2,i
+  REPEAT 3,j
+    MOVE COLOR00,i * 10 + j
+  ENDR
+  MOVE COLOR01,i
+ENDR""")
+        self.assertEqual([0x180, 0, 0x180, 1, 0x180, 2, 0x182, 0,
+                          0x180, 10, 0x180, 11, 0x180, 12, 0x182, 1], words)
+
+    def test_macro(self):
+        """macros take expressions as arguments, labels after them point to the right index"""
+        words, indexes = self.compile("""
+MACRO line y,color
+    WAIT 0,y
+    MOVE COLOR00,color
+ENDM
+REPEAT 3,i
+    line 0x2c + i, i * 0x111
+ENDR
+after:
+    MOVE COLOR01,0""")
+        self.assertEqual([0x2c01, 0xfffe, 0x180, 0, 0x2d01, 0xfffe, 0x180, 0x111,
+                          0x2e01, 0xfffe, 0x180, 0x222, 0x182, 0], words)
+        self.assertEqual({'after': 13}, indexes)
+
+    def test_large_list(self):
+        """a list of 256 gradient lines per REPEAT is generated in one pass"""
+        words, _ = self.compile("""
+REPEAT 100
+  REPEAT 256,i
+    WAIT 0,i
+    MOVE COLOR00,i & 0xfff
+  ENDR
+ENDR""")
+        self.assertEqual(100 * 256 * 4, len(words))
+        self.assertEqual([0xff01, 0xfffe, 0x180, 0xff], words[-4:])
+
+    def test_literal_list_speed(self):
+        """a list of a few thousand literal lines compiles in milliseconds"""
+        lines = []
+        for line in range(4096):
+            lines += ["WAIT 0,%d" % (line & 0xff), "MOVE COLOR00,0x%03x" % (line & 0xfff)]
+        seconds = min(timeit.repeat(lambda: compile_clist.compile_source(lines), number=1, repeat=3))
+        self.assertLess(seconds, 0.25)
+
+    def test_errors(self):
+        """invalid sources are rejected"""
+        for source in ["MOVE COLOR00,__import__('os')", "MOVE COLOR00,0x10000", "WAIT 0,256",
+                       "REPEAT 2,i\nlabel:\nENDR", "REPEAT 2", "ENDR", "X = 1\nREPEAT 2\nX = X + 1\nENDR",
+                       "unknown 1", "MOVE COLOR00", "REPEAT 2,i\nREPEAT i\nENDR\nENDR",
+                       "a:\na:"]:
+            self.assertRaises(Exception, self.compile, source)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CompileClistTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
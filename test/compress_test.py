@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""compress_test.py
+"""
+import random
+import unittest
+from ratr0.util import compress
+
+
+class CompressTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the compression codecs"""
+
+    def setUp(self):
+        rand = random.Random(7)
+        # level like data: long runs with some noise
+        self.values = []
+        while len(self.values) < 4000:
+            self.values.extend([rand.randrange(1, 20)] * rand.randrange(1, 300))
+        self.values = self.values[:4000]
+
+    def test_rle_encode(self):
+        """runs are split at row boundaries"""
+        self.assertEqual(bytes([3, 1, 1, 1, 1, 2]),
+                         compress.rle_encode([1, 1, 1, 1, 2], 3))
+
+    def test_rle_long_run(self):
+        """runs longer than 255 are split"""
+        self.assertEqual(bytes([255, 5, 45, 5]), compress.rle_encode([5] * 300, 300))
+
+    def test_rle_roundtrip(self):
+        for value_size in [1, 2]:
+            payload = compress.rle_encode(self.values, 100, value_size)
+            self.assertEqual(self.values,
+                             compress.rle_decode(payload, len(self.values), value_size).tolist())
+
+    def test_lz_encode(self):
+        """repeated sequences become matches"""
+        self.assertEqual(bytes([2, 1, 2, 3, 0x80 + 3, 0, 3]),
+                         compress.lz_encode(bytes([1, 2, 3] * 3)))
+
+    def test_lz_roundtrip(self):
+        for data in [b'', b'a', b'ab', bytes(self.values), bytes(range(256)) * 3,
+                     bytes([random.Random(3).randrange(4) for _ in range(5000)])]:
+            self.assertEqual(data, compress.lz_decode(compress.lz_encode(data), len(data)))
+
+    def test_byterun1_encode(self):
+        """short runs are merged into literal runs, which end at row boundaries"""
+        self.assertEqual(bytes([0xfd, 0, 3, 1, 2, 3, 3, 0, 4]),
+                         compress.byterun1_encode(bytes([0, 0, 0, 0, 1, 2, 3, 3, 4]), 8))
+        self.assertEqual(bytes([0x81, 5, 0x81, 5, 0xff, 5]),
+                         compress.byterun1_encode(bytes([5] * 258), 258))
+
+    def test_byterun1_roundtrip(self):
+        rand = random.Random(5)
+        for data in [b'', b'a', bytes(self.values), bytes(range(256)) * 3,
+                     bytes([rand.choice([0, 0, 0, 1, rand.randrange(256)]) for _ in range(5000)])]:
+            self.assertEqual(data, compress.byterun1_decode(compress.byterun1_encode(data, 40),
+                                                            len(data)))
+
+    def test_encode_decode(self):
+        """data with long runs gets smaller with every codec"""
+        for codec in [compress.CODEC_RLE, compress.CODEC_LZ, compress.CODEC_BYTERUN1]:
+            payload = compress.encode(codec, self.values, 100)
+            self.assertLess(len(payload), len(self.values))
+            self.assertEqual(self.values, compress.decode(codec, payload, len(self.values)).tolist())
+
+    def test_decode_cycles(self):
+        """the cost model counts runs and tokens"""
+        self.assertEqual(2 * compress.RLE_CYCLES_PER_RUN + 5 * compress.RLE_CYCLES_PER_BYTE,
+                         compress.decode_cycles(compress.CODEC_RLE, bytes([3, 1, 2, 2])))
+        self.assertEqual(2 * compress.LZ_CYCLES_PER_TOKEN + 3 * compress.LZ_CYCLES_PER_LITERAL +
+                         compress.LZ_CYCLES_PER_MATCH + 6 * compress.LZ_CYCLES_PER_MATCH_BYTE,
+                         compress.decode_cycles(compress.CODEC_LZ, bytes([2, 1, 2, 3, 0x83, 0, 3])))
+        self.assertEqual(compress.BYTERUN1_CYCLES_PER_REPEAT_RUN + 4 * compress.BYTERUN1_CYCLES_PER_REPEAT_BYTE +
+                         compress.BYTERUN1_CYCLES_PER_LITERAL_RUN + 2 * compress.BYTERUN1_CYCLES_PER_LITERAL,
+                         compress.decode_cycles(compress.CODEC_BYTERUN1, bytes([0xfd, 0, 1, 1, 2])))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CompressTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
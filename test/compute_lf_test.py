@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""compute_lf_test.py
+"""
+import unittest
+from ratr0.util import compute_lf, dma
+
+
+class ComputeLFTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the minterm compiler and the blit planner"""
+
+    def test_channels(self):
+        """single channels give the channel values"""
+        self.assertEqual(0xf0, compute_lf.compute_lf('A'))
+        self.assertEqual(0x33, compute_lf.compute_lf('b'))
+        self.assertEqual(0x55, compute_lf.compute_lf('~C'))
+        self.assertEqual(0xff, compute_lf.compute_lf('1'))
+
+    def test_notations(self):
+        """the cookie cut in the different notations"""
+        for expr in ['AB + aC', 'AB|~AC', 'A & B | !A & C', 'A*B + (~A)C']:
+            self.assertEqual(0xca, compute_lf.compute_lf(expr))
+
+    def test_precedence(self):
+        """AND binds tighter than XOR, XOR tighter than OR"""
+        self.assertEqual((0xf0 & 0xcc) ^ 0xaa | 0x0f, compute_lf.compute_lf('AB ^ C | a'))
+
+    def test_minterms(self):
+        self.assertEqual([7], compute_lf.parse_expression('ABC'))
+        self.assertEqual([0, 1], compute_lf.parse_expression('ab'))
+
+    def test_invalid(self):
+        for expr in ['A +', '(A', 'D', 'A B)']:
+            self.assertRaises(Exception, compute_lf.compute_lf, expr)
+
+    def test_used_channels(self):
+        """only the channels that change the result are used"""
+        self.assertEqual('', compute_lf.used_channels(0x00))
+        self.assertEqual('A', compute_lf.used_channels(0xf0))
+        self.assertEqual('AC', compute_lf.used_channels(compute_lf.compute_lf('A ^ C')))
+        self.assertEqual('C', compute_lf.used_channels(compute_lf.compute_lf('AC + aC')))
+
+    def test_plans(self):
+        """the planned channels and BLTCON0 values of the common operations"""
+        self.assertEqual('D', compute_lf.plan_operation('clear').channels)
+        self.assertEqual(0x0100, compute_lf.plan_operation('clear').bltcon0)
+        self.assertEqual(0x09f0, compute_lf.plan_operation('copy').bltcon0)
+        self.assertEqual(0x4fca, compute_lf.plan_operation('cookie-cut', 4).bltcon0)
+        self.assertEqual(0x4000, compute_lf.plan_operation('cookie-cut', 4).bltcon1)
+        self.assertEqual('ACD', compute_lf.plan_operation('xor').channels)
+
+    def test_bob_cycles(self):
+        """a cookie cut and a restore cost what the DMA model assumes"""
+        cookie_cut = compute_lf.plan_operation('cookie-cut', 1)
+        copy = compute_lf.plan_operation('copy')
+        self.assertEqual(dma.BOB_DRAW_RESTORE_CYCLES,
+                         cookie_cut.cycles_per_word + copy.cycles_per_word)
+        self.assertEqual(dma.bob_dma_cycles(32, 16, 4),
+                         cookie_cut.blit_cycles(32, 16, 4, True) + copy.blit_cycles(32, 16, 4, True))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ComputeLFTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+"""coplist_test.py
+"""
+import os
+import tempfile
+import unittest
+from ratr0.util import coplist, compile_clist, file_info
+
+SOURCE = """
+    MOVE FMODE,0
+colors:
+    MOVE COLOR00,1
+    MOVE BPL1PTH,0
+    MOVE SPR3PTH,0
+    MOVE BPL1PTL,0
+    MOVE SPR3PTL,0
+    END"""
+
+
+class CopperListTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for RATR0 copper list files"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'list.cop')
+        self.words, self.indexes = compile_clist.compile_source(SOURCE.strip().split('\n'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_relocations(self):
+        """pointer high words are paired with the next low word"""
+        relocations = coplist.find_relocations(self.words)
+        self.assertEqual([(5, 9, 0x0e0, 0), (7, 11, 0x12c, 11)], relocations.tolist())
+
+    def test_missing_low_word(self):
+        """a pointer without low word can not be relocated"""
+        self.assertRaises(Exception, coplist.find_relocations, [0xe0, 0])
+
+    def test_roundtrip(self):
+        """the loader memory-maps the file and patches the pointers"""
+        coplist.write_coplist(self.words, self.indexes, self.path)
+        with coplist.CopperList.open(self.path) as copper_list:
+            self.assertEqual(self.words, copper_list.words.tolist())
+            self.assertEqual({'colors': 3}, copper_list.labels)
+            words = copper_list.patched({0: 0x12345678, 11: 0x00abcdef})
+            self.assertEqual([0x1234, 0x00ab, 0x5678, 0xcdef], words[[5, 7, 9, 11]].tolist())
+        self.assertEqual(file_info.VERIFY_OK, file_info.verify_file(self.path)[1])
+
+    def test_truncated(self):
+        """truncated files are rejected"""
+        coplist.write_coplist(self.words, self.indexes, self.path)
+        with open(self.path, 'rb') as infile:
+            data = infile.read()
+        self.assertRaises(ValueError, coplist.CopperList, data[:-2])
+        self.assertEqual(file_info.VERIFY_FAILED, file_info.verify_buffer(data[:-2])[0])
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CopperListTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""dma_test.py
+"""
+import io
+import os
+import tempfile
+import unittest
+from PIL import Image
+from ratr0.util import dma, sprites
+
+
+class DmaTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the DMA budget model"""
+
+    def test_single(self):
+        """the values of a single parameter set"""
+        result = dma.evaluate({'num_sprites': 2, 'copper_moves': 30, 'scrolling': 1})
+        self.assertEqual(21504, result['display_dma_cycles'])
+        self.assertEqual(46676, result['free_dma_cycles'])
+        self.assertAlmostEqual(46676 / (6 * 3 * 32 * 4), result['bobs_dr'])
+        self.assertAlmostEqual(46676 / (8 * 3 * 32 * 4), result['bobs_sdr'])
+
+    def test_sweep(self):
+        """all combinations are evaluated, the same as one by one"""
+        table = dma.sweep(bob_width=[16, 32, 48], num_planes=[3, 4], audio_channels=[0, 4])
+        self.assertEqual(12, len(table['bobs_dr']))
+        for i in range(12):
+            params = {name: table[name][i] for name in dma.DEFAULT_PARAMETERS}
+            self.assertAlmostEqual(dma.evaluate(params)['bobs_dr'], table['bobs_dr'][i])
+        self.assertRaises(Exception, dma.sweep, bob_depth=[1])
+
+    def test_csv(self):
+        """the CSV output has a header and a row per combination"""
+        out = io.StringIO()
+        dma.write_csv(dma.sweep(bob_height=[16, 32]), out)
+        lines = out.getvalue().strip().split('\n')
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('bob_width,bob_height'))
+
+    def test_inputs(self):
+        """copper lists and sprite sheets as inputs"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            clist = os.path.join(tmpdir, 'clist.txt')
+            with open(clist, 'w') as out:
+                out.write("MOVE COLOR00,0\nWAIT 0,0x2c\nMOVE COLOR00,1\nEND\n")
+            self.assertEqual((2, 2), dma.copper_load(clist))
+            im = Image.new('P', (16, 8))
+            im.putpalette([0, 0, 0] * 16)
+            im.putdata([i % 16 for i in range(128)])
+            path = os.path.join(tmpdir, 'sprite.spr')
+            sprites.write_sprites(im, path, False, False)
+            self.assertEqual(2, dma.sprite_channels(path))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(DmaTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
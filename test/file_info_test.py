@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""file_info_test.py
+"""
+import io
+import os
+import tempfile
+import unittest
+from PIL import Image
+from ratr0.util import file_info, checksum, tiles, sprites, levels, compress
+
+
+class ChecksumTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the checksum module"""
+
+    def test_incremental(self):
+        """streaming the data in pieces gives the checksum of the whole file"""
+        data = bytes(range(256)) * 10
+        for bits in [16, 32]:
+            out = io.BytesIO()
+            writer = checksum.ChecksumWriter(out, bits)
+            writer.writelines([bytes(bits // 8), data[:100], data[100:]])
+            writer.patch(0)
+            self.assertEqual(writer.checksum.value,
+                             checksum.file_checksum(out.getvalue(), 0, bits))
+            self.assertEqual(writer.checksum.to_bytes(), out.getvalue()[:bits // 8])
+
+
+class VerifyTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the verification of RATR0 files"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.im = Image.new('P', (32, 16))
+        self.im.putpalette([0, 0, 0, 255, 255, 255, 255, 0, 0, 0, 255, 0])
+        self.im.putdata([(x // 4 + y) % 4 for y in range(16) for x in range(32)])
+        self.colors = [[0, 0, 0], [255, 255, 255], [255, 0, 0], [0, 255, 0]]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def write_files(self):
+        tiles.write_tiles(self.im, self.path('a.til'), (16, 16), self.colors, False,
+                          False, True, False)
+        tiles.write_tiles(self.im, self.path('b.til'), (16, 16), self.colors, True,
+                          True, True, False, compress.CODEC_BYTERUN1)
+        sprites.write_sprites(self.im, self.path('c.spr'), False, False)
+        level = {'width': 4, 'height': 2, 'map': [1, 2, 3, 4, 5, 6, 7, 8]}
+        levels.write_level(level, self.path('d.lvl'), False)
+        levels.write_level(level, self.path('e.lvl'), False, compress.CODEC_LZ, 2)
+        return [self.path(name) for name in ['a.til', 'b.til', 'c.spr', 'd.lvl', 'e.lvl']]
+
+    def test_verify_ok(self):
+        """all writers produce files with valid checksums"""
+        for path, result, message in file_info.verify_files(self.write_files()):
+            self.assertEqual(file_info.VERIFY_OK, result, "%s: %s" % (path, message))
+
+    def test_verify_corrupted(self):
+        """a flipped bit anywhere in the file is detected"""
+        for path in self.write_files():
+            with open(path, 'rb') as infile:
+                data = bytearray(infile.read())
+            data[-1] ^= 0x01
+            with open(path, 'wb') as out:
+                out.write(data)
+            self.assertEqual(file_info.VERIFY_FAILED, file_info.verify_file(path)[1], path)
+
+    def test_verify_truncated(self):
+        """truncated files fail the size check"""
+        for path in self.write_files():
+            with open(path, 'rb') as infile:
+                data = infile.read()
+            with open(path, 'wb') as out:
+                out.write(data[:-2])
+            result, message = file_info.verify_file(path)[1:]
+            self.assertEqual(file_info.VERIFY_FAILED, result, path)
+            self.assertTrue(message.startswith('file size'), message)
+
+    def test_verify_no_checksum(self):
+        """files without a checksum are only checked for their size"""
+        path = self.path('a.til')
+        tiles.write_tiles(self.im, path, (16, 16), self.colors, False, False, False, False)
+        with open(path, 'r+b') as out:
+            out.seek(9)
+            flags = out.read(1)[0]
+            out.seek(9)
+            out.write(bytes([flags & ~tiles.FLAG_CHECKSUM]))
+        self.assertEqual(file_info.VERIFY_NO_CHECKSUM, file_info.verify_file(path)[1])
+
+    def test_verify_unknown(self):
+        """other files fail"""
+        path = self.path('x.png')
+        self.im.save(path)
+        self.assertEqual(file_info.VERIFY_FAILED, file_info.verify_file(path)[1])
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ChecksumTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(VerifyTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
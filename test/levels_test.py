@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""levels_test.py
+"""
+import os
+import tempfile
+import unittest
+from ratr0.util import levels, file_info, compress
+
+
+class LevelsTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the level writer"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.outfile = os.path.join(self.tmpdir.name, 'level.lvl')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_level(self):
+        with open(self.outfile, 'rb') as infile:
+            self.assertEqual(b'RATR0LVL', infile.read(8))
+            info = file_info.read_level_info(infile)
+            return info, infile.read()
+
+    def test_write_level(self):
+        """8 bit tile numbers and the viewport are stored"""
+        level = {"width": 3, "height": 2, "map": [1, 2, 3, 4, 5, 6],
+                 "viewport": {"x": 1, "y": 0, "width": 2, "height": 1}}
+        levels.write_level(level, self.outfile, False)
+        info, data = self.read_level()
+        self.assertEqual(levels.FILE_FORMAT_VERSION, info.version)
+        self.assertEqual((3, 2), (info.width, info.height))
+        self.assertEqual((2, 1, 0, 1), (info.vp_width, info.vp_height,
+                                        info.init_vp_row, info.init_vp_col))
+        self.assertEqual(8, info.tile_num_bits)
+        self.assertEqual(bytes([1, 2, 3, 4, 5, 6]), data)
+
+    def test_write_level_16bit(self):
+        """large tile numbers switch to 16 bit"""
+        level = {"width": 2, "height": 1, "map": [1, 300]}
+        levels.write_level(level, self.outfile, False)
+        info, data = self.read_level()
+        self.assertEqual(16, info.tile_num_bits)
+        self.assertEqual((2, 1), (info.vp_width, info.vp_height))
+        self.assertEqual(bytes([0, 1, 1, 44]), data)
+
+    def test_write_level_compressed(self):
+        """compressed 16 bit levels"""
+        level = {"width": 4, "height": 1, "map": [1, 1, 1, 300]}
+        levels.write_level(level, self.outfile, False, codec=compress.CODEC_RLE)
+        info, data = self.read_level()
+        self.assertEqual('rle', info.compression)
+        self.assertEqual([1, 1, 1, 300], compress.decode(info.codec, data, 4, 2).tolist())
+
+    def test_column_layout(self):
+        """columns are read from their strip"""
+        level = {"width": 5, "height": 3, "map": list(range(1, 16))}
+        for codec in compress.CODEC_NAMES:
+            levels.write_level(level, self.outfile, False, codec=codec, strip_width=2)
+            info, data = self.read_level()
+            self.assertTrue(info.flags & levels.FLAG_COLUMNS)
+            self.assertEqual(2, info.strip_width)
+            with open(self.outfile, 'rb') as infile:
+                for column in range(5):
+                    self.assertEqual([column + 1, column + 6, column + 11],
+                                     levels.read_column(infile, column).tolist())
+
+    def test_column_major(self):
+        """a strip width of 1 stores the level column-major"""
+        level = {"width": 2, "height": 2, "map": [1, 2, 3, 4]}
+        levels.write_level(level, self.outfile, False, strip_width=1)
+        info, data = self.read_level()
+        self.assertEqual(bytes([0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 0, 4, 1, 3, 2, 4]), data)
+
+    def test_flipped_tiles(self):
+        """Tiled flip flags are rejected"""
+        level = {"width": 2, "height": 1, "map": [1, 0x80000001]}
+        self.assertRaises(Exception, levels.write_level, level, self.outfile, False)
+
+    def test_map_size(self):
+        """the map has to match the level size"""
+        level = {"width": 2, "height": 2, "map": [1, 2, 3]}
+        self.assertRaises(Exception, levels.write_level, level, self.outfile, False)
+
+    def test_tile_number_too_large(self):
+        """tile numbers have to fit into 16 bits"""
+        level = {"width": 1, "height": 1, "map": [65536]}
+        self.assertRaises(Exception, levels.write_level, level, self.outfile, False)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(LevelsTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""optimize_clist_test.py
+"""
+import unittest
+from ratr0.util import compile_clist, optimize_clist
+
+
+class OptimizeClistTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the copper list optimizer"""
+
+    def optimize(self, source):
+        words, indexes = compile_clist.compile_source(source.strip().split('\n'))
+        return optimize_clist.optimize_clist(words, indexes)
+
+    def test_redundant_moves(self):
+        """MOVEs of the value a register already has are removed, pointers are kept"""
+        words, _, _ = self.optimize("""
+WAIT 0,0x30
+MOVE COLOR00,1
+MOVE BPL1PTH,0
+WAIT 0,0x40
+MOVE COLOR00,1
+MOVE BPL1PTH,0
+END""")
+        self.assertEqual([0x3001, 0xfffe, 0x180, 1, 0xe0, 0, 0x4001, 0xfffe, 0xe0, 0, 0xffff, 0xfffe],
+                         words)
+
+    def test_dead_moves(self):
+        """overwritten MOVEs are only removed in the vertical blank"""
+        words, _, _ = self.optimize("""
+MOVE COLOR00,1
+MOVE COLOR00,2
+WAIT 0,0x30
+MOVE COLOR01,1
+MOVE COLOR01,2""")
+        self.assertEqual([0x180, 2, 0x3001, 0xfffe, 0x182, 1, 0x182, 2], words)
+
+    def test_waits(self):
+        """consecutive and satisfied WAITs are merged, END removes the rest"""
+        words, _, warnings = self.optimize("""
+WAIT 0,0x30
+WAIT 0,0x40
+MOVE COLOR00,1
+WAIT 0,0x38
+MOVE COLOR01,1
+WAIT 0,0x40
+MOVE COLOR02,1
+END
+MOVE COLOR00,2""")
+        self.assertEqual([0x4001, 0xfffe, 0x180, 1, 0x182, 1, 0x184, 1, 0xffff, 0xfffe], words)
+        self.assertEqual(1, len(warnings))
+
+    def test_wrap(self):
+        """the WAIT for the end of line 255 is kept"""
+        words, _, _ = self.optimize("""
+WAIT 0x6f,0xff
+WAIT 0,0x10
+MOVE COLOR00,1""")
+        self.assertEqual([0xffdf, 0xfffe, 0x1001, 0xfffe, 0x180, 1], words)
+
+    def test_labels(self):
+        """labelled instructions are kept and the indexes adjusted"""
+        words, indexes, _ = self.optimize("""
+MOVE COLOR00,1
+MOVE COLOR00,1
+color:
+MOVE COLOR00,1
+MOVE COLOR00,1""")
+        self.assertEqual([0x180, 1, 0x180, 1, 0x180, 1], words)
+        self.assertEqual({'color': 3}, indexes)
+
+    def test_scanline_cycles(self):
+        """MOVEs cost 2 cycles and WAITs 3 in the line they wait for"""
+        words, _ = compile_clist.compile_source(
+            ["MOVE COLOR00,0", "WAIT 0,0x30", "MOVE COLOR00,1", "MOVE COLOR01,1",
+             "WAIT 0x6f,0xff", "WAIT 0,0x10", "END"])
+        self.assertEqual([(0, 1, 0, 2), (0x30, 2, 1, 7), (0xff, 0, 1, 3), (0x110, 0, 2, 6)],
+                         optimize_clist.scanline_cycles(words))
+        report = optimize_clist.timing_report(words, 6)
+        self.assertTrue(report[2].endswith('> 6'))
+        self.assertEqual("total: 18 cycles, 1 lines over the budget of 6 cycles", report[-1])
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(OptimizeClistTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
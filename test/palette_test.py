@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""palette_test.py
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from ratr0.util import palette, png_util, tiles, sprites
+
+
+class SharedPaletteTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the shared palette"""
+
+    def setUp(self):
+        # an indexed image with a dark blue background and 2 colors
+        self.indexed = Image.new('P', (32, 16))
+        self.indexed.putpalette([0, 0, 0x88, 0xff, 0, 0, 0, 0xff, 0])
+        self.indexed.putdata([(x // 8) % 3 for y in range(16) for x in range(32)])
+        # a truecolor image with transparent pixels and 2 other colors
+        rgba = np.zeros((16, 32, 4), dtype=np.uint8)
+        rgba[:, 8:16] = [0xff, 0, 0, 0xff]
+        rgba[:, 16:] = [0xff, 0xff, 0xff, 0xff]
+        self.truecolor = Image.fromarray(rgba, 'RGBA')
+
+    def test_identical_palettes(self):
+        """all images get the same palette and keep their colors"""
+        remapped = palette.remap_images([self.indexed, self.truecolor], 2)
+        palettes = [png_util.make_colors(im, None, False) for im in remapped]
+        self.assertEqual(palettes[0], palettes[1])
+        self.assertEqual(4, len(palettes[0]))
+        # color 0 is the background color of the indexed image
+        self.assertEqual([0, 0, 0x88], palettes[0][0])
+        for im, original in zip(remapped, [self.indexed, self.truecolor]):
+            indexes = np.asarray(im)
+            colors = np.array(palettes[0])[indexes]
+            expected = np.asarray(original.convert('RGB'))
+            opaque = indexes != 0
+            self.assertTrue((colors[opaque] == expected[opaque]).all())
+        # color 0 stays color 0, transparent pixels become color 0
+        self.assertTrue((np.asarray(remapped[0])[:, :8] == 0).all())
+        self.assertTrue((np.asarray(remapped[1])[:, :8] == 0).all())
+        self.assertTrue((np.asarray(remapped[1])[:, 8:] != 0).all())
+
+    def test_reduces_colors(self):
+        """more colors than palette entries are clustered"""
+        rgb = np.random.default_rng(1).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+        remapped = palette.remap_images([Image.fromarray(rgb, 'RGB'), self.indexed], 3)
+        self.assertLess(np.asarray(remapped[0]).max(), 8)
+        self.assertEqual(remapped[0].getpalette(), remapped[1].getpalette())
+
+    def test_write_files(self):
+        """tile and sprite sheets written from the remapped images have the same palette"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tiles_path = os.path.join(tmpdir, 'a.ts')
+            sprites_path = os.path.join(tmpdir, 'b.spr')
+            tile_im, sprite_im = palette.remap_images([self.indexed, self.truecolor], 2)
+            tiles.write_tiles(tile_im, tiles_path, (16, 16), png_util.make_colors(tile_im, None, False),
+                              False, False, False, False)
+            sprites.write_sprites(sprite_im, sprites_path, False, False)
+            with tiles.TileSheet.open(tiles_path) as sheet:
+                tile_palette = sheet.info.palette
+            with open(sprites_path, 'rb') as infile:
+                infile.read(8)
+                info = sprites.read_sprite_info(infile)
+                infile.read(2 * info.num_sprites)
+                sprite_palette = np.frombuffer(infile.read(2 * info.num_colors), dtype='>u2').tolist()
+            self.assertEqual(tile_palette, sprite_palette)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(SharedPaletteTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""planar_test.py
+"""
+import unittest
+import numpy as np
+from ratr0.util.planar import PlanarImage
+
+
+class PlanarImageTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for PlanarImage"""
+
+    def setUp(self):
+        # 2 planes, 2 rows, 32 pixels wide
+        self.image = PlanarImage.from_planes([[1, 2, 3, 4], [5, 6, 7, 8]], 32, 2)
+
+    def test_dimensions(self):
+        """the dimensions are derived from the buffer"""
+        self.assertEqual(2, self.image.depth)
+        self.assertEqual(2, self.image.height)
+        self.assertEqual(2, self.image.words_per_row)
+        self.assertEqual(16, self.image.nbytes)
+
+    def test_views(self):
+        """planes, rows and tiles are views into the same buffer"""
+        self.assertEqual([[5, 6], [7, 8]], self.image.plane(1).tolist())
+        self.assertEqual([[3, 4], [7, 8]], self.image.row(1).tolist())
+        tile = self.image.tile(1, 0, 16, 2)
+        self.assertEqual([[[2], [4]], [[6], [8]]], tile.data.tolist())
+        self.assertTrue(np.shares_memory(self.image.data, tile.data))
+
+    def test_tile_width_not_multiple_of_16(self):
+        """tiles have to be word aligned"""
+        self.assertRaises(ValueError, self.image.tile, 0, 0, 8, 2)
+
+    def test_tobytes(self):
+        """the data is written as big endian words in both layouts"""
+        self.assertEqual(bytes([0, 1, 0, 2, 0, 3, 0, 4, 0, 5, 0, 6, 0, 7, 0, 8]),
+                         self.image.tobytes(interleaved=False))
+        self.assertEqual(bytes([0, 1, 0, 2, 0, 5, 0, 6, 0, 3, 0, 4, 0, 7, 0, 8]),
+                         self.image.tobytes(interleaved=True))
+
+    def test_mask(self):
+        """the mask is the bitwise or of all planes, repeated depth times"""
+        mask = self.image.mask(2)
+        self.assertEqual([[[5, 6], [7, 12]], [[5, 6], [7, 12]]], mask.data.tolist())
+
+    def test_with_depth(self):
+        """additional planes are empty"""
+        image = self.image.with_depth(3)
+        self.assertEqual(3, image.depth)
+        self.assertEqual([[0, 0], [0, 0]], image.plane(2).tolist())
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(PlanarImageTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -78,6 +78,22 @@ class PNGUtilTest(unittest.TestCase):  # pylint: disable-msg=R0904
         self.assertEqual(2, map_words_per_row)
         self.assertEqual([[65535, 0, 65535, 0]], planes)
 
+    def test_extract_planes_2_17by1(self):
+        """an image that is not a multiple of 16 wide gets padded with 0 bits"""
+        im = MockImage((17, 1), [3] + [0] * 15 + [2])
+        planes, map_words_per_row = png_util.extract_planes(im, 2, False)
+        self.assertEqual(2, map_words_per_row)
+        self.assertEqual([[0x8000, 0], [0x8000, 0x8000]], planes)
+
+    def test_extract_planes_array(self):
+        """the array version stores the words as depth x height x words"""
+        im = MockImage((16, 2), ([5] * 16) + ([2] * 16))
+        planes, map_words_per_row = png_util.extract_planes_array(im, 3, False)
+        self.assertEqual(1, map_words_per_row)
+        self.assertEqual((3, 2, 1), planes.shape)
+        self.assertEqual([[[65535], [0]], [[0], [65535]], [[65535], [0]]],
+                         planes.tolist())
+
 
 if __name__ == '__main__':
     SUITE = []
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""profiling_test.py
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import unittest
+from PIL import Image
+from ratr0.util import profiling, png_util
+
+
+class ProfilerTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for Profiler"""
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_nested_stages(self):
+        """nested stages are recorded with their depth, the outer peak includes the inner"""
+        profiler = profiling.enable(tool='test')
+        with profiling.stage('outer'):
+            with profiling.stage('inner'):
+                data = bytearray(1 << 20)
+            del data
+        profiling.disable()
+        inner, outer = profiler.records
+        self.assertEqual(('inner', 1, 'test'), (inner['stage'], inner['depth'], inner['tool']))
+        self.assertEqual(('outer', 0), (outer['stage'], outer['depth']))
+        self.assertGreaterEqual(inner['peak_memory'], 1 << 20)
+        self.assertGreaterEqual(outer['peak_memory'], inner['peak_memory'])
+        self.assertGreaterEqual(outer['wall'], inner['wall'])
+
+    def test_disabled(self):
+        """without a profiler, stages and profiled functions do nothing"""
+        profiled_sum = profiling.profiled('sum')(sum)
+        with profiling.stage('nothing'):
+            self.assertEqual(6, profiled_sum([1, 2, 3]))
+        profiler = profiling.enable()
+        self.assertEqual(6, profiled_sum([1, 2, 3]))
+        profiling.disable()
+        self.assertEqual(['sum'], [record['stage'] for record in profiler.records])
+
+    def test_library_stages(self):
+        """the conversion functions are recorded as stages"""
+        im = Image.new('P', (32, 8))
+        im.putpalette([0, 0, 0, 255, 255, 255, 255, 0, 0, 0, 255, 0])
+        profiler = profiling.enable(trace_memory=False)
+        png_util.make_colors(im, None, False)
+        png_util.extract_planar_image(im, 2, False)
+        profiling.disable()
+        self.assertEqual(['make_colors', 'extract_planes'],
+                         [record['stage'] for record in profiler.records])
+        self.assertEqual(0, profiler.records[0]['peak_memory'])
+
+    def test_add_records(self):
+        """records of a worker are nested into the current stage"""
+        profiler = profiling.Profiler(tool='main')
+        with profiler.stage('total'):
+            profiler.add_records([{'stage': 'asset', 'depth': 0, 'start': 0.0, 'wall': 1.0,
+                                   'cpu': 1.0, 'peak_memory': 0, 'asset': 'a.png'}])
+        self.assertEqual(('asset', 1, 'main'), (profiler.records[0]['stage'],
+                                                 profiler.records[0]['depth'],
+                                                 profiler.records[0]['tool']))
+
+    def test_summary(self):
+        """the summary adds up the calls of a stage"""
+        records = [{'stage': 'total', 'depth': 0, 'start': 0.0, 'wall': 3.0, 'cpu': 2.0,
+                    'peak_memory': 4096},
+                   {'stage': 'write', 'depth': 1, 'start': 0.5, 'wall': 1.0, 'cpu': 0.5,
+                    'peak_memory': 1024},
+                   {'stage': 'write', 'depth': 1, 'start': 1.5, 'wall': 1.0, 'cpu': 0.5,
+                    'peak_memory': 2048}]
+        lines = profiling.summary(records)
+        self.assertEqual(3, len(lines))
+        self.assertEqual(['total', '1', '3.0000', '2.0000', '4.0'], lines[1].split())
+        self.assertEqual(['write', '2', '2.0000', '1.0000', '2.0'], lines[2].split())
+        self.assertTrue(lines[2].startswith('  write'))
+
+
+class SessionTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the profiling options of the tools"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.parser = argparse.ArgumentParser()
+        profiling.add_arguments(self.parser)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_no_profile(self):
+        """without the options, nothing is profiled"""
+        with profiling.session(self.parser.parse_args([]), 'tool') as profiler:
+            self.assertIsNone(profiler)
+
+    def test_json_lines(self):
+        """the records are appended to the JSON lines file"""
+        path = os.path.join(self.tmpdir.name, 'profile.jsonl')
+        for _ in range(2):
+            with profiling.session(self.parser.parse_args(['--profile_json', path]), 'tool'):
+                with profiling.stage('work'):
+                    pass
+        with open(path) as infile:
+            records = [json.loads(line) for line in infile]
+        self.assertEqual(['work', 'total', 'work', 'total'], [record['stage'] for record in records])
+        self.assertEqual({'tool'}, set([record['tool'] for record in records]))
+
+    def test_write_json_lines(self):
+        """each record is a line"""
+        out = io.StringIO()
+        profiling.write_json_lines([{'stage': 'a'}, {'stage': 'b'}], out)
+        self.assertEqual('{"stage": "a"}\n{"stage": "b"}\n', out.getvalue())
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(ProfilerTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(SessionTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""quantize_test.py
+"""
+import unittest
+import numpy as np
+from PIL import Image
+from ratr0.util import quantize, png_util
+
+
+class QuantizeTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the truecolor quantizer"""
+
+    def setUp(self):
+        height, width = 64, 80
+        y, x = np.mgrid[0:height, 0:width]
+        self.rgb = np.stack([x * 255 // width, y * 255 // height,
+                             (x + y) * 255 // (width + height)], axis=-1).astype(np.uint8)
+        self.gradient = Image.fromarray(self.rgb, 'RGB')
+
+    def test_few_colors_exact(self):
+        """images with fewer colors than palette entries keep their 12 bit colors"""
+        im = Image.new('RGB', (8, 2), (0x11, 0x22, 0x33))
+        im.putpixel((3, 1), (0xff, 0x00, 0x88))
+        result = quantize.quantize(im, 2)
+        colors = png_util.make_colors(result, None, False)
+        self.assertEqual(4, len(colors))
+        self.assertEqual([[0x11, 0x22, 0x33], [0xff, 0x00, 0x88]], colors[:2])
+        self.assertEqual(1, result.getpixel((3, 1)))
+
+    def test_palette_size(self):
+        """the palette has 2^depth 12 bit entries for every dither mode"""
+        for dither in quantize.DITHER_MODES:
+            result = quantize.quantize(self.gradient, 4, dither)
+            self.assertEqual('P', result.mode)
+            colors = png_util.make_colors(result, None, False)
+            self.assertEqual(16, len(colors))
+            self.assertTrue(all([component % 17 == 0 for color in colors for component in color]))
+            self.assertLess(np.asarray(result).max(), 16)
+
+    def test_dithering_keeps_average(self):
+        """dithering keeps the average color of an area inside the palette's
+        gamut close to the original"""
+        for dither in [quantize.DITHER_ORDERED, quantize.DITHER_FLOYD_STEINBERG]:
+            result = quantize.quantize(self.gradient, 3, dither)
+            palette = np.array(png_util.make_colors(result, None, False))
+            mapped = palette[np.asarray(result)]
+            area = (slice(24, 40), slice(30, 46))
+            error = np.abs(mapped[area].mean(axis=(0, 1)) - self.rgb[area].mean(axis=(0, 1)))
+            self.assertTrue((error < 16).all(), "%s: %s" % (dither, error))
+
+    def test_alpha(self):
+        """transparent pixels become color 0, which no opaque pixel uses"""
+        rgba = np.dstack([self.rgb, np.full(self.rgb.shape[:2], 255, dtype=np.uint8)])
+        rgba[:8, :8, 3] = 0
+        rgba[8:, :, :3] = 0  # black, but opaque
+        for dither in quantize.DITHER_MODES:
+            indexes = np.asarray(quantize.quantize(Image.fromarray(rgba, 'RGBA'), 3, dither))
+            self.assertTrue((indexes[:8, :8] == 0).all())
+            self.assertTrue((indexes[8:] > 0).all())
+
+    def test_reserve_color0(self):
+        """color 0 can be kept free in images without transparent pixels"""
+        indexes = np.asarray(quantize.quantize(self.gradient, 2, reserve_color0=True))
+        self.assertTrue((indexes > 0).all())
+
+    def test_to_indexed(self):
+        """indexed images are not changed"""
+        im = Image.new('P', (4, 4))
+        self.assertIs(im, quantize.to_indexed(im))
+        self.assertEqual('P', quantize.to_indexed(self.gradient).mode)
+
+    def test_invalid_depth(self):
+        """the depth is checked"""
+        self.assertRaises(Exception, quantize.quantize, self.gradient, 0)
+        self.assertRaises(Exception, quantize.quantize, self.gradient, 9)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(QuantizeTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""spritemux_test.py
+"""
+import unittest
+from ratr0.util import spritemux
+from ratr0.util.spritemux import Placement
+
+
+class SpriteMuxTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the sprite channel planner"""
+
+    def test_reuse_channel(self):
+        """a channel is reused after the end of its sprite and the gap"""
+        placements = [Placement('a', 0, 0, 16), Placement('b', 0, 17, 16), Placement('c', 0, 10, 4)]
+        plan = spritemux.assign_channels(placements)
+        self.assertEqual([(0, 0, 0, False), (0, 1, 0, False), (1, 2, 0, False)], plan.entries)
+        self.assertEqual([], plan.overflows)
+
+    def test_gap(self):
+        """a sprite that starts right after the gap can not reuse the channel"""
+        placements = [Placement('a', 0, 0, 16), Placement('b', 0, 16, 16)]
+        plan = spritemux.assign_channels(placements, reuse_gap=1)
+        self.assertEqual([(0, 0, 0, False), (1, 1, 0, False)], plan.entries)
+
+    def test_attached(self):
+        """attached sprites take an even/odd pair for each column"""
+        placements = [Placement('a', 0, 0, 8), Placement('b', 0, 0, 8, 32, True)]
+        plan = spritemux.assign_channels(placements)
+        self.assertEqual([0, 2, 3, 4, 5], [entry[0] for entry in plan.entries])
+        self.assertEqual([False, False, True, False, True], [entry[3] for entry in plan.entries])
+
+    def test_overflow(self):
+        """sprites that do not find channels for all columns are reported"""
+        placements = [Placement('wide', 0, 0, 8, 112), Placement('a', 0, 0, 8), Placement('b', 0, 2, 8)]
+        plan = spritemux.assign_channels(placements, channels=range(8))
+        self.assertEqual([2], plan.overflows)
+        self.assertEqual(9, plan.max_channels)
+        report = spritemux.overflow_report([plan])
+        self.assertEqual("frame 0: 1 of 3 sprites without a channel, 9 channels needed", report[0])
+
+    def test_channel_table(self):
+        """the table has the frame starts and 5 words per entry"""
+        frames = spritemux.read_frames({'frames': [[{'x': 10, 'y': 5, 'height': 8}], []]})
+        frame_starts, words = spritemux.channel_table(spritemux.plan_frames(frames))
+        self.assertEqual([0, 1, 1], frame_starts)
+        self.assertEqual([0, 0, 10, 5, 8], words)
+
+    def test_read_tiled(self):
+        """object layers of a Tiled map are frames"""
+        data = {'layers': [{'type': 'tilelayer'},
+                           {'type': 'objectgroup', 'objects': [
+                               {'id': 1, 'name': '', 'x': 8, 'y': 40, 'width': 16, 'height': 16,
+                                'gid': 3,
+                                'properties': [{'name': 'attached', 'type': 'bool', 'value': True}]}]}]}
+        frames = spritemux.read_frames(data)
+        self.assertEqual(1, len(frames))
+        self.assertEqual(('object1', 8, 24, True),
+                         (frames[0][0].name, frames[0][0].x, frames[0][0].y, frames[0][0].attached))
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(SpriteMuxTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
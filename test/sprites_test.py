@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""sprites_test.py
+"""
+import os
+import random
+import struct
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+
+from ratr0.util import sprites, png_util, file_info
+from ratr0.util.planar import WORD_TYPE
+
+
+class SpritesTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the sprite sheet writer"""
+
+    def setUp(self):
+        rand = random.Random(3)
+        # 2 rows of 2 frames of 16x8
+        self.im = Image.new('P', (32, 16))
+        self.im.putdata([rand.randrange(4) for _ in range(32 * 16)])
+        self.im.putpalette([0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0, 255])
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def frame_words(self, im, x, y, height, plane):
+        """the words of a plane of the 16 pixel wide frame at x, y"""
+        pixels = np.asarray(im)[y:y + height, x:x + 16].astype(np.int64)
+        bits = (pixels >> plane) & 1
+        return (bits << np.arange(15, -1, -1)).sum(axis=1).tolist()
+
+    def test_structures_grid(self):
+        """frames are ordered by row, then column"""
+        image = png_util.extract_planar_image(self.im, 2, False)
+        structures = sprites.sprite_structures(image, 8, 0)
+        self.assertEqual((4, 10, 2), structures.shape)
+        for i, (x, y) in enumerate([(0, 0), (16, 0), (0, 8), (16, 8)]):
+            self.assertEqual([8, 0], structures[i, 0].tolist())
+            self.assertEqual(self.frame_words(self.im, x, y, 8, 0), structures[i, 1:-1, 0].tolist())
+            self.assertEqual(self.frame_words(self.im, x, y, 8, 1), structures[i, 1:-1, 1].tolist())
+            self.assertEqual([0, 0], structures[i, -1].tolist())
+
+    def test_structures_attached(self):
+        """the attached sprite of a frame follows it"""
+        im = Image.new('P', (16, 4))
+        im.putdata(list(range(16)) * 4)
+        image = png_util.extract_planar_image(im, 4, False)
+        structures = sprites.sprite_structures(image, 4, 0x80)
+        self.assertEqual((2, 6, 2), structures.shape)
+        self.assertEqual([4, 0x80], structures[1, 0].tolist())
+        self.assertEqual(self.frame_words(im, 0, 0, 4, 2), structures[1, 1:-1, 0].tolist())
+        self.assertEqual(self.frame_words(im, 0, 0, 4, 3), structures[1, 1:-1, 1].tolist())
+
+    def test_write_sprites(self):
+        """the file has the offsets, palette and structures in big endian"""
+        path = os.path.join(self.tmpdir.name, 'sprites.spr')
+        sprites.write_sprites(self.im, path, False, False, 8)
+        with open(path, 'rb') as infile:
+            data = infile.read()
+        _, version, flags, _, num_colors, num_sprites, imgdata_size, _ = \
+            struct.unpack(sprites.HEADER_FORMAT, data[:20])
+        self.assertEqual((1, sprites.FLAG_CHECKSUM, 4, 4, 4 * 40),
+                         (version, flags, num_colors, num_sprites, imgdata_size))
+        values = np.frombuffer(data, dtype=WORD_TYPE, offset=20)
+        self.assertEqual([0, 40, 80, 120], values[:4].tolist())
+        self.assertEqual([0x000, 0xf00, 0x0f0, 0x00f], values[4:8].tolist())
+        image = png_util.extract_planar_image(self.im, 2, False)
+        self.assertEqual(sprites.sprite_structures(image, 8, 0).ravel().tolist(),
+                         values[8:].tolist())
+        self.assertEqual(file_info.VERIFY_OK, file_info.verify_file(path)[1])
+
+    def test_c_source(self):
+        """the C source contains the palette and one array per sprite"""
+        path = os.path.join(self.tmpdir.name, 'sprites.c')
+        sprites.write_sprites(self.im, path, False, True, 8)
+        with open(path) as infile:
+            source = infile.read()
+        self.assertTrue(source.startswith("UWORD palette[] = {\n  0x0000, 0x0f00, 0x00f0, 0x000f\n};"))
+        self.assertIn("UWORD __chip sprdata3[] = {\n  0x0008, 0x0000,\n", source)
+        self.assertEqual(4, source.count("  0x0000, 0x0000\n};"))
+
+    def test_invalid_frame_height(self):
+        """the image height has to be a multiple of the frame height"""
+        path = os.path.join(self.tmpdir.name, 'sprites.spr')
+        self.assertRaises(Exception, sprites.write_sprites, self.im, path, False, False, 5)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(SpritesTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+"""tiles_test.py
+"""
+import os
+import random
+import tempfile
+import unittest
+from PIL import Image
+from ratr0.util import tiles, png_util, compress, file_info
+
+
+class TilesInfoTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for TilesInfo"""
+
+    def make_info(self, palette, palette24):
+        return tiles.TilesInfo(tiles.FILE_FORMAT_VERSION, 2 if palette24 else 0,
+                               1, 32, 16, 16, 16, 2, 1, len(palette), 128, 0,
+                               palette, palette24)
+
+    def test_header_bytes(self):
+        """the header is always 32 bytes"""
+        header = self.make_info([0x000, 0xfff], False).header_bytes()
+        self.assertEqual(32, len(header))
+        self.assertEqual(b'RATR0TIL', header[:8])
+        self.assertEqual(bytes([tiles.FILE_FORMAT_VERSION, 0, 0, 1]), header[8:12])
+        self.assertEqual(bytes([0, 0, 0, 128]), header[26:30])
+
+    def test_palette_bytes_12(self):
+        """12 bit palette entries are stored as big endian words"""
+        info = self.make_info([0x000, 0xf0a], False)
+        self.assertEqual(bytes([0, 0, 0x0f, 0x0a]), info.palette_bytes())
+
+    def test_palette_bytes_24(self):
+        """24 bit palette entries are stored as byte triplets"""
+        info = self.make_info([[1, 2, 3], [4, 5, 6]], True)
+        self.assertEqual(bytes([1, 2, 3, 4, 5, 6]), info.palette_bytes())
+
+
+class TileSheetTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for TileSheet"""
+
+    def setUp(self):
+        rand = random.Random(42)
+        self.im = Image.new('P', (64, 32))
+        self.im.putdata([rand.randrange(8) for _ in range(64 * 32)])
+        self.colors = [[i * 32, i * 32, i * 32] for i in range(8)]
+        self.image = png_util.extract_planar_image(self.im, 3, False)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_sheet(self, non_interleaved, palette24=False, codec=compress.CODEC_NONE):
+        path = os.path.join(self.tmpdir.name, 'sheet.til')
+        tiles.write_tiles(self.im, path, (32, 16), self.colors, palette24,
+                          non_interleaved, True, False, codec)
+        return path
+
+    def check_tiles(self, sheet):
+        self.assertEqual(4, sheet.num_tiles)
+        for index in range(4):
+            tile_x, tile_y = index % 2, index // 2
+            expected = self.image.tile(tile_x, tile_y, 32, 16)
+            tile = sheet.tile(index)
+            self.assertEqual(expected.data.tolist(), tile.data.tolist())
+            self.assertEqual(expected.plane(2).tolist(), tile.plane(2).tolist())
+            self.assertEqual(expected.tobytes(interleaved=True), tile.tobytes(interleaved=True))
+            mask = expected.mask(sheet.tile_mask(index).depth)
+            self.assertEqual(mask.data.tolist(), sheet.tile_mask(index).data.tolist())
+
+    def test_interleaved(self):
+        """read the tiles of an interleaved sheet"""
+        with tiles.TileSheet.open(self.write_sheet(False)) as sheet:
+            self.assertTrue(sheet.interleaved)
+            self.assertEqual(3, sheet.tile_mask(0).depth)
+            self.check_tiles(sheet)
+
+    def test_non_interleaved(self):
+        """read the tiles of a non-interleaved sheet"""
+        with tiles.TileSheet.open(self.write_sheet(True)) as sheet:
+            self.assertFalse(sheet.interleaved)
+            self.assertEqual(1, sheet.tile_mask(0).depth)
+            self.check_tiles(sheet)
+
+    def test_palette24(self):
+        """24 bit palettes are parsed"""
+        with tiles.TileSheet.open(self.write_sheet(False, True)) as sheet:
+            self.assertEqual(self.colors, sheet.info.palette)
+            self.check_tiles(sheet)
+
+    def test_compressed(self):
+        """compressed image data is decoded when the sheet is opened"""
+        for codec in [compress.CODEC_BYTERUN1, compress.CODEC_LZ]:
+            for non_interleaved in [False, True]:
+                with tiles.TileSheet.open(self.write_sheet(non_interleaved, codec=codec)) as sheet:
+                    self.assertEqual(codec, sheet.info.codec)
+                    self.assertEqual(0x10, sheet.info.flags & 0x10)
+                    self.check_tiles(sheet)
+
+    def test_compressed_truncated(self):
+        """truncated compressed data is detected"""
+        path = self.write_sheet(False, codec=compress.CODEC_LZ)
+        with open(path, 'rb') as infile:
+            data = infile.read()
+        with open(path, 'wb') as out:
+            out.write(data[:-10])
+        self.assertRaises(ValueError, tiles.TileSheet.open, path)
+
+    def test_compression_report(self):
+        """the report lists the uncompressed size first"""
+        report = tiles.compression_report(self.image, False, True)
+        self.assertEqual(('none', 2 * self.image.nbytes), report[0][:2])
+        self.assertEqual(sorted(compress.CODEC_NAMES.values()), sorted([entry[0] for entry in report]))
+
+    def test_tile_index_out_of_range(self):
+        """tile indexes are checked"""
+        with tiles.TileSheet.open(self.write_sheet(False)) as sheet:
+            self.assertRaises(IndexError, sheet.tile, 4)
+
+
+class CropTableTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for the crop table"""
+
+    def setUp(self):
+        # 4 tiles of 32x8: a pixel in the second word of rows 2 and 5, an
+        # empty tile, a full tile and a single pixel in the first word
+        self.im = Image.new('P', (64, 16))
+        self.im.putpixel((20, 2), 1)
+        self.im.putpixel((31, 5), 3)
+        self.im.paste(2, (0, 8, 32, 16))
+        self.im.putpixel((32 + 15, 15), 1)
+        self.colors = [[i * 64, i * 64, i * 64] for i in range(4)]
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_crop_table(self):
+        """the bounding boxes are in words and rows, empty tiles are 0"""
+        image = png_util.extract_planar_image(self.im, 2, False)
+        self.assertEqual([[1, 2, 1, 4], [0, 0, 0, 0], [0, 0, 2, 8], [0, 7, 1, 1]],
+                         tiles.crop_table(image, (32, 8)).tolist())
+
+    def test_crop_table_tile_width(self):
+        """the tile width has to be a multiple of 16"""
+        image = png_util.extract_planar_image(self.im, 2, False)
+        self.assertRaises(Exception, tiles.crop_table, image, (8, 8))
+
+    def test_sheet(self):
+        """the crop table is read from the sheet and selects the cropped tiles"""
+        path = os.path.join(self.tmpdir.name, 'sheet.til')
+        for codec in [compress.CODEC_NONE, compress.CODEC_LZ]:
+            tiles.write_tiles(self.im, path, (32, 8), self.colors, False, False, True, False,
+                              codec, crop=True)
+            with tiles.TileSheet.open(path) as sheet:
+                self.assertEqual(tiles.FLAG_CROP_TABLE, sheet.info.flags & tiles.FLAG_CROP_TABLE)
+                self.assertEqual((1, 2, 1, 4), sheet.tile_crop(0))
+                cropped = sheet.cropped_tile(0)
+                self.assertEqual((2, 4, 1), cropped.data.shape)
+                self.assertEqual(sheet.tile(0).data[:, 2:6, 1:2].tolist(), cropped.data.tolist())
+                self.assertEqual(0, sheet.cropped_tile(1).height)
+                self.assertEqual([0xffff] * 8, sheet.tile_mask(2).plane(0)[:, 0].tolist())
+
+    def test_no_crop_table(self):
+        """sheets without a crop table raise an error"""
+        path = os.path.join(self.tmpdir.name, 'sheet.til')
+        tiles.write_tiles(self.im, path, (32, 8), self.colors, False, False, True, False)
+        with tiles.TileSheet.open(path) as sheet:
+            self.assertIsNone(sheet.crop_table)
+            self.assertRaises(ValueError, sheet.tile_crop, 0)
+
+    def test_write_mask(self):
+        """the preview mask repeats each row depth times in interleaved mode"""
+        path = os.path.join(self.tmpdir.name, 'mask.png')
+        tiles.write_mask(path, self.im, (32, 8), 2, False, False, False)
+        with Image.open(path) as mask:
+            self.assertEqual((64, 32), mask.size)
+            self.assertEqual(0, mask.getpixel((20, 3)))
+            self.assertEqual(255, mask.getpixel((20, 4)))
+            self.assertEqual(255, mask.getpixel((20, 5)))
+        tiles.write_mask(path, self.im, (32, 8), 2, False, True, False)
+        with Image.open(path) as mask:
+            self.assertEqual((64, 16), mask.size)
+            self.assertEqual(255, mask.getpixel((20, 2)))
+
+
+class PreshiftTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for pre-shifted BOB sheets"""
+
+    def setUp(self):
+        # 2 BOBs of 16x2 with the first and the last pixel of a row set
+        self.im = Image.new('P', (32, 2))
+        for x in [0, 15, 16, 31]:
+            self.im.putpixel((x, 0), 1)
+        self.im.putpixel((17, 1), 2)
+        self.colors = [[i * 64, i * 64, i * 64] for i in range(4)]
+        self.image = png_util.extract_planar_image(self.im, 2, False)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_preshift_tiles(self):
+        """copy k is shifted by k * 16 / shifts pixels into an extra word"""
+        sheet, tile_size = tiles.preshift_tiles(self.image, (16, 2), 4)
+        self.assertEqual((32, 2), tile_size)
+        self.assertEqual(128, sheet.width)
+        self.assertEqual((2, 4, 8), sheet.data.shape)
+        self.assertEqual([0x8001, 0, 0x0800, 0x1000, 0x0080, 0x0100, 0x0008, 0x0010],
+                         sheet.plane(0)[0].tolist())
+        self.assertEqual([0x4000, 0, 0x0400, 0, 0x0040, 0, 0x0004, 0],
+                         sheet.plane(1)[3].tolist())
+
+    def test_invalid_shifts(self):
+        """the number of shifts and the tile width are checked"""
+        self.assertRaises(Exception, tiles.preshift_tiles, self.image, (16, 2), 3)
+        self.assertRaises(Exception, tiles.preshift_tiles, self.image, (8, 2), 2)
+
+    def test_sheet(self):
+        """the shift table selects the copy and the remaining blitter shift"""
+        path = os.path.join(self.tmpdir.name, 'bobs.til')
+        tiles.write_tiles(self.im, path, (16, 2), self.colors, False, False, True, False,
+                          crop=True, shifts=8)
+        with tiles.TileSheet.open(path) as sheet:
+            self.assertEqual(tiles.FLAG_PRESHIFTED, sheet.info.flags & tiles.FLAG_PRESHIFTED)
+            self.assertEqual(16, sheet.num_tiles)
+            self.assertEqual(8, sheet.num_shifts)
+            self.assertEqual([0, 8], sheet.shift_table.tolist())
+            self.assertEqual((13, 1), sheet.shifted_tile_index(1, 43))
+            # the crop table trims the extra word of the unshifted copy, the others need both
+            self.assertEqual((0, 0, 1, 1), sheet.tile_crop(0))
+            self.assertEqual((0, 0, 2, 1), sheet.tile_crop(1))
+            self.assertEqual([0x8001, 0], sheet.tile_mask(0).plane(0)[0].tolist())
+            self.assertRaises(IndexError, sheet.shifted_tile_index, 2, 0)
+        self.assertEqual('ok', file_info.verify_file(path)[1])
+
+    def test_preshift_report(self):
+        """the report compares the memory of the copies with the BOBs and the blitted words"""
+        report = tiles.preshift_report(self.image, (16, 2), 16, True, True)
+        self.assertIn('768 bytes instead of 24', report)
+        self.assertIn('8 for the unshifted copy (use a crop table to trim it), 8 for the shifted',
+                      report)
+        report = tiles.preshift_report(self.image, (16, 2), 16, True, True, crop=True)
+        self.assertIn('4 for the unshifted copy, 8 for the shifted copies, 8 for a shifted blit',
+                      report)
+
+
+class RipTilesTest(unittest.TestCase):  # pylint: disable-msg=R0904
+    """Test class for rip_tiles()"""
+
+    def test_rip_tiles(self):
+        """duplicate tiles are stored once, in order of first occurrence"""
+        im = Image.new('P', (4, 4))
+        im.putdata([1, 1, 2, 2,
+                    1, 1, 2, 2,
+                    2, 2, 1, 1,
+                    2, 2, 3, 3])
+        unique_tiles, tile_map = tiles.rip_tiles(im, (2, 2), False)
+        self.assertEqual([[[1, 1], [1, 1]], [[2, 2], [2, 2]], [[1, 1], [3, 3]]],
+                         unique_tiles.tolist())
+        self.assertEqual([[0, 1], [1, 2]], tile_map.tolist())
+
+    def test_rip_tiles_size_mismatch(self):
+        """the image has to be a multiple of the tile size"""
+        im = Image.new('P', (5, 4))
+        self.assertRaises(Exception, tiles.rip_tiles, im, (2, 2), False)
+
+
+if __name__ == '__main__':
+    SUITE = []
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(TilesInfoTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(TileSheetTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(CropTableTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(PreshiftTest))
+    SUITE.append(unittest.TestLoader().loadTestsFromTestCase(RipTilesTest))
+    unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite(SUITE))